@@ -50,9 +50,8 @@ async def get_main_keyboard_mode(current_model: str = None, user_id: int = None)
     }
     
     # Получаем лимиты пользователя
-    from database.settingsdata import get_table_data
-    static_ai_users = await get_table_data("StaticAIUsers")
-    user_limits = next((user for user in static_ai_users if user.get('chatId') == user_id), None)
+    from database.settingsdata import get_user_data
+    user_limits = await get_user_data("StaticAIUsers", user_id)
     
     # Формируем клавиатуру динамически
     keyboard = []
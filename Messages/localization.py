@@ -16,7 +16,7 @@ MESSAGES = {
             'expiration_date': "📅 Срок действия подписки:"
         },
         'admin': {
-            'help_text': "📋 /allid - Получить список всех ID пользователей\n🔄 /reset [user_id] - Сбросить статистику пользователя\n📊 /state [user_id] - Показать текущее состояние\n🚀 /allboost [user_id] - Активировать все модели с +100 запросами\n\nИспользуйте эти команды для управления системой."
+            'help_text': "📋 /allid - Получить список всех ID пользователей\n🔄 /reset [user_id] - Сбросить статистику пользователя\n📊 /state [user_id] - Показать текущее состояние\n🚀 /allboost [user_id] - Активировать все модели с +100 запросами\n⏱ /profile [секунды] - Профилирование бота\n\nИспользуйте эти команды для управления системой."
         },
         'pay_end_plus': "💎 Ваша подписка Plus завершена. Хотите продлить?",
         'pay_info': "💎 Подписка открывает доступ к премиальным функциям:\n\n• Приоритетная обработка запросов\n• Увеличенные лимиты использования\n• Доступ к самым мощным моделям AI\n• Расширенные возможности настройки\n\nВыберите подходящий тип подписки:\n• Base - 590₽ в месяц\n• Pro - 990₽ в месяц\n\nОформите подписку, чтобы получить максимум от AI Assistant!",
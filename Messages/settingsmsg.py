@@ -1,9 +1,14 @@
 from aiogram.types import InlineKeyboardMarkup, Message
+from aiogram.exceptions import TelegramRetryAfter
 from services.logging import logs_bot
+from services.tracing import traced
 from Messages.utils import escape_markdown
 from aiogram.enums import ParseMode
+from typing import Optional
+import asyncio
 
 
+@traced()
 async def new_message(message: Message, text: str, keyboard=None) -> Message:
     """
     Отправляет новое сообщение с текстом и опциональной клавиатурой.
@@ -63,6 +68,7 @@ async def new_message(message: Message, text: str, keyboard=None) -> Message:
         )
 
 
+@traced()
 async def update_message(message: Message, text: str, keyboard=None) -> bool:
     """Обновляет существующее сообщение с новым текстом и опциональной клавиатурой.
     Если текст больше 3997 символов, отправляет его частями."""
@@ -119,6 +125,87 @@ async def update_message(message: Message, text: str, keyboard=None) -> bool:
         return False
 
 
+class StreamingMessage:
+    """
+    Постепенное обновление сообщения по мере генерации ответа.
+
+    update() только запоминает последний текст, а правку делает фоновая
+    задача: первая правка сразу, следующие не чаще раза в interval секунд
+    и только если добавилось не меньше min_chars символов. Так промежуточные
+    фрагменты объединяются и бот не упирается в лимит правок Telegram.
+    Промежуточный текст отправляется без Markdown (он может быть незакрытым),
+    итоговое форматирование делает update_message.
+    """
+
+    # Максимальная длина промежуточного текста (как у update_message)
+    MAX_LENGTH = 3997
+
+    def __init__(self, message: Message, interval: float = 1.0, min_chars: int = 20):
+        self.message = message
+        self.interval = interval
+        self.min_chars = min_chars
+        self.edits = 0
+        self._text = ""
+        self._shown = ""
+        self._next_edit = 0.0
+        self._editing = False
+        self._closed = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def update(self, text: str) -> None:
+        """Запоминает накопленный текст ответа; правка выполняется в фоне"""
+        self._text = text
+        if self._closed:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._edit_later())
+
+    async def _edit_later(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = self._next_edit - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text = self._text[: self.MAX_LENGTH]
+            if self._closed or text == self._shown or (
+                self._shown and len(text) - len(self._shown) < self.min_chars
+                and len(text) < self.MAX_LENGTH
+            ):
+                # Мало нового текста: ждем следующего фрагмента
+                return
+
+            self._editing = True
+            try:
+                await self.message.edit_text(text=text, parse_mode=None)
+                self._shown = text
+                self.edits += 1
+                self._next_edit = loop.time() + self.interval
+            except TelegramRetryAfter as e:
+                self._next_edit = loop.time() + e.retry_after
+                continue
+            except Exception as e:
+                await logs_bot("debug", "Streaming edit failed: %s", e)
+                self._next_edit = loop.time() + self.interval
+            finally:
+                self._editing = False
+
+            if self._closed or self._text[: self.MAX_LENGTH] == self._shown:
+                return
+
+    async def close(self) -> None:
+        """
+        Останавливает промежуточные правки перед итоговым update_message.
+        Отложенная правка отменяется, а уже отправленная дожидается.
+        """
+        self._closed = True
+        task = self._task
+        if task is None or task.done():
+            return
+        if not self._editing:
+            task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
 async def prepare_keyboard(keyboard):
     """Подготовка клавиатуры"""
     if not keyboard:
@@ -1,9 +1,32 @@
+from config.config import get_config
 from services.logging import logs_bot
-from database.settingsdata import add_to_table, user_exists, save_voice_to_mongodb
+from services.tracing import traced
+from database.settingsdata import (
+    ensure_user_documents,
+    save_voice_to_mongodb,
+    stream_voice,
+)
+from aiogram.types import InputFile
+from typing import AsyncGenerator
+from database.migrations import parse_datetime
 from datetime import datetime, timedelta
+from collections import OrderedDict
 import uuid
 
+# Пользователи, записи которых уже точно есть в базе (LRU ограниченного размера)
+KNOWN_USERS_LIMIT = get_config().cache.known_users_limit
+_known_users: "OrderedDict[int, None]" = OrderedDict()
 
+
+def _remember_user(chat_id: int) -> None:
+    """Добавляет пользователя в множество известных, вытесняя самых старых"""
+    _known_users[chat_id] = None
+    _known_users.move_to_end(chat_id)
+    if len(_known_users) > KNOWN_USERS_LIMIT:
+        _known_users.popitem(last=False)
+
+
+@traced()
 async def create_user_data(message) -> dict:
     from config.confpaypass import get_default_limits
 
@@ -17,20 +40,27 @@ async def create_user_data(message) -> dict:
     3. Sets up payment/pass information
     4. Configures static AI data
     5. Starts chat history
-    6. Logs the user's start
-    7. Saves all data to respective database tables
+    6. Saves all data with a single insert-if-absent bulk write
+    7. Logs the user's start when new records were created
+
+    Users already seen by this process are skipped without touching the database.
     
     Args:
         message: Telegram message object containing user information
         
     Returns:
         dict: Dictionary containing all created user data
+              (empty for users that are already known)
     """
 
     # Common user ID to be used across all tables
     chat_id = message.from_user.id
-    created_at = datetime.now().strftime("%H:%M %d-%m-%Y")
-    updated_pass_at = (datetime.now() + timedelta(days=7)).strftime("%H:%M %d-%m-%Y")
+    if chat_id in _known_users:
+        _known_users.move_to_end(chat_id)
+        return {}
+
+    created_at = datetime.now()
+    updated_pass_at = created_at + timedelta(days=7)
 
     user_data = {
         "chatId": int(chat_id),
@@ -63,37 +93,29 @@ async def create_user_data(message) -> dict:
         "chatId": int(chat_id),
         "message_text": "",
         "response_text": "",
-        "context": [
-            "re",
-            "Привет! Как я могу помочь?",
-        ],  # Пустой контекст для новых пользователей
         "model": "gpt-4o-mini",
         "timestamp": created_at,
     }
 
-    # Log user start
-    await logs_bot("info", f"User {chat_id} started the bot")
-
-    # Проверяем и сохраняем данные только если они не существуют
-    tables_data = [
-        ("Users", user_data),
-        ("UsersAI", user_ai),
-        ("UsersPayPass", user_pay_pass),
-        ("StaticAIUsers", static_ai_user),
-    ]
-
-    for table_name, data in tables_data:
-        # Проверяем, существует ли запись
-        if not await user_exists(table_name, chat_id):
-            await add_to_table(table_name, data)
-            await logs_bot(
-                "info", f"Created new record in {table_name} for user {chat_id}"
-            )
-        else:
-            await logs_bot(
-                "debug",
-                f"User {chat_id} already exists in {table_name}, skipping creation",
-            )
+    # Сохраняем данные только в те таблицы, где записи еще нет
+    created = await ensure_user_documents(
+        int(chat_id),
+        {
+            "Users": user_data,
+            "UsersAI": user_ai,
+            "UsersPayPass": user_pay_pass,
+            "StaticAIUsers": static_ai_user,
+        },
+    )
+    if created is not None:
+        _remember_user(chat_id)
+
+    if created:
+        # Log user start
+        await logs_bot(
+            "info",
+            f"User {chat_id} started the bot, created records in: {', '.join(created)}",
+        )
 
     # Возвращаем созданные данные
     return {
@@ -105,6 +127,7 @@ async def create_user_data(message) -> dict:
     }
 
 
+@traced()
 async def download_voice_user(message):
     """
     Скачивает голосовое сообщение пользователя и сохраняет в MongoDB
@@ -113,7 +136,7 @@ async def download_voice_user(message):
         message: Объект сообщения с голосовым сообщением
 
     Returns:
-        str: Виртуальный путь к файлу (для совместимости)
+        str: Ключ аудио (sha256 содержимого)
     """
     try:
         # Получаем информацию о голосовом файле
@@ -133,18 +156,19 @@ async def download_voice_user(message):
         # Логируем для отладки
         await logs_bot(
             "debug",
-            f"Downloaded voice file: {voice_name}, size: {len(file_bytes.getvalue())} bytes",
+            "Downloaded voice file: %s, size: %s bytes",
+            voice_name,
+            file_bytes.getbuffer().nbytes,
         )
 
         # Сохраняем в MongoDB
-        virtual_path = await save_voice_to_mongodb(
-            user_id, file_bytes.getvalue(), voice_name
-        )
+        # Передаем буфер целиком, без копирования в bytes
+        audio_key = await save_voice_to_mongodb(user_id, file_bytes, voice_name)
 
         await logs_bot(
-            "info", f"Voice message saved to MongoDB with path: {virtual_path}"
+            "info", f"Voice message saved with audio key: {audio_key}"
         )
-        return virtual_path
+        return audio_key
 
     except Exception as e:
         await logs_bot("error", f"Error in download_voice_user: {str(e)}")
@@ -154,6 +178,21 @@ async def download_voice_user(message):
         return None
 
 
+class VoiceInputFile(InputFile):
+    """
+    Голосовое сообщение из хранилища для отправки в Telegram.
+    Данные передаются в запрос частями по мере чтения из хранилища.
+    """
+
+    def __init__(self, audio_key: str, filename: str = None):
+        super().__init__(filename=filename or f"{audio_key}.ogg")
+        self.audio_key = audio_key
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        async for chunk in stream_voice(self.audio_key):
+            yield chunk
+
+
 def escape_markdown(text: str) -> str:
     """
     Экранирует специальные символы для Markdown V2
@@ -197,6 +236,23 @@ def escape_markdown(text: str) -> str:
     return text
 
 
+def format_datetime(value, default: str = "Неизвестно") -> str:
+    """
+    Форматирует дату из MongoDB для показа пользователю
+
+    Args:
+        value: datetime или строка старого формата
+        default: Текст, если дата не задана или не распознана
+
+    Returns:
+        str: Дата в формате "%H:%M %d-%m-%Y"
+    """
+    parsed = parse_datetime(value)
+    if parsed is None:
+        return default
+    return parsed.strftime("%H:%M %d-%m-%Y")
+
+
 async def format_expiry_date(timestamp: str) -> str:
     """Форматирует дата из MongoDB в русский формат"""
     if not timestamp:
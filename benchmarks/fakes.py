@@ -0,0 +1,373 @@
+"""
+Локальные заглушки Telegram Bot API и ProxyAPI для нагрузочного теста.
+
+FakeTelegram отдает боту синтетические обновления через getUpdates
+и принимает его ответы (sendMessage, editMessageText и т.д.), отмечая
+момент, когда обновление считается обработанным.
+FakeProxyAPI отвечает на запросы четырех провайдеров ProxyAPI, TTS и STT
+с настраиваемой задержкой.
+"""
+
+from aiohttp import web
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import itertools
+import json
+import random
+import time
+
+# Маркер в ответе модели: по нему нагрузочный тест понимает, что ответ дошел
+REPLY_MARKER = "BENCHREPLY"
+
+# Начало текстов, которыми бот сообщает о неудаче
+ERROR_PREFIXES = (
+    "⚠️",
+    "Не удалось",
+    "Произошла ошибка",
+    "Пожалуйста, подождите",
+    "Ошибка",
+)
+
+# Небольшой валидный OGG-заголовок: содержимое голосовых для бота не важно
+FAKE_VOICE = b"OggS" + bytes(4092)
+
+
+class Latency:
+    """Задержка ответа: base секунд плюс равномерный разброс jitter"""
+
+    def __init__(self, base: float = 0.0, jitter: float = 0.0):
+        self.base = base
+        self.jitter = jitter
+
+    async def wait(self) -> None:
+        delay = self.base + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class PendingUpdate:
+    """Отправленное боту обновление, ожидающее завершения"""
+
+    __slots__ = ("chat_id", "predicate", "future", "sent_at", "first_visible")
+
+    def __init__(self, chat_id: int, predicate: Callable[[str, Dict[str, Any]], Optional[bool]]):
+        self.chat_id = chat_id
+        self.predicate = predicate
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.sent_at = 0.0
+        # Задержка до первого показа текста ответа (потоковые правки)
+        self.first_visible: Optional[float] = None
+
+
+class FakeTelegram:
+    """Заглушка Bot API: /bot<token>/<method> и /file/bot<token>/<path>"""
+
+    def __init__(self, latency: Latency = None):
+        self.latency = latency or Latency()
+        self._updates: List[Dict[str, Any]] = []
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self._pending: Dict[int, PendingUpdate] = {}
+        self.calls: Dict[str, int] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self._handle_method)
+        app.router.add_get("/file/bot{token}/{path:.*}", self._handle_file)
+        return app
+
+    # --- отправка обновлений ---
+
+    def push(
+        self,
+        chat_id: int,
+        payload: Dict[str, Any],
+        predicate: Callable[[str, Dict[str, Any]], Optional[bool]],
+    ) -> PendingUpdate:
+        """
+        Ставит обновление в очередь getUpdates.
+        predicate(method, params) возвращает True/False, когда ответ бота
+        завершает обновление успешно или с ошибкой, и None для промежуточных.
+        """
+        pending = PendingUpdate(chat_id, predicate)
+        pending.sent_at = time.perf_counter()
+        self._pending[chat_id] = pending
+        self._updates.append({"update_id": next(self._update_ids), **payload})
+        self._new_updates.set()
+        return pending
+
+    def user(self, chat_id: int) -> Dict[str, Any]:
+        return {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}", "username": f"user{chat_id}"}
+
+    def chat(self, chat_id: int) -> Dict[str, Any]:
+        return {"id": chat_id, "type": "private", "first_name": f"user{chat_id}"}
+
+    def text_update(self, chat_id: int, text: str) -> Dict[str, Any]:
+        return {
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": self.chat(chat_id),
+                "from": self.user(chat_id),
+                "text": text,
+            }
+        }
+
+    def voice_update(self, chat_id: int) -> Dict[str, Any]:
+        return {
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": self.chat(chat_id),
+                "from": self.user(chat_id),
+                "voice": {
+                    "file_id": f"voice{chat_id}",
+                    "file_unique_id": f"voice{chat_id}",
+                    "duration": 2,
+                    "mime_type": "audio/ogg",
+                    "file_size": len(FAKE_VOICE),
+                },
+            }
+        }
+
+    def callback_update(self, chat_id: int, data: str) -> Dict[str, Any]:
+        return {
+            "callback_query": {
+                "id": str(next(self._message_ids)),
+                "from": self.user(chat_id),
+                "chat_instance": str(chat_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": self.chat(chat_id),
+                    "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+                    "text": "menu",
+                },
+            }
+        }
+
+    # --- обработка вызовов бота ---
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params.get("chat_id", 0))
+        return {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": self.chat(chat_id),
+            "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+            "text": params.get("text") or params.get("caption") or "",
+        }
+
+    def _complete(self, method: str, params: Dict[str, Any]) -> None:
+        chat_id = params.get("chat_id")
+        if chat_id is None:
+            return
+        pending = self._pending.get(int(chat_id))
+        if pending is None or pending.future.done():
+            return
+        outcome = pending.predicate(method, params)
+        if (
+            pending.first_visible is None
+            and method in ("sendMessage", "editMessageText")
+            and REPLY_MARKER in params.get("text", "")
+        ):
+            pending.first_visible = time.perf_counter() - pending.sent_at
+        if outcome is not None:
+            pending.future.set_result((outcome, time.perf_counter() - pending.sent_at))
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:100]
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params: Dict[str, Any] = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                form = await request.post()
+                params.update(
+                    {key: value for key, value in form.items() if isinstance(value, str)}
+                )
+
+        if method == "getUpdates":
+            result: Any = await self._get_updates(params)
+        else:
+            await self.latency.wait()
+            if method == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+            elif method == "getFile":
+                file_id = params.get("file_id", "file")
+                result = {
+                    "file_id": file_id,
+                    "file_unique_id": file_id,
+                    "file_size": len(FAKE_VOICE),
+                    "file_path": f"voice/{file_id}.oga",
+                }
+            elif method in ("sendMessage", "editMessageText", "sendVoice", "sendDocument", "editMessageReplyMarkup"):
+                result = self._message(params)
+            else:
+                result = True
+            self._complete(method, params)
+
+        return web.json_response({"ok": True, "result": result})
+
+    async def _handle_file(self, request: web.Request) -> web.Response:
+        await self.latency.wait()
+        return web.Response(body=FAKE_VOICE, content_type="application/octet-stream")
+
+
+class FakeProxyAPI:
+    """
+    Заглушка ProxyAPI: /openai, /anthropic, /google, /deepseek.
+    latency - время до первого токена, token_interval - пауза между токенами;
+    при stream=true ответ отдается потоком SSE в формате провайдера.
+    """
+
+    def __init__(self, latency: Latency = None, reply_tokens: int = 60, token_interval: float = 0.0):
+        self.latency = latency or Latency()
+        self.token_interval = token_interval
+        self.tokens = [f"{REPLY_MARKER} "] + ["ответ "] * reply_tokens
+        self.reply = "".join(self.tokens).strip()
+        self.calls: Dict[str, int] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/openai/v1/chat/completions", self._openai_chat)
+        app.router.add_post("/deepseek/chat/completions", self._openai_chat)
+        app.router.add_post("/anthropic/v1/messages", self._anthropic)
+        app.router.add_post("/google/v1/models/{model}", self._google)
+        app.router.add_post("/openai/v1/audio/speech", self._speech)
+        app.router.add_post("/openai/v1/audio/transcriptions", self._transcription)
+        return app
+
+    def _count(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    async def _generate(self) -> None:
+        """Время генерации всего ответа без потока"""
+        await self.latency.wait()
+        if self.token_interval:
+            await asyncio.sleep(self.token_interval * (len(self.tokens) - 1))
+
+    async def _stream(self, request: web.Request, events) -> web.StreamResponse:
+        """Отдает события SSE: events(token) -> список JSON-событий на токен"""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await self.latency.wait()
+        for index, token in enumerate(self.tokens):
+            if index and self.token_interval:
+                await asyncio.sleep(self.token_interval)
+            for event in events(token):
+                await response.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode())
+        return response
+
+    def _usage(self, body: Dict[str, Any]) -> Dict[str, int]:
+        prompt = len(json.dumps(body, ensure_ascii=False)) // 4
+        completion = len(self.reply) // 4
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    async def _openai_chat(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self._count("chat")
+        if body.get("stream"):
+            response = await self._stream(
+                request,
+                lambda token: [{"choices": [{"index": 0, "delta": {"content": token}}]}],
+            )
+            usage = {"choices": [], "usage": self._usage(body)}
+            await response.write(f"data: {json.dumps(usage)}\n\ndata: [DONE]\n\n".encode())
+            return response
+        await self._generate()
+        return web.json_response(
+            {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "bench"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": self.reply},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": self._usage(body),
+            }
+        )
+
+    async def _anthropic(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self._count("anthropic")
+        usage = self._usage(body)
+        if body.get("stream"):
+            response = await self._stream(
+                request,
+                lambda token: [
+                    {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": token}}
+                ],
+            )
+            done = {"type": "message_delta", "usage": {"output_tokens": usage["completion_tokens"]}}
+            await response.write(f"data: {json.dumps(done)}\n\n".encode())
+            return response
+        await self._generate()
+        return web.json_response(
+            {
+                "id": "msg-bench",
+                "type": "message",
+                "role": "assistant",
+                "model": body.get("model", "bench"),
+                "content": [{"type": "text", "text": self.reply}],
+                "usage": {
+                    "input_tokens": usage["prompt_tokens"],
+                    "output_tokens": usage["completion_tokens"],
+                },
+            }
+        )
+
+    async def _google(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self._count("google")
+        usage = self._usage(body)
+        if request.match_info["model"].endswith(":streamGenerateContent"):
+            return await self._stream(
+                request,
+                lambda token: [{"candidates": [{"content": {"role": "model", "parts": [{"text": token}]}}]}],
+            )
+        await self._generate()
+        return web.json_response(
+            {
+                "candidates": [
+                    {"content": {"role": "model", "parts": [{"text": self.reply}]}}
+                ],
+                "usageMetadata": {
+                    "promptTokenCount": usage["prompt_tokens"],
+                    "candidatesTokenCount": usage["completion_tokens"],
+                },
+            }
+        )
+
+    async def _speech(self, request: web.Request) -> web.Response:
+        await request.read()
+        self._count("tts")
+        await self.latency.wait()
+        return web.Response(body=FAKE_VOICE, content_type="audio/mpeg")
+
+    async def _transcription(self, request: web.Request) -> web.Response:
+        await request.read()
+        self._count("stt")
+        await self.latency.wait()
+        return web.json_response({"text": "расшифровка голосового сообщения"})
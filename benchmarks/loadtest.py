@@ -0,0 +1,336 @@
+"""
+Нагрузочный тест бота целиком, без доступа в интернет.
+
+Поднимает заглушки Telegram Bot API и ProxyAPI (benchmarks/fakes.py),
+запускает настоящий main.py отдельным процессом с TELEGRAM_API_URL
+и PROXY_BASE_URL, указывающими на заглушки, и отдельной базой в локальном
+MongoDB. Затем синтетические пользователи проходят сценарии text, voice
+и menu. Для каждого сценария выводятся пропускная способность,
+задержки p50/p95/p99 и ресурсы процесса бота (CPU, RSS).
+
+Пример:
+    python -m benchmarks.loadtest --users 2000 --concurrency 300 \\
+        --scenarios text,voice,menu --provider-latency 0.8 --output bench.json
+"""
+
+from aiohttp import web
+from benchmarks.fakes import (
+    ERROR_PREFIXES,
+    REPLY_MARKER,
+    FakeProxyAPI,
+    FakeTelegram,
+    Latency,
+)
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Первый chatId синтетических пользователей
+BASE_CHAT_ID = 900_000_000
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def reply_predicate(method: str, params: Dict[str, Any]) -> Optional[bool]:
+    """
+    Текстовый и голосовой сценарии: ждем ответа модели или сообщения об ошибке.
+    Итоговая правка отличается от потоковых наличием клавиатуры.
+    """
+    if method not in ("sendMessage", "editMessageText"):
+        return None
+    text = params.get("text", "")
+    if REPLY_MARKER in text:
+        return True if params.get("reply_markup") else None
+    if text.startswith(ERROR_PREFIXES):
+        return False
+    return None
+
+
+def menu_predicate(method: str, params: Dict[str, Any]) -> Optional[bool]:
+    """Сценарий меню: достаточно любого отправленного или измененного сообщения"""
+    if method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+        return True
+    return None
+
+
+class ProcessSampler:
+    """Снимает CPU и RSS процесса бота из /proc (только Linux)"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.rss_max = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def cpu_seconds(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/stat") as stat_file:
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self.ticks
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def rss_bytes(self) -> Optional[int]:
+        try:
+            with open(f"/proc/{self.pid}/status") as status_file:
+                for line in status_file:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            return None
+        return None
+
+    async def _run(self) -> None:
+        while True:
+            rss = self.rss_bytes()
+            if rss:
+                self.rss_max = max(self.rss_max, rss)
+            await asyncio.sleep(0.5)
+
+    def start(self) -> None:
+        self.rss_max = 0
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+async def run_user(
+    telegram: FakeTelegram,
+    scenario: str,
+    chat_id: int,
+    args: argparse.Namespace,
+    latencies: List[float],
+    first_visible: List[float],
+    outcomes: Dict[str, int],
+) -> None:
+    """Один пользователь: messages запросов подряд с паузой think_time"""
+    for index in range(args.messages):
+        if scenario == "text":
+            payload = telegram.text_update(chat_id, f"Вопрос номер {index}: расскажи о погоде")
+            predicate = reply_predicate
+        elif scenario == "voice":
+            payload = telegram.voice_update(chat_id)
+            predicate = reply_predicate
+        else:
+            data = "Profile" if index % 2 == 0 else "Help"
+            payload = telegram.callback_update(chat_id, data)
+            predicate = menu_predicate
+
+        pending = telegram.push(chat_id, payload, predicate)
+        try:
+            ok, latency = await asyncio.wait_for(pending.future, args.timeout)
+            outcomes["ok" if ok else "error"] += 1
+            latencies.append(latency)
+            if pending.first_visible is not None:
+                first_visible.append(pending.first_visible)
+        except asyncio.TimeoutError:
+            outcomes["timeout"] += 1
+
+        # Пауза больше окна антиспама (3 сообщения за 3 секунды)
+        await asyncio.sleep(args.think_time)
+
+
+async def run_scenario(
+    telegram: FakeTelegram,
+    sampler: ProcessSampler,
+    scenario: str,
+    first_chat_id: int,
+    args: argparse.Namespace,
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    first_visible: List[float] = []
+    outcomes = {"ok": 0, "error": 0, "timeout": 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(chat_id: int) -> None:
+        async with semaphore:
+            await run_user(
+                telegram, scenario, chat_id, args, latencies, first_visible, outcomes
+            )
+
+    cpu_before = sampler.cpu_seconds()
+    sampler.start()
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(limited(first_chat_id + index) for index in range(args.users))
+    )
+    duration = time.perf_counter() - started
+    await sampler.stop()
+    cpu_after = sampler.cpu_seconds()
+
+    completed = outcomes["ok"] + outcomes["error"]
+    # Паузы пользователей не нагружают бота, поэтому из времени не вычитаются
+    result = {
+        "scenario": scenario,
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "requests": args.users * args.messages,
+        **outcomes,
+        "duration_seconds": round(duration, 3),
+        "throughput_rps": round(completed / duration, 2) if duration else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "max": round(max(latencies, default=0.0) * 1000, 1),
+        },
+        # Время до первого показа текста ответа (при потоковой генерации)
+        "first_visible_ms": {
+            "p50": round(percentile(first_visible, 50) * 1000, 1),
+            "p95": round(percentile(first_visible, 95) * 1000, 1),
+        },
+        "bot_process": {
+            "cpu_seconds": (
+                round(cpu_after - cpu_before, 2)
+                if cpu_before is not None and cpu_after is not None
+                else None
+            ),
+            "cpu_percent": (
+                round((cpu_after - cpu_before) / duration * 100, 1)
+                if cpu_before is not None and cpu_after is not None and duration
+                else None
+            ),
+            "rss_max_mb": round(sampler.rss_max / 2**20, 1) if sampler.rss_max else None,
+        },
+    }
+    return result
+
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def bot_environment(args: argparse.Namespace, workdir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update(
+        {
+            "BOT_TOKEN": "123456:BENCHMARK",
+            "API_KEY": "benchmark",
+            "PROXY_API_KEY": "benchmark",
+            "MONGO_URI": args.mongo_uri,
+            "MONGO_DB_NAME": args.db_name,
+            "TELEGRAM_API_URL": f"http://127.0.0.1:{args.telegram_port}",
+            "PROXY_BASE_URL": f"http://127.0.0.1:{args.proxy_port}",
+            "LOG_LEVEL": args.log_level,
+            "BLOB_BACKEND": args.blob_backend,
+            "BLOB_LOCAL_PATH": os.path.join(workdir, "blobs"),
+            "TRACE_PATH": os.path.join(workdir, "traces.jsonl"),
+        }
+    )
+    return env
+
+
+async def drop_database(args: argparse.Namespace) -> None:
+    from pymongo import AsyncMongoClient
+
+    client = AsyncMongoClient(args.mongo_uri)
+    try:
+        await client.drop_database(args.db_name)
+    finally:
+        await client.close()
+
+
+async def main(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    telegram = FakeTelegram(Latency(args.telegram_latency, args.telegram_jitter))
+    proxy = FakeProxyAPI(
+        Latency(args.provider_latency, args.provider_jitter),
+        token_interval=args.token_interval,
+    )
+    runners = [
+        await start_site(telegram.app(), args.telegram_port),
+        await start_site(proxy.app(), args.proxy_port),
+    ]
+
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    bot = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "main.py",
+        cwd=PROJECT_ROOT,
+        env=bot_environment(args, workdir),
+        stdout=asyncio.subprocess.DEVNULL if not args.bot_output else None,
+        stderr=asyncio.subprocess.DEVNULL if not args.bot_output else None,
+    )
+
+    results = []
+    try:
+        # Бот готов, когда начал опрашивать getUpdates
+        deadline = time.monotonic() + args.startup_timeout
+        while not telegram.calls.get("getUpdates"):
+            if bot.returncode is not None or time.monotonic() > deadline:
+                raise RuntimeError("Bot process did not start polling")
+            await asyncio.sleep(0.1)
+
+        sampler = ProcessSampler(bot.pid)
+        first_chat_id = BASE_CHAT_ID
+        for scenario in args.scenarios:
+            result = await run_scenario(telegram, sampler, scenario, first_chat_id, args)
+            first_chat_id += args.users
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+    finally:
+        if bot.returncode is None:
+            bot.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(bot.wait(), 15)
+            except asyncio.TimeoutError:
+                bot.kill()
+        for runner in runners:
+            await runner.cleanup()
+        if not args.keep_db:
+            await drop_database(args)
+
+    return results
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на заглушках")
+    parser.add_argument("--users", type=int, default=500, help="Пользователей в сценарии")
+    parser.add_argument("--concurrency", type=int, default=100, help="Одновременно активных пользователей")
+    parser.add_argument("--messages", type=int, default=3, help="Запросов на пользователя")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=["text", "voice", "menu"])
+    parser.add_argument("--think-time", type=float, default=1.1, help="Пауза пользователя между запросами, с")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Ожидание ответа на запрос, с")
+    parser.add_argument("--provider-latency", type=float, default=0.5)
+    parser.add_argument("--provider-jitter", type=float, default=0.2)
+    parser.add_argument("--token-interval", type=float, default=0.02, help="Пауза между токенами ответа, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.01)
+    parser.add_argument("--telegram-jitter", type=float, default=0.01)
+    parser.add_argument("--telegram-port", type=int, default=18081)
+    parser.add_argument("--proxy-port", type=int, default=18082)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default=f"bench_{int(time.time())}")
+    parser.add_argument("--keep-db", action="store_true", help="Не удалять базу после теста")
+    parser.add_argument("--blob-backend", default="local", choices=["local", "gridfs"])
+    parser.add_argument("--log-level", default="warning")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--bot-output", action="store_true", help="Показывать вывод процесса бота")
+    parser.add_argument("--output", help="Файл для результатов в JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    scenario_results = asyncio.run(main(arguments))
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as output_file:
+            json.dump(scenario_results, output_file, ensure_ascii=False, indent=2)
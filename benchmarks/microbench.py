@@ -0,0 +1,270 @@
+"""
+Микробенчмарки функций, которые выполняются на каждом обновлении.
+
+Каждый случай калибруется так, чтобы один замер длился не меньше
+--min-time секунд, затем повторяется --repeat раз с отключенной сборкой
+мусора. Отчет содержит медиану, min, межквартильный размах и разброс
+времени одного вызова. Отдельным прогоном под tracemalloc снимаются пиковая
+память на вызов и число блоков, оставшихся после тысячи вызовов.
+
+Результат сохраняется в JSON (--save) и сравнивается с прошлым (--baseline).
+При регрессии медианы больше --threshold процентов, которая не укладывается
+в разброс замеров, скрипт завершается с кодом 1.
+
+Пример:
+    python -m benchmarks.microbench --save bench/base.json
+    python -m benchmarks.microbench --baseline bench/base.json
+"""
+
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+# Модули проекта читают конфигурацию при импорте; для замеров чистых
+# функций достаточно заглушек, к сети и базе бенчмарк не обращается
+for _name, _value in {
+    "BOT_TOKEN": "123456:MICROBENCH",
+    "PROXY_API_KEY": "microbench",
+    "API_KEY": "microbench",
+    "MONGO_URI": "mongodb://localhost:27017",
+    "MONGO_DB_NAME": "microbench",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+from config.confpaypass import get_default_limits  # noqa: E402
+from Messages import inlinebutton  # noqa: E402
+from Messages.utils import escape_markdown  # noqa: E402
+from services.anti_spam import AntiSpam  # noqa: E402
+from services.openai_services import _clean_response, openai_service  # noqa: E402
+
+REPLY = (
+    "Конечно! Вот пример функции на Python:\n\n"
+    "```python\ndef add(a, b):\n    return a + b  # сумма (a + b)\n```\n\n"
+    "1. Функция *add* принимает два аргумента.\n"
+    "2. Результат - [сумма](https://example.com/sum) чисел!\n"
+    "Подробнее: _документация_ > раздел #3 {примеры} | итог = 42.\n"
+) * 4
+
+TECHNICAL_REPLY = (
+    "{'role': 'assistant', 'content': '" + REPLY.replace("'", "") + "'}"
+)
+
+CONTEXT = [
+    (f"Вопрос {index}: как работает асинхронность в Python?", REPLY)
+    for index in range(5)
+]
+
+
+def run_coroutine(coro) -> Any:
+    """
+    Выполняет корутину, которая не уступает управление, без цикла событий.
+    Так в замер не попадают накладные расходы asyncio.
+    """
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("Benchmarked coroutine suspended")
+
+
+def anti_spam_case() -> Callable[[], Any]:
+    controller = AntiSpam()
+    user_ids = itertools.cycle(range(1000))
+    return lambda: run_coroutine(controller.check_spam(next(user_ids)))
+
+
+# Случаи: имя -> фабрика, возвращающая вызываемый объект без аргументов
+CASES: Dict[str, Callable[[], Callable[[], Any]]] = {
+    "escape_markdown": lambda: lambda: escape_markdown(REPLY),
+    "prepare_messages": lambda: lambda: run_coroutine(
+        openai_service._prepare_messages(
+            "Новый вопрос", CONTEXT, openai_service.default_system_message
+        )
+    ),
+    "get_default_limits": lambda: get_default_limits,
+    "clean_response_plain": lambda: lambda: _clean_response(REPLY),
+    "clean_response_technical": lambda: lambda: _clean_response(TECHNICAL_REPLY),
+    "anti_spam_check": anti_spam_case,
+    "keyboard_general_menu": lambda: lambda: run_coroutine(
+        inlinebutton.get_general_menu()
+    ),
+    "keyboard_profile": lambda: lambda: run_coroutine(
+        inlinebutton.get_profile_keyboard(True, True)
+    ),
+    "keyboard_pay": lambda: lambda: run_coroutine(
+        inlinebutton.get_pay_keyboard(False, False)
+    ),
+    "keyboard_tts_quality": lambda: lambda: run_coroutine(
+        inlinebutton.tts_quality_menu(True, True)
+    ),
+}
+
+
+def calibrate(func: Callable[[], Any], min_time: float) -> int:
+    """Число вызовов в одном замере, чтобы он длился не меньше min_time"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        if time.perf_counter() - started >= min_time:
+            return loops
+        loops *= 2
+
+
+def measure_time(func: Callable[[], Any], repeat: int, min_time: float) -> Dict[str, Any]:
+    loops = calibrate(func, min_time)
+    samples: List[float] = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter_ns()
+            for _ in range(loops):
+                func()
+            samples.append((time.perf_counter_ns() - started) / loops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    quartiles = statistics.quantiles(samples, n=4) if len(samples) > 1 else samples * 3
+    return {
+        "loops": loops,
+        "repeat": repeat,
+        "median_ns": round(statistics.median(samples), 1),
+        "min_ns": round(min(samples), 1),
+        "mean_ns": round(statistics.fmean(samples), 1),
+        "stdev_ns": round(statistics.stdev(samples), 1) if len(samples) > 1 else 0.0,
+        "iqr_ns": round(quartiles[2] - quartiles[0], 1),
+    }
+
+
+def _retained_blocks(func: Callable[[], Any], calls: int) -> int:
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    for _ in range(calls):
+        func()
+    gc.collect()
+    return sys.getallocatedblocks() - blocks_before
+
+
+def measure_memory(func: Callable[[], Any], calls: int = 1000) -> Dict[str, Any]:
+    """Пиковая память одного вызова и блоки, оставшиеся после calls вызовов"""
+    func()  # прогрев кешей, чтобы они не считались утечкой
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+
+        retained = _retained_blocks(func, calls) - _retained_blocks(lambda: None, calls)
+    finally:
+        tracemalloc.stop()
+    return {"peak_bytes_per_call": peak - before, f"retained_blocks_per_{calls}": retained}
+
+
+def environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def run(names: List[str], repeat: int, min_time: float) -> Dict[str, Any]:
+    results = {}
+    for name in names:
+        func = CASES[name]()
+        results[name] = {**measure_time(func, repeat, min_time), **measure_memory(func)}
+    return {"environment": environment(), "created_at": time.time(), "results": results}
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Сравнивает медианы с базовым прогоном.
+
+    Returns:
+        List[str]: Имена случаев с регрессией
+    """
+    if baseline.get("environment") != current["environment"]:
+        print("Warning: baseline was recorded in a different environment")
+
+    regressions = []
+    print(f"\n{'case':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, result in current["results"].items():
+        old: Optional[Dict[str, Any]] = baseline.get("results", {}).get(name)
+        if old is None:
+            print(f"{name:<28}{'-':>12}{result['median_ns']:>12.0f}{'new':>10}")
+            continue
+        change = (result["median_ns"] - old["median_ns"]) / old["median_ns"] * 100
+        # Регрессия: рост выше порога, не объяснимый разбросом обоих замеров
+        noise = old["iqr_ns"] + result["iqr_ns"]
+        regressed = (
+            change > threshold
+            and result["median_ns"] - old["median_ns"] > noise
+        )
+        marker = " !" if regressed else ""
+        print(
+            f"{name:<28}{old['median_ns']:>12.0f}{result['median_ns']:>12.0f}"
+            f"{change:>+9.1f}%{marker}"
+        )
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def print_table(report: Dict[str, Any]) -> None:
+    print(f"{'case':<28}{'median ns':>12}{'min ns':>12}{'iqr ns':>10}{'peak B':>10}{'kept blk':>10}")
+    for name, result in report["results"].items():
+        print(
+            f"{name:<28}{result['median_ns']:>12.0f}{result['min_ns']:>12.0f}"
+            f"{result['iqr_ns']:>10.0f}{result['peak_bytes_per_call']:>10}"
+            f"{result['retained_blocks_per_1000']:>10}"
+        )
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих функций бота")
+    parser.add_argument("--repeat", type=int, default=20, help="Число замеров на случай")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Минимальная длительность замера, с")
+    parser.add_argument("--filter", default="", help="Запускать только случаи, содержащие подстроку")
+    parser.add_argument("--save", help="Сохранить результат в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Допустимый рост медианы, %%")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv)
+    names = [name for name in CASES if args.filter in name]
+    report = run(names, args.repeat, args.min_time)
+    print_table(report)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from environs import Env
-from typing import Optional
+from typing import Dict, Optional
 
 
 @dataclass
@@ -8,12 +8,54 @@ class DatabaseConfig:
     """Конфигурация базы данных."""
     uri: str
     name: str
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    max_idle_time_ms: int = 60000
+    wait_queue_timeout_ms: int = 5000
+    server_selection_timeout_ms: int = 5000
     
 @dataclass
 class OpenAIConfig:
     """Конфигурация OpenAI."""
     api_key: str
     base_url: str = "https://api.proxyapi.ru/openai/v1"
+    # Корень ProxyAPI: от него строятся адреса всех провайдеров
+    proxy_base_url: str = "https://api.proxyapi.ru"
+    # Общий пул HTTP-соединений к провайдерам
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    timeout: float = 60.0
+    connect_timeout: float = 10.0
+    http2: bool = True
+    # Потоковая генерация ответов с постепенной правкой сообщения
+    stream: bool = True
+
+@dataclass
+class RateLimitConfig:
+    """Ограничение запросов к провайдерам (0 - без ограничения)."""
+    enabled: bool = True
+    max_concurrent: int = 20  # одновременных запросов на провайдера
+    rpm: int = 0  # запросов в минуту на провайдера
+    tpm: int = 0  # токенов в минуту на провайдера
+    max_queue: int = 200  # запросов в очереди ожидания
+    max_wait: float = 30.0  # предельное ожидание в очереди, секунды
+    max_retries: int = 2  # повторы после 429/503
+    max_retry_after: float = 30.0  # больший Retry-After не ждем
+    # Лимиты отдельных провайдеров или моделей: {"anthropic": 5, "o1": 2}
+    concurrency: Dict[str, int] = field(default_factory=dict)
+    rpm_overrides: Dict[str, int] = field(default_factory=dict)
+    tpm_overrides: Dict[str, int] = field(default_factory=dict)
+
+@dataclass
+class CircuitBreakerConfig:
+    """Автоматы защиты провайдеров и переключение на резервные модели."""
+    enabled: bool = True
+    window: float = 60.0  # окно подсчета ошибок, секунды
+    min_requests: int = 5  # минимум запросов в окне для размыкания
+    error_rate: float = 0.5  # доля неудачных запросов для размыкания
+    slow_seconds: float = 30.0  # ответ медленнее порога считается неудачным
+    open_seconds: float = 30.0  # пауза до пробного запроса
 
 @dataclass
 class TelegramConfig:
@@ -21,13 +63,71 @@ class TelegramConfig:
     token: str
     api_key: str
     webhook_url: Optional[str] = None
+    # Адрес Bot API (например, локальный сервер); None - api.telegram.org
+    api_url: Optional[str] = None
+    # Правки сообщения при потоковом ответе: не чаще раза в interval секунд
+    # и не меньше min_chars новых символов
+    stream_edit_interval: float = 1.0
+    stream_min_chars: int = 20
     
+@dataclass
+class CacheConfig:
+    """Конфигурация кэша состояния пользователей."""
+    max_users: int = 10000
+    ttl_seconds: float = 300.0
+    known_users_limit: int = 50000  # LRU пользователей, записи которых уже есть в базе
+
+@dataclass
+class StorageConfig:
+    """Конфигурация хранилища аудиофайлов."""
+    backend: str = "gridfs"  # gridfs или local
+    local_path: str = "./info_save/blobs"
+    bucket_name: str = "audio"
+    chunk_size: int = 255 * 1024
+
+@dataclass
+class LogConfig:
+    """Конфигурация пакетной записи логов."""
+    queue_size: int = 10000
+    batch_size: int = 200
+    flush_interval: float = 1.0
+    overflow: str = "drop"  # drop или block
+    level: str = "info"  # минимальный уровень по умолчанию
+    module_levels: Dict[str, str] = field(default_factory=dict)
+    # Срок хранения записей по уровням, в днях
+    retention_days: Dict[str, int] = field(
+        default_factory=lambda: {"debug": 1, "info": 7, "warning": 30, "error": 90}
+    )
+
+@dataclass
+class TracingConfig:
+    """Конфигурация трассировки обновлений."""
+    enabled: bool = True
+    slow_ms: float = 2000.0  # трассировки дольше порога сохраняются целиком
+    export: str = "file"  # file или mongo
+    path: str = "./info_save/traces.jsonl"
+
+@dataclass
+class LoopMonitorConfig:
+    """Конфигурация монитора задержек цикла событий."""
+    enabled: bool = True
+    interval: float = 0.1
+    block_threshold: float = 0.1  # блокировка дольше порога фиксируется со стеком
+    report_interval: float = 60.0
+
 @dataclass
 class Config:
     """Основная конфигурация приложения."""
     db: DatabaseConfig
     openai: OpenAIConfig
     telegram: TelegramConfig
+    rate_limit: RateLimitConfig
+    circuit_breaker: CircuitBreakerConfig
+    cache: CacheConfig
+    storage: StorageConfig
+    logs: LogConfig
+    tracing: TracingConfig
+    loop_monitor: LoopMonitorConfig
     debug: bool = False
 
 
@@ -55,20 +155,93 @@ def load_config(path: str = None) -> Config:
     """
     env = Env()
     env.read_env(path)
+    proxy_base_url = env.str("PROXY_BASE_URL", "https://api.proxyapi.ru").rstrip("/")
 
     return Config(
         db=DatabaseConfig(
             uri=env.str("MONGO_URI", "mongodb://localhost:27017"),
-            name=env.str("MONGO_DB_NAME", "my_database")
+            name=env.str("MONGO_DB_NAME", "my_database"),
+            max_pool_size=env.int("MONGO_MAX_POOL_SIZE", 100),
+            min_pool_size=env.int("MONGO_MIN_POOL_SIZE", 0),
+            max_idle_time_ms=env.int("MONGO_MAX_IDLE_TIME_MS", 60000),
+            wait_queue_timeout_ms=env.int("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000),
+            server_selection_timeout_ms=env.int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)
         ),
         openai=OpenAIConfig(
             api_key=env.str("PROXY_API_KEY"),
-            base_url="https://api.proxyapi.ru/openai/v1",
+            base_url=f"{proxy_base_url}/openai/v1",
+            proxy_base_url=proxy_base_url,
+            max_connections=env.int("PROVIDER_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=env.int("PROVIDER_MAX_KEEPALIVE", 20),
+            keepalive_expiry=env.float("PROVIDER_KEEPALIVE_EXPIRY", 30.0),
+            timeout=env.float("PROVIDER_TIMEOUT", 60.0),
+            connect_timeout=env.float("PROVIDER_CONNECT_TIMEOUT", 10.0),
+            http2=env.bool("PROVIDER_HTTP2", True),
+            stream=env.bool("AI_STREAM", True),
+        ),
+        rate_limit=RateLimitConfig(
+            enabled=env.bool("PROVIDER_RATE_LIMIT", True),
+            max_concurrent=env.int("PROVIDER_MAX_CONCURRENT", 20),
+            rpm=env.int("PROVIDER_RPM", 0),
+            tpm=env.int("PROVIDER_TPM", 0),
+            max_queue=env.int("PROVIDER_QUEUE_SIZE", 200),
+            max_wait=env.float("PROVIDER_QUEUE_TIMEOUT", 30.0),
+            max_retries=env.int("PROVIDER_MAX_RETRIES", 2),
+            max_retry_after=env.float("PROVIDER_MAX_RETRY_AFTER", 30.0),
+            concurrency=env.dict("PROVIDER_CONCURRENCY", {}, subcast_values=int),
+            rpm_overrides=env.dict("PROVIDER_RPM_LIMITS", {}, subcast_values=int),
+            tpm_overrides=env.dict("PROVIDER_TPM_LIMITS", {}, subcast_values=int),
+        ),
+        circuit_breaker=CircuitBreakerConfig(
+            enabled=env.bool("CIRCUIT_BREAKER", True),
+            window=env.float("CIRCUIT_WINDOW", 60.0),
+            min_requests=env.int("CIRCUIT_MIN_REQUESTS", 5),
+            error_rate=env.float("CIRCUIT_ERROR_RATE", 0.5),
+            slow_seconds=env.float("CIRCUIT_SLOW_SECONDS", 30.0),
+            open_seconds=env.float("CIRCUIT_OPEN_SECONDS", 30.0),
         ),
         telegram=TelegramConfig(
             token=env.str("BOT_TOKEN"),
             api_key=env.str("API_KEY"),
-            webhook_url=env.str("WEBHOOK_URL", None)
+            webhook_url=env.str("WEBHOOK_URL", None),
+            api_url=env.str("TELEGRAM_API_URL", None),
+            stream_edit_interval=env.float("STREAM_EDIT_INTERVAL", 1.0),
+            stream_min_chars=env.int("STREAM_MIN_CHARS", 20),
+        ),
+        cache=CacheConfig(
+            max_users=env.int("USER_CACHE_SIZE", 10000),
+            ttl_seconds=env.float("USER_CACHE_TTL", 300.0),
+            known_users_limit=env.int("KNOWN_USERS_LIMIT", 50000)
+        ),
+        storage=StorageConfig(
+            backend=env.str("BLOB_BACKEND", "gridfs"),
+            local_path=env.str("BLOB_LOCAL_PATH", "./info_save/blobs"),
+            bucket_name=env.str("BLOB_BUCKET", "audio"),
+            chunk_size=env.int("BLOB_CHUNK_SIZE", 255 * 1024)
+        ),
+        logs=LogConfig(
+            queue_size=env.int("LOG_QUEUE_SIZE", 10000),
+            batch_size=env.int("LOG_BATCH_SIZE", 200),
+            flush_interval=env.float("LOG_FLUSH_INTERVAL", 1.0),
+            overflow=env.str("LOG_OVERFLOW", "drop"),
+            level=env.str("LOG_LEVEL", "debug" if env.bool("DEBUG", False) else "info"),
+            module_levels=env.dict("LOG_LEVELS", {}),
+            retention_days={
+                "debug": 1, "info": 7, "warning": 30, "error": 90,
+                **env.dict("LOG_RETENTION_DAYS", {}, subcast_values=int)
+            }
+        ),
+        tracing=TracingConfig(
+            enabled=env.bool("TRACE_ENABLED", True),
+            slow_ms=env.float("TRACE_SLOW_MS", 2000.0),
+            export=env.str("TRACE_EXPORT", "file"),
+            path=env.str("TRACE_PATH", "./info_save/traces.jsonl")
+        ),
+        loop_monitor=LoopMonitorConfig(
+            enabled=env.bool("LOOP_MONITOR_ENABLED", True),
+            interval=env.float("LOOP_MONITOR_INTERVAL", 0.1),
+            block_threshold=env.float("LOOP_BLOCK_THRESHOLD", 0.1),
+            report_interval=env.float("LOOP_REPORT_INTERVAL", 60.0)
         ),
         debug=env.bool("DEBUG", False)
     )
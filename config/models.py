@@ -0,0 +1,34 @@
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """Маршрут модели: адаптер провайдера и неизменяемые параметры запроса."""
+    adapter: str  # openai, o1, anthropic, google, deepseek
+    api_model: str  # имя модели у провайдера
+    max_tokens: Optional[int] = None
+    stream: bool = True  # поддерживает ли модель потоковый ответ
+    # Равноценная модель другого провайдера на время сбоя основного
+    fallback: Optional[str] = None
+
+
+# Модели, доступные пользователям (ключ - id модели в интерфейсе и лимитах).
+# Чтобы добавить модель, достаточно записи здесь, лимита в confpaypass.py
+# и кнопки в Messages/inlinebutton.py.
+MODEL_ROUTES: Dict[str, ModelRoute] = {
+    "gpt-4o-mini": ModelRoute("openai", "gpt-4o-mini", fallback="claude-3-haiku"),
+    "gpt-4o": ModelRoute("openai", "gpt-4o", fallback="claude-3-5-sonnet"),
+    "o1-mini": ModelRoute("o1", "o1-mini", stream=False, fallback="deepseek-r1"),
+    "o1": ModelRoute("o1", "o1", stream=False, fallback="deepseek-r1"),
+    "o3-mini": ModelRoute("o1", "o3-mini", stream=False, fallback="deepseek-r1"),
+    "claude-3-5-sonnet": ModelRoute(
+        "anthropic", "claude-3-5-sonnet-20241022", max_tokens=1024, fallback="gpt-4o"
+    ),
+    "claude-3-haiku": ModelRoute(
+        "anthropic", "claude-3-haiku-20240307", max_tokens=1024, fallback="gpt-4o-mini"
+    ),
+    "gemini-1.5-flash": ModelRoute("google", "gemini-1.5-flash", fallback="gpt-4o-mini"),
+    "deepseek-v3": ModelRoute("deepseek", "deepseek-chat", fallback="gpt-4o-mini"),
+    "deepseek-r1": ModelRoute("deepseek", "deepseek-chat", fallback="o3-mini"),
+}
@@ -0,0 +1,227 @@
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, BinaryIO, Optional, Union
+from bson import ObjectId
+from gridfs import AsyncGridFSBucket
+from gridfs.errors import NoFile
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import hashlib
+import mmap
+import os
+import tempfile
+
+BlobSource = Union[bytes, bytearray, memoryview, BinaryIO]
+
+
+def _content_key(source: BlobSource, chunk_size: int) -> str:
+    """
+    Вычисляет ключ содержимого (sha256) без копирования данных в память.
+    Файловый источник читается по частям и возвращается в исходную позицию.
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+        return digest.hexdigest()
+
+    if hasattr(source, "getbuffer"):
+        # BytesIO: хешируем буфер напрямую
+        with source.getbuffer() as buffer:
+            digest.update(buffer)
+        return digest.hexdigest()
+
+    position = source.tell()
+    while chunk := source.read(chunk_size):
+        digest.update(chunk)
+    source.seek(position)
+    return digest.hexdigest()
+
+
+class BlobStore(ABC):
+    """
+    Хранилище бинарных данных (аудио) с адресацией по содержимому.
+    Ключ объекта - sha256 его содержимого, поэтому одинаковые файлы
+    хранятся один раз, а сохранение идемпотентно.
+    """
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+
+    @abstractmethod
+    async def put(self, source: BlobSource, filename: str = None) -> str:
+        """Сохраняет данные и возвращает ключ содержимого"""
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        """Проверяет наличие объекта"""
+
+    @abstractmethod
+    def stream(self, key: str) -> AsyncIterator[bytes]:
+        """Потоково читает объект частями по chunk_size"""
+
+    @abstractmethod
+    async def size(self, key: str) -> Optional[int]:
+        """Размер объекта в байтах или None, если объекта нет"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> bool:
+        """Удаляет объект"""
+
+    async def read(self, key: str) -> Optional[bytes]:
+        """Читает объект целиком (только для небольших файлов)"""
+        if not await self.exists(key):
+            return None
+        return b"".join([chunk async for chunk in self.stream(key)])
+
+
+class GridFSBlobStore(BlobStore):
+    """
+    Хранилище в GridFS: файл разбивается на чанки по chunk_size байт.
+    Имя файла в GridFS - ключ содержимого; уникальный индекс по filename
+    (см. REQUIRED_INDEXES) не дает параллельным загрузкам создать копии.
+    """
+
+    def __init__(self, db, bucket_name: str = "audio", chunk_size: int = 255 * 1024):
+        super().__init__(chunk_size)
+        self.bucket = AsyncGridFSBucket(
+            db, bucket_name=bucket_name, chunk_size_bytes=chunk_size
+        )
+        self.files = db[f"{bucket_name}.files"]
+        self.chunks = db[f"{bucket_name}.chunks"]
+
+    async def put(self, source: BlobSource, filename: str = None) -> str:
+        # Хеширование больших файлов не должно блокировать цикл событий
+        key = await asyncio.to_thread(_content_key, source, self.chunk_size)
+        if await self.exists(key):
+            return key
+
+        if hasattr(source, "getbuffer"):
+            # BytesIO после записи указывает на конец буфера
+            source.seek(0)
+
+        # upload_from_stream читает файловый источник по chunk_size байт
+        file_id = ObjectId()
+        try:
+            await self.bucket.upload_from_stream_with_id(
+                file_id, key, source, metadata={"original_name": filename}
+            )
+        except DuplicateKeyError:
+            # Тот же файл успела загрузить параллельная операция: запись
+            # в files не создана, удаляем записанные чанки
+            await self.chunks.delete_many({"files_id": file_id})
+        return key
+
+    async def exists(self, key: str) -> bool:
+        return await self.files.find_one({"filename": key}, {"_id": 1}) is not None
+
+    async def size(self, key: str) -> Optional[int]:
+        record = await self.files.find_one({"filename": key}, {"length": 1})
+        return record["length"] if record else None
+
+    async def stream(self, key: str) -> AsyncIterator[bytes]:
+        try:
+            grid_out = await self.bucket.open_download_stream_by_name(key)
+        except NoFile:
+            return
+        try:
+            while chunk := await grid_out.readchunk():
+                yield chunk
+        finally:
+            await grid_out.close()
+
+    async def delete(self, key: str) -> bool:
+        deleted = False
+        async for grid_file in self.bucket.find({"filename": key}):
+            await self.bucket.delete(grid_file._id)
+            deleted = True
+        return deleted
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Хранилище в локальной файловой системе.
+    Файлы раскладываются по каталогам root/ab/cd/<sha256>, запись атомарна
+    (временный файл + rename), чтение идет через mmap без копирования в кучу.
+    """
+
+    def __init__(self, root: str, chunk_size: int = 255 * 1024):
+        super().__init__(chunk_size)
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        """Путь к файлу объекта"""
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _write(self, source: BlobSource) -> str:
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                if isinstance(source, (bytes, bytearray, memoryview)):
+                    digest.update(source)
+                    temp_file.write(source)
+                else:
+                    if hasattr(source, "getbuffer"):
+                        source.seek(0)
+                    while chunk := source.read(self.chunk_size):
+                        digest.update(chunk)
+                        temp_file.write(chunk)
+
+            key = digest.hexdigest()
+            target = self.path(key)
+            if os.path.exists(target):
+                os.unlink(temp_path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(temp_path, target)
+            return key
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    async def put(self, source: BlobSource, filename: str = None) -> str:
+        return await asyncio.to_thread(self._write, source)
+
+    async def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.path(key))
+        except OSError:
+            return None
+
+    async def stream(self, key: str) -> AsyncIterator[bytes]:
+        try:
+            handle = open(self.path(key), "rb")
+        except FileNotFoundError:
+            return
+        with handle:
+            if os.fstat(handle.fileno()).st_size == 0:
+                return
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, len(mapped), self.chunk_size):
+                        yield bytes(view[offset : offset + self.chunk_size])
+                finally:
+                    view.release()
+
+    async def delete(self, key: str) -> bool:
+        try:
+            os.unlink(self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+def create_blob_store(db, storage_config) -> BlobStore:
+    """
+    Создает хранилище по конфигурации (BLOB_BACKEND: gridfs или local).
+    """
+    if storage_config.backend == "local":
+        return LocalBlobStore(storage_config.local_path, storage_config.chunk_size)
+    return GridFSBlobStore(
+        db, storage_config.bucket_name, storage_config.chunk_size
+    )
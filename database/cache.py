@@ -0,0 +1,152 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import copy
+import time
+
+
+class UserStateCache:
+    """
+    LRU-кэш с TTL для состояния пользователя.
+
+    Для каждого chatId хранится набор записей из коллекций
+    (UsersAI, StaticAIUsers, Users, UsersPayPass), полученных из базы.
+    Запись пользователя живет не дольше ttl секунд с момента первой загрузки,
+    а при переполнении вытесняется пользователь, к которому дольше всего
+    не обращались.
+
+    У каждого пользователя есть поколение, которое меняется при каждом
+    сбросе или обновлении его записей. Загрузка из базы запоминает поколение
+    до запроса и передает его в set(): если за время запроса запись успели
+    изменить, устаревший документ в кэш не попадает.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        # chatId -> (время истечения, {коллекция: запись или None})
+        self._entries: "OrderedDict[int, Tuple[float, Dict[str, Optional[dict]]]]" = (
+            OrderedDict()
+        )
+        # chatId -> поколение; эпоха меняется, когда словарь очищается
+        self._generations: Dict[int, int] = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.stale_loads = 0
+
+    def _entry(self, chat_id: int) -> Optional[Dict[str, Optional[dict]]]:
+        """Возвращает записи пользователя, если они еще не устарели"""
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            return None
+
+        expires_at, records = entry
+        if expires_at <= time.monotonic():
+            del self._entries[chat_id]
+            return None
+
+        self._entries.move_to_end(chat_id)
+        return records
+
+    def get(self, chat_id: int, collection_name: str) -> Tuple[bool, Optional[dict]]:
+        """
+        Ищет запись пользователя в кэше.
+
+        Returns:
+            Tuple[bool, Optional[dict]]: (найдено ли в кэше, копия записи)
+        """
+        records = self._entry(chat_id)
+        if records is None or collection_name not in records:
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        return True, copy.deepcopy(records[collection_name])
+
+    def generation(self, chat_id: int) -> Tuple[int, int]:
+        """Поколение записей пользователя; запоминается перед загрузкой из базы"""
+        return self._epoch, self._generations.get(chat_id, 0)
+
+    def _bump(self, chat_id: int) -> None:
+        if chat_id not in self._generations and len(self._generations) >= 2 * self.max_size:
+            # Новая эпоха: все начатые загрузки будут считаться устаревшими
+            self._generations.clear()
+            self._epoch += 1
+        self._generations[chat_id] = self._generations.get(chat_id, 0) + 1
+
+    def set(
+        self,
+        chat_id: int,
+        collection_name: str,
+        record: Optional[dict],
+        generation: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        """
+        Сохраняет запись пользователя (None - записи нет в базе).
+        generation - поколение, полученное до загрузки записи из базы;
+        если с тех пор запись изменилась, она не сохраняется.
+        """
+        if generation is not None and generation != self.generation(chat_id):
+            self.stale_loads += 1
+            return
+
+        records = self._entry(chat_id)
+        if records is None:
+            records = {}
+            self._entries[chat_id] = (time.monotonic() + self.ttl, records)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        records[collection_name] = copy.deepcopy(record)
+
+    def update(self, chat_id: int, collection_name: str, fields: Dict[str, Any]) -> None:
+        """
+        Применяет $set-обновление к закэшированной записи.
+        Если записи нет в кэше (или она отсутствует в базе), она сбрасывается.
+        """
+        records = self._entry(chat_id)
+        if records is None or records.get(collection_name) is None:
+            self.invalidate(chat_id, collection_name)
+            return
+
+        self._bump(chat_id)
+        records[collection_name].update(copy.deepcopy(fields))
+
+    def invalidate(self, chat_id: int, collection_name: Optional[str] = None) -> None:
+        """Сбрасывает запись коллекции или все состояние пользователя"""
+        # Поколение меняется и без записи в кэше: ее может загружать
+        # параллельный запрос
+        self._bump(chat_id)
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            return
+
+        self.invalidations += 1
+        if collection_name is None:
+            del self._entries[chat_id]
+        else:
+            entry[1].pop(collection_name, None)
+
+    def clear(self) -> None:
+        """Полностью очищает кэш"""
+        self._entries.clear()
+        self._generations.clear()
+        self._epoch += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и промахов кэша"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "stale_loads": self.stale_loads,
+        }
@@ -0,0 +1,229 @@
+from pymongo import UpdateOne
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from services.logging import logs_bot
+from database.settingsdata import CACHED_COLLECTIONS, db, user_cache
+from config.config import get_config
+import asyncio
+
+config = get_config()
+
+# Формат, в котором даты раньше хранились строками
+LEGACY_DATE_FORMAT = "%H:%M %d-%m-%Y"
+
+# Поля с датами, которые переводятся из строк в BSON datetime
+DATETIME_FIELDS: Dict[str, List[str]] = {
+    "Users": ["created_at"],
+    "UsersAI": ["created_at"],
+    "UsersPayPass": ["created_at", "updated_pass", "expiration_date"],
+    "ChatHistory": ["timestamp"],
+    "VoiceMessages": ["timestamp"],
+    "VoiceExamples": ["created_at"],
+}
+
+# Коллекция логов (записи без expire_at не удаляются TTL-индексом)
+LOGS_COLLECTION = "logs_json"
+
+# Коллекция с контрольными точками миграций
+MIGRATIONS_COLLECTION = "Migrations"
+
+
+def parse_datetime(value: Any) -> Optional[datetime]:
+    """
+    Приводит дату из базы к datetime.
+    Понимает как BSON datetime, так и строки старого формата "%H:%M %d-%m-%Y".
+
+    Args:
+        value: Значение поля из MongoDB
+
+    Returns:
+        Optional[datetime]: Дата или None, если значение пустое или нераспознано
+    """
+    if isinstance(value, datetime):
+        return value
+    if not value or not isinstance(value, str):
+        return None
+
+    for date_format in (LEGACY_DATE_FORMAT, "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+async def _backfill_collection(
+    collection_name: str, fields: List[str], batch_size: int, pause: float
+) -> int:
+    """
+    Переводит строковые даты одной коллекции в datetime пакетами по _id.
+    После каждого пакета сохраняет контрольную точку, поэтому прерванная
+    миграция продолжается с того же места.
+
+    Returns:
+        int: Количество обновленных документов
+    """
+    collection = db[collection_name]
+    migrations = db[MIGRATIONS_COLLECTION]
+    checkpoint_id = f"datetime_backfill:{collection_name}"
+    cached = collection_name in CACHED_COLLECTIONS
+
+    checkpoint = await migrations.find_one({"_id": checkpoint_id}) or {}
+    if checkpoint.get("done"):
+        return 0
+
+    query: Dict[str, Any] = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    last_id = checkpoint.get("last_id")
+    converted = 0
+    skipped = 0
+
+    while True:
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+
+        documents = (
+            await collection.find(query, {"chatId": 1, **{field: 1 for field in fields}})
+            .sort("_id", 1)
+            .limit(batch_size)
+            .to_list(batch_size)
+        )
+        if not documents:
+            break
+
+        operations = []
+        for document in documents:
+            for field in fields:
+                value = document.get(field)
+                if not isinstance(value, str):
+                    continue
+                parsed = parse_datetime(value)
+                if parsed is None:
+                    skipped += 1
+                    continue
+                # Условие на старое значение не перезаписывает свежие изменения
+                operations.append(
+                    UpdateOne(
+                        {"_id": document["_id"], field: value},
+                        {"$set": {field: parsed}},
+                    )
+                )
+
+        if operations:
+            result = await collection.bulk_write(operations, ordered=False)
+            converted += result.modified_count
+            if cached:
+                # Закэшированные записи пользователей хранят старые строки
+                for document in documents:
+                    if "chatId" in document:
+                        user_cache.invalidate(document["chatId"], collection_name)
+
+        last_id = documents[-1]["_id"]
+        await migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"last_id": last_id, "updated_at": datetime.now()}},
+            upsert=True,
+        )
+        await asyncio.sleep(pause)
+
+    await migrations.update_one(
+        {"_id": checkpoint_id},
+        {"$set": {"done": True, "updated_at": datetime.now()}},
+        upsert=True,
+    )
+    if skipped:
+        await logs_bot(
+            "warning",
+            f"Datetime backfill skipped {skipped} unparsable values in {collection_name}",
+        )
+    return converted
+
+
+async def backfill_datetime_fields(batch_size: int = 500, pause: float = 0.1) -> None:
+    """
+    Фоновая миграция: переводит строковые даты во всех коллекциях
+    из DATETIME_FIELDS в BSON datetime.
+
+    Args:
+        batch_size: Количество документов в одном пакете
+        pause: Пауза между пакетами в секундах, чтобы не нагружать базу
+    """
+    for collection_name, fields in DATETIME_FIELDS.items():
+        try:
+            converted = await _backfill_collection(
+                collection_name, fields, batch_size, pause
+            )
+            if converted:
+                await logs_bot(
+                    "info",
+                    f"Datetime backfill converted {converted} documents in {collection_name}",
+                )
+        except Exception as e:
+            await logs_bot(
+                "error", f"Datetime backfill error in {collection_name}: {str(e)}"
+            )
+
+
+async def expire_legacy_logs() -> int:
+    """
+    Проставляет старым записям логов поля level, created_at (datetime)
+    и expire_at, чтобы их тоже удалял TTL-индекс по сроку хранения уровня.
+
+    Returns:
+        int: Количество обновленных записей
+    """
+    retention = config.logs.retention_days
+    try:
+        result = await db[LOGS_COLLECTION].update_many(
+            {"expire_at": {"$exists": False}},
+            [
+                {
+                    "$set": {
+                        "level": {"$toLower": {"$ifNull": ["$level", "$data.level"]}},
+                        "created_at": {
+                            "$cond": [
+                                {"$eq": [{"$type": "$created_at"}, "date"]},
+                                "$created_at",
+                                {
+                                    "$dateFromString": {
+                                        "dateString": "$created_at",
+                                        "format": LEGACY_DATE_FORMAT,
+                                        "onError": "$$NOW",
+                                        "onNull": "$$NOW",
+                                    }
+                                },
+                            ]
+                        },
+                    }
+                },
+                {
+                    "$set": {
+                        "expire_at": {
+                            "$dateAdd": {
+                                "startDate": "$created_at",
+                                "unit": "day",
+                                "amount": {
+                                    "$switch": {
+                                        "branches": [
+                                            {"case": {"$eq": ["$level", level]}, "then": days}
+                                            for level, days in retention.items()
+                                        ],
+                                        "default": max(retention.values()),
+                                    }
+                                },
+                            }
+                        }
+                    }
+                },
+            ],
+        )
+        if result.modified_count:
+            await logs_bot(
+                "info", "Set expire_at on %s legacy log records", result.modified_count
+            )
+        return result.modified_count
+    except Exception as e:
+        await logs_bot("error", f"Legacy log expiry error: {str(e)}")
+        return 0
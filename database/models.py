@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import Optional, Dict
+from datetime import datetime
 
 
 class Users(BaseModel):
@@ -7,43 +8,43 @@ class Users(BaseModel):
     idMessage: Optional[str] = None
     last_name: Optional[str] = None
     first_name: Optional[str] = None
-    created_at: str
+    created_at: datetime
 
 
 class UsersAI(BaseModel):
     chatId: int
     typeGpt: str
     in_progress: bool = False
-    created_at: str
+    created_at: datetime
 
 
 class UsersPayPass(BaseModel):
     chatId: int
     id_pass: int
     tarif: str
-    updated_pass: str
-    expiration_date: Optional[str] = None  # Date when subscription expires
-    created_at: str
+    updated_pass: datetime
+    expiration_date: Optional[datetime] = None  # Date when subscription expires
+    created_at: datetime
 
 
 class StaticAIUsers(BaseModel):
     chatId: int
     dataGpt: Dict[str, int]
-    created_at: str
+    created_at: datetime
 
 
 class ChatHistory(BaseModel):
-    user_id: int
+    chatId: int
     message_text: str
     response_text: str
     model: str
-    timestamp: str
-    context: str
+    timestamp: datetime
 
 
 class VoiceMessages(BaseModel):
     chatId: int
-    voice_data: str
+    blob_key: str  # sha256 содержимого в blob_store
+    storage: str  # gridfs или local
+    size: int
     voice_name: str
-    virtual_path: str
-    created_at: str
+    timestamp: datetime
@@ -1,16 +1,124 @@
-from pymongo import MongoClient
+from pymongo import (
+    AsyncMongoClient,
+    IndexModel,
+    ReturnDocument,
+    UpdateOne,
+    ASCENDING,
+    DESCENDING,
+)
+from pymongo.errors import (
+    OperationFailure,
+    DuplicateKeyError,
+    InvalidOperation,
+    ClientBulkWriteException,
+)
 from config.config import get_config
-from typing import Any, List, Dict
+from database.blobstore import BlobSource, create_blob_store
+from database.cache import UserStateCache
+from typing import Any, AsyncIterator, List, Dict, Optional, Iterable, Tuple
 from services.logging import logs_bot
-from datetime import datetime
-import json
+from services.metrics import MongoCommandMetrics
+from services.tracing import traced
+from datetime import datetime, timedelta
+import asyncio
+import base64
+import re
 
 config = get_config()
 
-# Подключение к MongoDB
-client = MongoClient(config.db.uri)
+# Подключение к MongoDB (асинхронный драйвер с настраиваемым пулом соединений)
+client = AsyncMongoClient(
+    config.db.uri,
+    maxPoolSize=config.db.max_pool_size,
+    minPoolSize=config.db.min_pool_size,
+    maxIdleTimeMS=config.db.max_idle_time_ms,
+    waitQueueTimeoutMS=config.db.wait_queue_timeout_ms,
+    serverSelectionTimeoutMS=config.db.server_selection_timeout_ms,
+    event_listeners=[MongoCommandMetrics()],
+)
 db = client[config.db.name]
 
+# Хранилище аудио (GridFS или локальная файловая система, см. BLOB_BACKEND)
+blob_store = create_blob_store(db, config.storage)
+
+# Кэш состояния пользователей: записи этих коллекций читаются через кэш,
+# а все изменения в settingsdata обновляют или сбрасывают его
+CACHED_COLLECTIONS = {"Users", "UsersAI", "UsersPayPass", "StaticAIUsers"}
+user_cache = UserStateCache(config.cache.max_users, config.cache.ttl_seconds)
+
+# Фоновые задачи (ленивые миграции), запущенные из функций модуля
+_background_tasks = set()
+
+# Ключ аудио - sha256 содержимого в hex
+AUDIO_KEY_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+# Поддерживает ли сервер client-level bulkWrite (MongoDB 8.0+)
+_client_bulk_write_supported = True
+
+# Индексы, на которые опираются запросы бота.
+# Уникальные индексы соответствуют коллекциям, где логика upsert
+# предполагает одну запись на пользователя (или на пару ключей).
+REQUIRED_INDEXES: Dict[str, List[IndexModel]] = {
+    "Users": [
+        IndexModel([("chatId", ASCENDING)], name="chatId_unique", unique=True),
+    ],
+    "UsersAI": [
+        IndexModel([("chatId", ASCENDING)], name="chatId_unique", unique=True),
+    ],
+    "UsersPayPass": [
+        IndexModel([("chatId", ASCENDING)], name="chatId_unique", unique=True),
+    ],
+    "StaticAIUsers": [
+        IndexModel([("chatId", ASCENDING)], name="chatId_unique", unique=True),
+    ],
+    "ChatHistory": [
+        IndexModel(
+            [("chatId", ASCENDING), ("timestamp", DESCENDING)],
+            name="chatId_timestamp",
+        ),
+        IndexModel([("timestamp", ASCENDING)], name="timestamp"),
+    ],
+    "VoiceMessages": [
+        IndexModel([("blob_key", ASCENDING)], name="blob_key"),
+        # Ключи старых записей, сохраненных до перехода на blob_store
+        IndexModel([("virtual_path", ASCENDING)], name="virtual_path"),
+        IndexModel(
+            [("chatId", ASCENDING), ("voice_name", ASCENDING)],
+            name="chatId_voice_name_unique",
+            unique=True,
+        ),
+    ],
+    "VoiceExamples": [
+        IndexModel(
+            [("voice_id", ASCENDING), ("quality", ASCENDING)],
+            name="voice_id_quality_unique",
+            unique=True,
+        ),
+    ],
+    # Логи: выборка последних записей по уровню и удаление по сроку хранения
+    "logs_json": [
+        IndexModel(
+            [("level", ASCENDING), ("created_at", DESCENDING)],
+            name="level_created_at",
+        ),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+        IndexModel([("expire_at", ASCENDING)], name="expire_at_ttl", expireAfterSeconds=0),
+    ],
+    # События использования моделей, TTS и STT для аналитики
+    "UsageEvents": [
+        IndexModel(
+            [("kind", ASCENDING), ("created_at", ASCENDING)],
+            name="kind_created_at",
+        ),
+    ],
+}
+
+# Файлы GridFS: имя - ключ содержимого, одна копия на ключ
+if config.storage.backend == "gridfs":
+    REQUIRED_INDEXES[f"{config.storage.bucket_name}.files"] = [
+        IndexModel([("filename", ASCENDING)], name="filename_unique", unique=True),
+    ]
+
 
 async def init_db():
     """
@@ -18,10 +126,124 @@ async def init_db():
     """
     try:
         # Проверяем подключение к базе данных
-        client.admin.command("ping")
-        await logs_bot("info", "MongoDB connection established successfully")
+        await client.admin.command("ping")
+        await logs_bot(
+            "info",
+            f"MongoDB connection established successfully "
+            f"(pool size {config.db.min_pool_size}-{config.db.max_pool_size})",
+        )
     except Exception as e:
         await logs_bot("error", f"MongoDB connection error: {str(e)}")
+        return
+
+    await ensure_indexes()
+    await verify_indexes()
+
+
+async def ensure_indexes() -> Dict[str, List[str]]:
+    """
+    Идемпотентно создает индексы из REQUIRED_INDEXES.
+    Уже существующие индексы с теми же параметрами MongoDB пропускает.
+
+    Returns:
+        Dict[str, List[str]]: Индексы, которые не удалось создать, по коллекциям
+    """
+    failed = {}
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        for index in indexes:
+            name = index.document["name"]
+            try:
+                await collection.create_indexes([index])
+            except OperationFailure as e:
+                # Например, дубликаты chatId мешают построить уникальный индекс
+                failed.setdefault(collection_name, []).append(name)
+                await logs_bot(
+                    "error",
+                    f"Failed to create index {name} on {collection_name}: {str(e)}",
+                )
+    return failed
+
+
+async def verify_indexes(
+    check_usage: bool = False, min_age: timedelta = timedelta(days=7)
+) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Сверяет индексы в базе с REQUIRED_INDEXES и сообщает о проблемах:
+    - missing: объявленные индексы, которых нет в коллекции
+    - unused (только при check_usage): необъявленные индексы без единого
+      обращения по данным $indexStats. Счетчики сбрасываются при создании
+      индекса и перезапуске MongoDB, поэтому индексы, счет которых идет
+      меньше min_age, не учитываются.
+
+    При запуске бота проверяются только отсутствующие индексы,
+    отчет об использовании строится по запросу (GET /admin/indexes).
+
+    Returns:
+        Dict[str, Dict[str, List[str]]]: Отчет по коллекциям
+    """
+    report = {}
+    counted_before = datetime.utcnow() - min_age
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        required = {index.document["name"] for index in indexes}
+        try:
+            existing = [index["name"] async for index in await collection.list_indexes()]
+            unused = []
+            if check_usage:
+                stats = await collection.aggregate([{"$indexStats": {}}])
+                async for stat in stats:
+                    name = stat["name"]
+                    accesses = stat["accesses"]
+                    since = accesses.get("since")
+                    if (
+                        name != "_id_"
+                        and name not in required
+                        and accesses["ops"] == 0
+                        and since is not None
+                        and since.replace(tzinfo=None) <= counted_before
+                    ):
+                        unused.append(name)
+        except Exception as e:
+            await logs_bot(
+                "error", f"Index verification error for {collection_name}: {str(e)}"
+            )
+            continue
+
+        missing = [
+            index.document["name"]
+            for index in indexes
+            if index.document["name"] not in existing
+        ]
+
+        if missing:
+            await logs_bot(
+                "warning", f"Missing indexes on {collection_name}: {', '.join(missing)}"
+            )
+        if unused:
+            await logs_bot(
+                "info", f"Unused indexes on {collection_name}: {', '.join(unused)}"
+            )
+        report[collection_name] = {"missing": missing, "unused": unused}
+
+    return report
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """
+    Возвращает счетчики кэша состояния пользователей (попадания, промахи и т.д.).
+    """
+    return user_cache.stats()
+
+
+async def close_db():
+    """
+    Закрывает пул соединений MongoDB.
+    """
+    try:
+        await client.close()
+    except Exception as e:
+        await logs_bot("error", f"MongoDB close error: {str(e)}")
 
 
 async def add_to_table(collection_name: str, data: dict) -> Any:
@@ -47,12 +269,20 @@ async def add_to_table(collection_name: str, data: dict) -> Any:
             filter_criteria = {"chatId": data["chatId"]}
 
             # Для всех коллекций используем upsert
-            result = collection.update_one(filter_criteria, {"$set": data}, upsert=True)
+            result = await collection.update_one(
+                filter_criteria, {"$set": data}, upsert=True
+            )
+
+            if collection_name in CACHED_COLLECTIONS:
+                if result.upserted_id is None:
+                    user_cache.update(data["chatId"], collection_name, data)
+                else:
+                    user_cache.invalidate(data["chatId"], collection_name)
 
             return result.upserted_id or result.modified_count
 
         # Для остальных коллекций - обычная вставка
-        result = collection.insert_one(data)
+        result = await collection.insert_one(data)
         return result.inserted_id
 
     except Exception as e:
@@ -74,7 +304,7 @@ async def get_table_data(collection_name: str) -> List[dict]:
     try:
         collection = db[collection_name]
         # Добавляем фильтр для поиска по chatId
-        records = list(collection.find({}))
+        records = await collection.find({}).to_list(None)
         if not records:
             await logs_bot("warning", f"No records found in {collection_name}")
         return records
@@ -84,6 +314,136 @@ async def get_table_data(collection_name: str) -> List[dict]:
         return []
 
 
+@traced()
+async def get_user_data(collection_name: str, chat_id: int) -> Optional[dict]:
+    """
+    Получает запись конкретного пользователя из коллекции по chatId.
+    Записи коллекций из CACHED_COLLECTIONS читаются через кэш состояния.
+
+    Аргументы:
+        collection_name: str - Название коллекции
+        chat_id: int - ID пользователя
+
+    Возвращает:
+        Словарь с данными пользователя или None, если запись не найдена
+    """
+    cached = collection_name in CACHED_COLLECTIONS
+    if cached:
+        found, record = user_cache.get(chat_id, collection_name)
+        if found:
+            return record
+
+    try:
+        collection = db[collection_name]
+        # Поколение до запроса: запись, измененная во время find_one,
+        # не перезапишется устаревшим документом
+        generation = user_cache.generation(chat_id)
+        record = await collection.find_one({"chatId": chat_id})
+        if cached:
+            user_cache.set(chat_id, collection_name, record, generation)
+        return record
+    except Exception as e:
+        error_msg = f"Error retrieving user {chat_id} from {collection_name}: {str(e)}"
+        await logs_bot("error", error_msg)
+        return None
+
+
+async def get_user_data_multi(
+    chat_id: int, collection_names: Iterable[str]
+) -> Dict[str, Optional[dict]]:
+    """
+    Получает записи пользователя сразу из нескольких коллекций.
+    Запросы выполняются параллельно, по одному find_one на коллекцию.
+
+    Аргументы:
+        chat_id: int - ID пользователя
+        collection_names: Iterable[str] - Названия коллекций
+
+    Возвращает:
+        Словарь {название коллекции: запись пользователя или None}
+    """
+    names = list(collection_names)
+    records = await asyncio.gather(
+        *(get_user_data(name, chat_id) for name in names)
+    )
+    return dict(zip(names, records))
+
+
+async def get_user_records(
+    collection_name: str, chat_id: int, projection: Optional[dict] = None
+) -> List[dict]:
+    """
+    Получает все записи пользователя из коллекции (например, историю чата).
+
+    Аргументы:
+        collection_name: str - Название коллекции
+        chat_id: int - ID пользователя
+        projection: dict - Поля, которые нужно вернуть (по умолчанию все)
+
+    Возвращает:
+        Список записей пользователя
+    """
+    try:
+        collection = db[collection_name]
+        return await collection.find({"chatId": chat_id}, projection).to_list(None)
+    except Exception as e:
+        error_msg = f"Error retrieving records of {chat_id} from {collection_name}: {str(e)}"
+        await logs_bot("error", error_msg)
+        return []
+
+
+async def get_chat_history_page(
+    chat_id: int, limit: int = 10
+) -> Tuple[List[dict], int]:
+    """
+    Последние реплики пользователя и общее число его реплик.
+    Сортировка и ограничение выполняются на сервере по индексу chatId_timestamp.
+
+    Аргументы:
+        chat_id: int - ID пользователя
+        limit: int - Сколько последних реплик вернуть
+
+    Возвращает:
+        Кортеж (реплики от новых к старым, всего реплик)
+    """
+    try:
+        collection = db["ChatHistory"]
+        history, total = await asyncio.gather(
+            collection.find({"chatId": chat_id}, {"context": 0})
+            .sort("timestamp", -1)
+            .limit(limit)
+            .to_list(limit),
+            collection.count_documents({"chatId": chat_id}),
+        )
+        return history, total
+    except Exception as e:
+        await logs_bot("error", f"Error retrieving chat history of {chat_id}: {str(e)}")
+        return [], 0
+
+
+async def get_model_counts(chat_id: int) -> Dict[str, int]:
+    """
+    Число реплик пользователя по моделям (группировка на сервере).
+
+    Аргументы:
+        chat_id: int - ID пользователя
+
+    Возвращает:
+        Словарь {модель: число реплик}
+    """
+    try:
+        cursor = await db["ChatHistory"].aggregate(
+            [
+                {"$match": {"chatId": chat_id}},
+                {"$group": {"_id": {"$ifNull": ["$model", "unknown"]}, "count": {"$sum": 1}}},
+            ]
+        )
+        return {item["_id"]: item["count"] async for item in cursor}
+    except Exception as e:
+        await logs_bot("error", f"Error counting models of {chat_id}: {str(e)}")
+        return {}
+
+
 async def delete_table(collection_name: str, user_id: int) -> bool:
     """
     Удаляет запись из коллекции по её идентификатору.
@@ -97,7 +457,8 @@ async def delete_table(collection_name: str, user_id: int) -> bool:
     """
     try:
         collection = db[collection_name]
-        result = collection.delete_one({"chatId": user_id})
+        result = await collection.delete_one({"chatId": user_id})
+        user_cache.invalidate(user_id, collection_name)
         if result.deleted_count > 0:
             await logs_bot(
                 "info", f"Deleted record from {collection_name} for user_id: {user_id}"
@@ -120,8 +481,7 @@ async def get_state_ai(chat_id: int) -> Dict[str, int]:
     Получает и расшифровывает статистику использования GPT для конкретного пользователя.
     """
     try:
-        collection = db["StaticAIUsers"]
-        record = collection.find_one({"chatId": chat_id})
+        record = await get_user_data("StaticAIUsers", chat_id)
 
         if record and "dataGpt" in record:
             return record["dataGpt"]
@@ -133,26 +493,195 @@ async def get_state_ai(chat_id: int) -> Dict[str, int]:
         return {}
 
 
+def _quota_value(model: str) -> dict:
+    """
+    Выражение для значения лимита модели внутри dataGpt.
+    Имена моделей содержат точки (gemini-1.5-flash), поэтому вместо
+    dot-notation используется $getField.
+    """
+    return {"$getField": {"field": {"$literal": model}, "input": "$dataGpt"}}
+
+
+def _quota_update(model: str, delta: int) -> list:
+    """Pipeline-обновление, изменяющее лимит модели на delta."""
+    return [
+        {
+            "$set": {
+                "dataGpt": {
+                    "$setField": {
+                        "field": {"$literal": model},
+                        "input": "$dataGpt",
+                        "value": {
+                            "$add": [{"$ifNull": [_quota_value(model), 0]}, delta]
+                        },
+                    }
+                }
+            }
+        }
+    ]
+
+
+@traced()
+async def decrement_quota(chat_id: int, model: str) -> Optional[int]:
+    """
+    Атомарно списывает один запрос модели у пользователя, если лимит > 0.
+    Проверка и уменьшение выполняются на сервере одной операцией,
+    поэтому параллельные запросы не могут уйти в минус.
+
+    Args:
+        chat_id: int - ID пользователя
+        model: str - Название модели (ключ в dataGpt)
+
+    Returns:
+        Optional[int]: Новый остаток или None, если запросов не осталось
+
+    Raises:
+        Exception: Ошибка базы данных пробрасывается (после записи в лог),
+            чтобы сбой не выглядел для пользователя как исчерпанный лимит
+    """
+    try:
+        collection = db["StaticAIUsers"]
+        record = await collection.find_one_and_update(
+            {"chatId": chat_id, "$expr": {"$gt": [_quota_value(model), 0]}},
+            _quota_update(model, -1),
+            projection={"_id": 0, "dataGpt": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+    except Exception as e:
+        await logs_bot("error", f"Error decrementing {model} quota for {chat_id}: {str(e)}")
+        raise
+    if record is None:
+        return None
+    user_cache.update(chat_id, "StaticAIUsers", record)
+    return record["dataGpt"][model]
+
+
+async def set_quota_limits(
+    chat_id: int, limits: Dict[str, int], increment: bool = False
+) -> bool:
+    """
+    Устанавливает (или при increment=True увеличивает) лимиты моделей
+    пользователя одним атомарным обновлением. Меняются только переданные
+    модели, поэтому параллельные списания остальных лимитов не теряются.
+
+    Args:
+        chat_id: int - ID пользователя
+        limits: Dict[str, int] - Новые значения (или прибавки) по моделям
+        increment: bool - Прибавить значения к текущим вместо замены
+
+    Returns:
+        bool: True, если обновление выполнено
+    """
+    stages = [{"$set": {"dataGpt": {"$ifNull": ["$dataGpt", {}]}}}]
+    for model, value in limits.items():
+        if increment:
+            stages.extend(_quota_update(model, value))
+        else:
+            stages.append(
+                {
+                    "$set": {
+                        "dataGpt": {
+                            "$setField": {
+                                "field": {"$literal": model},
+                                "input": "$dataGpt",
+                                "value": {"$literal": value},
+                            }
+                        }
+                    }
+                }
+            )
+    try:
+        collection = db["StaticAIUsers"]
+        await collection.update_one({"chatId": chat_id}, stages, upsert=True)
+        user_cache.invalidate(chat_id, "StaticAIUsers")
+        return True
+    except Exception as e:
+        await logs_bot("error", f"Error setting quota limits for {chat_id}: {str(e)}")
+        return False
+
+
+@traced()
+async def refund_quota(chat_id: int, model: str, amount: int = 1) -> Optional[int]:
+    """
+    Атомарно возвращает пользователю списанные запросы модели
+    (например, если запрос к AI завершился ошибкой).
+
+    Args:
+        chat_id: int - ID пользователя
+        model: str - Название модели (ключ в dataGpt)
+        amount: int - Количество возвращаемых запросов
+
+    Returns:
+        Optional[int]: Новый остаток или None в случае ошибки
+    """
+    try:
+        collection = db["StaticAIUsers"]
+        record = await collection.find_one_and_update(
+            {"chatId": chat_id},
+            _quota_update(model, amount),
+            projection={"_id": 0, "dataGpt": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if record is None:
+            return None
+        user_cache.update(chat_id, "StaticAIUsers", record)
+        return record["dataGpt"][model]
+    except Exception as e:
+        await logs_bot("error", f"Error refunding {model} quota for {chat_id}: {str(e)}")
+        return None
+
+
+@traced()
 async def get_user_history(user_id: int, limit: int = 10) -> list:
     """
-    Получает историю сообщений пользователя для контекста OpenAI
+    Получает последние реплики пользователя для контекста OpenAI.
+
+    Каждая запись ChatHistory хранит одну реплику (сообщение и ответ),
+    поэтому чтение ограничено окном из limit записей независимо от длины диалога.
+
+    Args:
+        user_id: int - ID пользователя
+        limit: int - Размер окна последних реплик
+
+    Returns:
+        list: Список кортежей (message_text, response_text) в хронологическом порядке
     """
     try:
         collection = db["ChatHistory"]
-        # Получаем последние сообщения пользователя
-        messages = list(
-            collection.find({"chatId": user_id}).sort("timestamp", -1).limit(limit)
+        # Получаем последние реплики без старого поля context (оно может быть большим),
+        # но отмечаем записи, в которых оно еще осталось
+        messages = (
+            await collection.find(
+                {"chatId": user_id},
+                {
+                    "message_text": 1,
+                    "response_text": 1,
+                    "legacy_context": {
+                        "$ne": [{"$type": "$context"}, "missing"]
+                    },
+                },
+            )
+            .sort("timestamp", -1)
+            .limit(limit)
+            .to_list(limit)
         )
 
+        # Старые записи с накопленным контекстом переводим в формат реплик в фоне
+        if any(msg.get("legacy_context") for msg in messages):
+            _run_in_background(_migrate_chat_history(user_id))
+
         # Формируем список кортежей с текстами сообщений и ответов
         history = [
-            (msg["message_text"], msg["response_text"], json.loads(msg["context"]))
-            for msg in messages
+            (msg.get("message_text", ""), msg.get("response_text", ""))
+            for msg in reversed(messages)
+            if msg.get("message_text")
         ]
 
         await logs_bot(
             "debug",
-            f"Retrieved history for user {user_id}, messages count: {len(messages)}",
+            "Retrieved history for user %s, messages count: %s",
+            user_id,
+            len(messages),
         )
         return history
 
@@ -161,9 +690,41 @@ async def get_user_history(user_id: int, limit: int = 10) -> list:
         return []
 
 
+async def _migrate_chat_history(user_id: int) -> None:
+    """
+    Удаляет накопленный контекст (поле context) из старых записей истории
+    пользователя: реплика уже хранится в message_text и response_text.
+    """
+    try:
+        result = await db["ChatHistory"].update_many(
+            {"chatId": user_id, "context": {"$exists": True}},
+            {"$unset": {"context": ""}},
+        )
+        await logs_bot(
+            "info",
+            f"Migrated {result.modified_count} chat history records for user {user_id}",
+        )
+    except Exception as e:
+        await logs_bot("error", f"Error migrating chat history for {user_id}: {e}")
+
+
+def _run_in_background(coro) -> None:
+    """Запускает корутину в фоне, сохраняя ссылку на задачу до ее завершения"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+@traced()
 async def save_chat_history(history_data: Dict[str, Any]) -> bool:
     """
-    Сохраняет сообщение в историю чата
+    Добавляет в историю чата одну реплику (сообщение пользователя и ответ модели)
+
+    Args:
+        history_data: Dict[str, Any] - user_id, message_text, response_text, model
+
+    Returns:
+        bool: True если запись сохранена
     """
     try:
         collection = db["ChatHistory"]
@@ -173,7 +734,6 @@ async def save_chat_history(history_data: Dict[str, Any]) -> bool:
         message = history_data["message_text"]
         response = history_data["response_text"]
         model = history_data["model"]
-        context = history_data["context"]
 
         # Создаем новую запись
         chat_data = {
@@ -181,16 +741,15 @@ async def save_chat_history(history_data: Dict[str, Any]) -> bool:
             "message_text": message,
             "response_text": response,
             "model": model,
-            "context": json.dumps(context),  # Store context as JSON
-            "timestamp": datetime.now().strftime("%H:%M %d-%m-%Y"),
+            "timestamp": datetime.now(),
         }
 
         # Сохраняем новое сообщение
-        result = collection.insert_one(chat_data)
+        result = await collection.insert_one(chat_data)
 
         success = bool(result.inserted_id)
         if success:
-            await logs_bot("debug", f"Saved message for user {user_id}")
+            await logs_bot("debug", "Saved message for user %s", user_id)
         return success
 
     except Exception as e:
@@ -198,6 +757,83 @@ async def save_chat_history(history_data: Dict[str, Any]) -> bool:
         return False
 
 
+async def get_chat_usage_stats(start_date: datetime, end_date: datetime) -> Dict[str, Any]:
+    """
+    Считает статистику запросов за период агрегациями на сервере:
+    ChatHistory (индекс по timestamp) и UsageEvents (индекс kind_created_at).
+
+    Args:
+        start_date: datetime - Начало периода (включительно)
+        end_date: datetime - Конец периода (не включительно)
+
+    Returns:
+        Dict[str, Any]: total_requests, requests_by_model, requests_by_day,
+        а также по UsageEvents: average_response_time, average_time_to_first_byte
+        (секунды), input_tokens, output_tokens, errors
+    """
+    pipeline = [
+        {"$match": {"timestamp": {"$gte": start_date, "$lt": end_date}}},
+        {
+            "$facet": {
+                "by_model": [{"$group": {"_id": "$model", "count": {"$sum": 1}}}],
+                "by_day": [
+                    {
+                        "$group": {
+                            "_id": {
+                                "$dateToString": {
+                                    "format": "%Y-%m-%d",
+                                    "date": "$timestamp",
+                                }
+                            },
+                            "count": {"$sum": 1},
+                        }
+                    }
+                ],
+            }
+        },
+    ]
+    cursor = await db["ChatHistory"].aggregate(pipeline)
+    result = (await cursor.to_list(1))[0]
+
+    # Время ответа и токены берутся из событий использования (UsageEvents)
+    usage_pipeline = [
+        {
+            "$match": {
+                "kind": "chat",
+                "created_at": {"$gte": start_date, "$lt": end_date},
+            }
+        },
+        {
+            "$group": {
+                "_id": None,
+                "response_time": {
+                    "$avg": {"$cond": [{"$eq": ["$outcome", "ok"]}, "$duration", None]}
+                },
+                "time_to_first_byte": {"$avg": "$ttfb"},
+                "input_tokens": {"$sum": "$input_tokens"},
+                "output_tokens": {"$sum": "$output_tokens"},
+                "errors": {"$sum": {"$cond": [{"$eq": ["$outcome", "ok"]}, 0, 1]}},
+            }
+        },
+    ]
+    cursor = await db["UsageEvents"].aggregate(usage_pipeline)
+    usage = (await cursor.to_list(1) or [{}])[0]
+
+    requests_by_model = {
+        item["_id"] or "unknown": item["count"] for item in result["by_model"]
+    }
+    return {
+        "total_requests": sum(requests_by_model.values()),
+        "requests_by_model": requests_by_model,
+        "requests_by_day": {item["_id"]: item["count"] for item in result["by_day"]},
+        "average_response_time": usage.get("response_time") or 0,
+        "average_time_to_first_byte": usage.get("time_to_first_byte") or 0,
+        "input_tokens": usage.get("input_tokens", 0),
+        "output_tokens": usage.get("output_tokens", 0),
+        "errors": usage.get("errors", 0),
+    }
+
+
 async def delete_user_history(user_id: int) -> bool:
     """
     Удаляет всю историю чата пользователя и сбрасывает контекст
@@ -211,11 +847,14 @@ async def delete_user_history(user_id: int) -> bool:
     try:
         # Удаляем историю чата
         chat_history = db["ChatHistory"]
-        chat_history.delete_many({"chatId": user_id})
+        await chat_history.delete_many({"chatId": user_id})
 
         # Сбрасываем контекст в usersAI
         users_ai = db["UsersAI"]
-        users_ai.update_one({"chatId": user_id}, {"$set": {"context": []}}, upsert=True)
+        await users_ai.update_one(
+            {"chatId": user_id}, {"$set": {"context": []}}, upsert=True
+        )
+        user_cache.update(user_id, "UsersAI", {"context": []})
 
         await logs_bot("info", f"Successfully deleted history for user {user_id}")
         return True
@@ -238,7 +877,7 @@ async def user_exists(collection_name: str, chat_id: int) -> bool:
     """
     try:
         collection = db[collection_name]
-        result = collection.find_one({"chatId": chat_id})
+        result = await collection.find_one({"chatId": chat_id}, {"_id": 1})
         return result is not None
     except Exception as e:
         await logs_bot(
@@ -247,134 +886,255 @@ async def user_exists(collection_name: str, chat_id: int) -> bool:
         return False
 
 
+@traced()
+async def ensure_user_documents(
+    chat_id: int, documents: Dict[str, dict]
+) -> Optional[List[str]]:
+    """
+    Создает отсутствующие записи пользователя сразу в нескольких коллекциях.
+    Используется upsert с $setOnInsert: значения по умолчанию применяются
+    только при вставке, существующие записи не изменяются.
+    Все операции отправляются одним bulkWrite (MongoDB 8.0+), на старых
+    серверах - параллельными upsert-запросами.
+
+    Args:
+        chat_id: int - ID пользователя
+        documents: Dict[str, dict] - Документы по умолчанию по коллекциям
+
+    Returns:
+        Optional[List[str]]: Коллекции, в которых была создана новая запись,
+        или None в случае ошибки
+    """
+    global _client_bulk_write_supported
+
+    names = list(documents)
+    defaults = [
+        {key: value for key, value in documents[name].items() if key != "chatId"}
+        for name in names
+    ]
+
+    if _client_bulk_write_supported:
+        try:
+            result = await client.bulk_write(
+                [
+                    UpdateOne(
+                        {"chatId": chat_id},
+                        {"$setOnInsert": default},
+                        upsert=True,
+                        namespace=f"{config.db.name}.{name}",
+                    )
+                    for name, default in zip(names, defaults)
+                ],
+                ordered=False,
+                verbose_results=True,
+            )
+            created = [
+                names[index]
+                for index, update in result.update_results.items()
+                if update.upserted_id is not None
+            ]
+            for name in created:
+                user_cache.invalidate(chat_id, name)
+            return created
+        except InvalidOperation:
+            # Сервер не поддерживает client-level bulkWrite
+            _client_bulk_write_supported = False
+        except ClientBulkWriteException as e:
+            # Параллельный запрос уже создал часть записей (уникальный индекс chatId)
+            user_cache.invalidate(chat_id)
+            await logs_bot(
+                "warning", f"Concurrent user bootstrap for {chat_id}: {str(e)}"
+            )
+            return []
+        except Exception as e:
+            await logs_bot("error", f"Error creating user {chat_id}: {str(e)}")
+            return None
+
+    async def upsert(name: str, default: dict) -> bool:
+        try:
+            result = await db[name].update_one(
+                {"chatId": chat_id}, {"$setOnInsert": default}, upsert=True
+            )
+            return result.upserted_id is not None
+        except DuplicateKeyError:
+            return False
+
+    try:
+        created = await asyncio.gather(
+            *(upsert(name, default) for name, default in zip(names, defaults))
+        )
+        created = [name for name, was_created in zip(names, created) if was_created]
+        for name in created:
+            user_cache.invalidate(chat_id, name)
+        return created
+    except Exception as e:
+        await logs_bot("error", f"Error creating user {chat_id}: {str(e)}")
+        return None
+
+
+def is_audio_key(value: str) -> bool:
+    """Проверяет, является ли значение ключом аудио (sha256 в hex)"""
+    return bool(AUDIO_KEY_PATTERN.fullmatch(value or ""))
+
+
+@traced()
 async def save_voice_to_mongodb(
-    user_id: int, voice_data: bytes, voice_name: str
+    user_id: int, voice_data: BlobSource, voice_name: str
 ) -> str:
     """
-    Сохраняет голосовое сообщение в MongoDB
+    Сохраняет голосовое сообщение: аудио записывается в хранилище blob_store,
+    а в VoiceMessages остаются только ключ содержимого и метаданные
 
     Args:
         user_id: ID пользователя
-        voice_data: Бинарные данные голосового сообщения
+        voice_data: Бинарные данные или файловый объект (например, BytesIO)
         voice_name: Имя файла голосового сообщения
 
     Returns:
-        str: Виртуальный путь к файлу (для совместимости)
+        str: Ключ аудио (sha256 содержимого) для последующих запросов
     """
     try:
         collection = db["VoiceMessages"]
 
-        # Создаем виртуальный путь к файлу (для совместимости)
-        virtual_path = f"./info_save/audio_user/{user_id}_{voice_name}"
-
-        # Кодируем бинарные данные в base64 для хранения в MongoDB
-        import base64
-
-        encoded_data = base64.b64encode(voice_data).decode("utf-8")
-
-        # Создаем запись для MongoDB
-        voice_record = {
-            "chatId": user_id,
-            "voice_data": encoded_data,
-            "voice_name": voice_name,
-            "virtual_path": virtual_path,
-            "timestamp": datetime.now().strftime("%H:%M %d-%m-%Y"),
-        }
-
-        # Проверяем, существует ли уже запись для этого пользователя и голоса
-        existing = collection.find_one({"chatId": user_id, "voice_name": voice_name})
-        if existing:
-            # Обновляем существующую запись
-            collection.update_one(
-                {"chatId": user_id, "voice_name": voice_name},
-                {
-                    "$set": {
-                        "voice_data": encoded_data,
-                        "virtual_path": virtual_path,
-                        "timestamp": datetime.now().strftime("%H:%M %d-%m-%Y"),
-                    }
+        audio_key = await blob_store.put(voice_data, voice_name)
+        size = await blob_store.size(audio_key)
+
+        # Одна запись на пару (chatId, voice_name); старые base64-данные удаляются
+        previous = await collection.find_one_and_update(
+            {"chatId": user_id, "voice_name": voice_name},
+            {
+                "$set": {
+                    "blob_key": audio_key,
+                    "storage": config.storage.backend,
+                    "size": size,
+                    "timestamp": datetime.now(),
                 },
-            )
-            await logs_bot("info", f"Updated voice message for user {user_id}")
-        else:
-            # Создаем новую запись
-            collection.insert_one(voice_record)
-            await logs_bot("info", f"Created new voice message for user {user_id}")
+                "$unset": {"voice_data": "", "virtual_path": ""},
+            },
+            projection={"_id": 0, "blob_key": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        action = "Updated" if previous is not None else "Created new"
+        await logs_bot("info", f"{action} voice message for user {user_id}")
 
-        return virtual_path
+        old_key = (previous or {}).get("blob_key")
+        if old_key and old_key != audio_key:
+            await _delete_orphaned_blob(old_key)
+
+        return audio_key
 
     except Exception as e:
         await logs_bot("error", f"Error saving voice to MongoDB: {str(e)}")
         return None
 
 
-async def get_voice_from_mongodb(virtual_path: str) -> bytes:
+async def _delete_orphaned_blob(audio_key: str) -> None:
+    """
+    Удаляет объект из blob_store, если на него больше не ссылается
+    ни одно голосовое сообщение и ни один пример голоса.
+    """
+    try:
+        if await db["VoiceMessages"].find_one({"blob_key": audio_key}, {"_id": 1}):
+            return
+        if await db["VoiceExamples"].find_one({"audio_key": audio_key}, {"_id": 1}):
+            return
+        await blob_store.delete(audio_key)
+    except Exception as e:
+        await logs_bot("error", f"Error deleting orphaned blob {audio_key}: {str(e)}")
+
+
+async def _find_voice_record(audio_key: str) -> Optional[dict]:
+    """
+    Ищет запись голосового сообщения по ключу аудио.
+    Ключи старых записей (виртуальные пути) ищутся по индексу virtual_path.
+    """
+    collection = db["VoiceMessages"]
+    field = "blob_key" if is_audio_key(audio_key) else "virtual_path"
+
+    voice_record = await collection.find_one({field: audio_key})
+    if not voice_record:
+        await logs_bot("warning", f"Voice message not found in MongoDB: {audio_key}")
+    return voice_record
+
+
+async def _stream_voice_record(voice_record: dict) -> AsyncIterator[bytes]:
+    """Отдает данные записи частями: из blob_store или из старого base64-поля"""
+    if voice_record.get("blob_key"):
+        async for chunk in blob_store.stream(voice_record["blob_key"]):
+            yield chunk
+    elif voice_record.get("voice_data"):
+        # Записи, сохраненные до перехода на blob_store
+        yield base64.b64decode(voice_record["voice_data"])
+
+
+async def get_voice_size(audio_key: str) -> Optional[int]:
     """
-    Получает голосовое сообщение из MongoDB по виртуальному пути
+    Возвращает размер голосового сообщения без загрузки данных
 
     Args:
-        virtual_path: Виртуальный путь к файлу
+        audio_key: Ключ аудио, полученный при сохранении
 
     Returns:
-        bytes: Бинарные данные голосового сообщения или None
+        Optional[int]: Размер в байтах или None, если сообщение не найдено
     """
     try:
-        collection = db["VoiceMessages"]
+        voice_record = await _find_voice_record(audio_key)
+        if not voice_record:
+            return None
+        if voice_record.get("blob_key"):
+            return await blob_store.size(voice_record["blob_key"])
+        if voice_record.get("voice_data"):
+            return len(voice_record["voice_data"]) * 3 // 4
+        return None
+    except Exception as e:
+        await logs_bot("error", f"Error retrieving voice size: {str(e)}")
+        return None
 
-        # Логируем для отладки
-        await logs_bot(
-            "debug", f"Searching for voice message with path: {virtual_path}"
-        )
 
-        voice_record = collection.find_one({"virtual_path": virtual_path})
+async def stream_voice(audio_key: str) -> AsyncIterator[bytes]:
+    """
+    Потоково читает голосовое сообщение частями размера config.storage.chunk_size,
+    не загружая файл в память целиком
 
-        if voice_record and "voice_data" in voice_record:
-            # Декодируем данные из base64
-            import base64
+    Args:
+        audio_key: Ключ аудио, полученный при сохранении
 
-            try:
-                voice_data = base64.b64decode(voice_record["voice_data"])
-                await logs_bot(
-                    "debug", f"Found voice data of size: {len(voice_data)} bytes"
-                )
-                return voice_data
-            except Exception as decode_error:
-                await logs_bot(
-                    "error", f"Error decoding base64 data: {str(decode_error)}"
-                )
-                return None
+    Yields:
+        bytes: Очередная часть аудиофайла
+    """
+    voice_record = await _find_voice_record(audio_key)
+    if not voice_record:
+        return
+    async for chunk in _stream_voice_record(voice_record):
+        yield chunk
 
-        # Если не нашли по точному пути, попробуем поискать по частичному совпадению
+
+async def get_voice_from_mongodb(audio_key: str) -> bytes:
+    """
+    Получает голосовое сообщение целиком по ключу аудио.
+    Для отправки и обработки больших файлов используйте stream_voice.
+
+    Args:
+        audio_key: Ключ аудио, полученный при сохранении
+
+    Returns:
+        bytes: Бинарные данные голосового сообщения или None
+    """
+    try:
+        voice_record = await _find_voice_record(audio_key)
         if not voice_record:
-            await logs_bot(
-                "debug", f"Trying partial match for voice path: {virtual_path}"
-            )
-            # Извлекаем имя файла из виртуального пути
-            file_name = virtual_path.split("/")[-1]
-            voice_records = list(
-                collection.find({"voice_name": {"$regex": file_name.split("_")[-1]}})
-            )
+            return None
 
-            if voice_records and len(voice_records) > 0:
-                voice_record = voice_records[0]  # Берем первое совпадение
-                if "voice_data" in voice_record:
-                    import base64
-
-                    try:
-                        voice_data = base64.b64decode(voice_record["voice_data"])
-                        await logs_bot(
-                            "debug",
-                            f"Found voice data by partial match, size: {len(voice_data)} bytes",
-                        )
-                        return voice_data
-                    except Exception as decode_error:
-                        await logs_bot(
-                            "error", f"Error decoding base64 data: {str(decode_error)}"
-                        )
-                        return None
-
-        await logs_bot("warning", f"Voice message not found in MongoDB: {virtual_path}")
-        return None
+        voice_data = b"".join(
+            [chunk async for chunk in _stream_voice_record(voice_record)]
+        )
+        if not voice_data:
+            await logs_bot("warning", f"Voice data is empty: {audio_key}")
+            return None
+
+        await logs_bot("debug", "Found voice data of size: %s bytes", len(voice_data))
+        return voice_data
 
     except Exception as e:
         await logs_bot("error", f"Error retrieving voice from MongoDB: {str(e)}")
@@ -386,25 +1146,29 @@ async def get_voice_from_mongodb(virtual_path: str) -> bytes:
 
 async def get_voice_example(voice_id: str, quality: str) -> str:
     """
-    Получает виртуальный путь к примеру голоса из базы данных
+    Получает ключ аудио примера голоса из базы данных
 
     Args:
         voice_id: Идентификатор голоса (alloy, echo, и т.д.)
         quality: Качество голоса (tts или tts-hd)
 
     Returns:
-        str: Виртуальный путь к примеру голоса или None
+        str: Ключ аудио примера голоса или None
     """
     try:
         collection = db["VoiceExamples"]
-        example = collection.find_one({"voice_id": voice_id, "quality": quality})
+        example = await collection.find_one({"voice_id": voice_id, "quality": quality})
 
-        if example and "virtual_path" in example:
-            await logs_bot("debug", f"Found voice example for {voice_id} ({quality})")
-            return example["virtual_path"]
+        # Старые примеры хранят виртуальный путь вместо ключа
+        audio_key = example and (example.get("audio_key") or example.get("virtual_path"))
+        if audio_key:
+            await logs_bot("debug", "Found voice example for %s (%s)", voice_id, quality)
+            return audio_key
 
         # Если пример не найден, возвращаем None
-        await logs_bot("debug", f"Voice example not found for {voice_id} ({quality})")
+        await logs_bot(
+            "debug", "Voice example not found for %s (%s)", voice_id, quality
+        )
         return None
 
     except Exception as e:
@@ -412,14 +1176,14 @@ async def get_voice_example(voice_id: str, quality: str) -> str:
         return None
 
 
-async def save_voice_example(voice_id: str, quality: str, virtual_path: str) -> bool:
+async def save_voice_example(voice_id: str, quality: str, audio_key: str) -> bool:
     """
-    Сохраняет виртуальный путь к примеру голоса в базу данных
+    Сохраняет ключ аудио примера голоса в базу данных
 
     Args:
         voice_id: Идентификатор голоса
         quality: Качество голоса (tts или tts-hd)
-        virtual_path: Виртуальный путь к примеру голоса
+        audio_key: Ключ аудио примера голоса
 
     Returns:
         bool: True если сохранение успешно, False в противном случае
@@ -427,25 +1191,15 @@ async def save_voice_example(voice_id: str, quality: str, virtual_path: str) ->
     try:
         collection = db["VoiceExamples"]
 
-        # Проверяем, существует ли уже пример для этого голоса и качества
-        example = collection.find_one({"voice_id": voice_id, "quality": quality})
-
-        if example:
-            # Обновляем существующий пример
-            collection.update_one(
-                {"voice_id": voice_id, "quality": quality},
-                {"$set": {"virtual_path": virtual_path}},
-            )
-        else:
-            # Создаем новый пример
-            collection.insert_one(
-                {
-                    "voice_id": voice_id,
-                    "quality": quality,
-                    "virtual_path": virtual_path,
-                    "created_at": datetime.now().strftime("%H:%M %d-%m-%Y"),
-                }
-            )
+        await collection.update_one(
+            {"voice_id": voice_id, "quality": quality},
+            {
+                "$set": {"audio_key": audio_key},
+                "$unset": {"virtual_path": ""},
+                "$setOnInsert": {"created_at": datetime.now()},
+            },
+            upsert=True,
+        )
 
         await logs_bot("info", f"Saved voice example for {voice_id} ({quality})")
         return True
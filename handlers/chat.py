@@ -7,7 +7,12 @@ from Messages.settingsmsg import new_message, update_message, send_typing_action
 from services.logging import logs_bot
 from handlers.voice_chat import tts_process_text
 from aiogram.fsm.context import FSMContext
-from database.settingsdata import get_state_ai, get_table_data, add_to_table
+from database.settingsdata import (
+    get_user_data,
+    add_to_table,
+    decrement_quota,
+    refund_quota,
+)
 from services.openai_services import AI_choice
 from services.anti_spam import spam_controller
 from Messages.inlinebutton import get_general_menu, ai_menu_back
@@ -51,16 +56,26 @@ async def handle_message(message: types.Message, state: FSMContext):
 
         chat_id = message.from_user.id
         await create_user_data(message)
-        data_gpt = await get_state_ai(chat_id)
 
         # Получаем данные конкретного пользователя по chat_id
-        user_ai_list = await get_table_data("UsersAI")
-        user_ai = next((u for u in user_ai_list if u.get("chatId") == chat_id), {})
+        user_ai = await get_user_data("UsersAI", chat_id) or {}
 
         type_gpt = user_ai.get("typeGpt", "gpt-4o-mini")
-        remaining_requests = data_gpt.get(type_gpt, 0)
 
-        if remaining_requests <= 0:
+        # Списываем запрос заранее одной атомарной операцией,
+        # при неудачной обработке он будет возвращен
+        try:
+            remaining_requests = await decrement_quota(chat_id, type_gpt)
+        except Exception:
+            # Сбой базы данных - это не исчерпанный лимит
+            await new_message(
+                message,
+                "⚠️ Не удалось проверить доступные запросы. Попробуйте позже.",
+                None,
+            )
+            return
+
+        if remaining_requests is None:
             await new_message(
                 message,
                 "⚠️ У вас закончились доступные запросы для этого типа AI. "
@@ -76,33 +91,29 @@ async def handle_message(message: types.Message, state: FSMContext):
 
             await send_typing_action(message, "typing")
             # Запускаем запрос к OpenAI
-            response, msg_old = await AI_choice(message, type_gpt)
+            response, msg_old, ok = await AI_choice(message, type_gpt)
             # stop_typing = await maintain_typing_status(message)
 
             # Останавливаем статус "печатает" после получения ответа
 
-            if response is not None and msg_old is not None:
-                # Получаем текущие данные пользователя
-                user_data = await get_state_ai(message.from_user.id)
-
-                # Уменьшаем количество доступных запросов только для указанной модели
-                if type_gpt in user_data:
-                    user_data[type_gpt] -= 1
-
-                # Обновляем статистику в StaticAIUsers
-                await add_to_table(
-                    "StaticAIUsers",
-                    {"chatId": message.from_user.id, "dataGpt": user_data},
-                )
-
+            if ok and msg_old is not None:
                 await asyncio.sleep(0.10)
                 # Обновляем сообщение с клавиатурой для последнего сообщения
                 keyboard = await ai_menu_back()
 
                 await update_message(msg_old, str(response), keyboard)
             else:
-                error_msg = "Не удалось обработать ваш запрос. Попробуйте позже."
-                await new_message(message, error_msg, None)
+                # Генерация не удалась: возвращаем списанный запрос
+                await refund_quota(chat_id, type_gpt)
+                error_msg = response or "Не удалось обработать ваш запрос. Попробуйте позже."
+                if msg_old is not None:
+                    await update_message(msg_old, str(error_msg), None)
+                else:
+                    await new_message(message, error_msg, None)
+
+        except Exception:
+            await refund_quota(chat_id, type_gpt)
+            raise
 
         finally:
             # Устанавливаем in_progress в False после обработки
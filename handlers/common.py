@@ -2,33 +2,26 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from Messages.inlinebutton import get_main_keyboard_mode, backstep_menu_message, get_general_menu, get_profile_keyboard, get_pay_keyboard, backstep_menu_message_pass
 from Messages.localization import MESSAGES
-from database.settingsdata import get_table_data, add_to_table, delete_user_history
+from database.settingsdata import get_user_data, get_user_data_multi, add_to_table, delete_user_history
 from Messages.settingsmsg import new_message, update_message
 from services.logging import logs_bot
 from aiogram.fsm.context import FSMContext
 import asyncio
 from handlers.subscription_manager import update_pass_date
+from Messages.utils import parse_datetime, format_datetime
 from datetime import datetime
+from config.models import MODEL_ROUTES
 
 router = Router(name=__name__)
 
-@router.callback_query(F.data.in_({
-    "Mode", "Mode_new", 
-    "claude-3-5-sonnet", "claude-3-haiku", 
-    "gpt-4o-mini", "gemini-1.5-flash", "gpt-4o",
-    "deepseek-v3", "deepseek-r1", "o1-mini", "o1", "o3-mini"
-}))
+@router.callback_query(F.data.in_({"Mode", "Mode_new", *MODEL_ROUTES}))
 async def general_main_mode(call: CallbackQuery):
-    get_data_user = await get_table_data("UsersAI")
-    
-    # Находим пользователя в списке записей
-    user_data = next((user for user in get_data_user if user.get('chatId') == call.from_user.id), None)
+    user_data = await get_user_data("UsersAI", call.from_user.id)
     current_model = user_data.get('typeGpt', 'gpt-4o-mini') if user_data else 'gpt-4o-mini'
 
     if call.data != "Mode" and call.data != "Mode_new":
         # Проверяем, есть ли у пользователя доступные запросы для выбранной модели
-        static_ai_users = await get_table_data("StaticAIUsers")
-        user_limits = next((user for user in static_ai_users if user.get('chatId') == call.from_user.id), None)
+        user_limits = await get_user_data("StaticAIUsers", call.from_user.id)
         
         if user_limits and call.data in user_limits.get('dataGpt', {}):
             remaining_requests = user_limits['dataGpt'].get(call.data, 0)
@@ -109,14 +102,12 @@ async def general_main_help(call: CallbackQuery):
 async def general_main_profile(call: CallbackQuery):
     try:
         # Получаем данные пользователя асинхронно
-        users_data = await get_table_data("Users")
-        users_ai = await get_table_data("UsersAI")
-        users_pay_pass = await get_table_data("UsersPayPass")
-
-        # Находим данные конкретного пользователя
-        user_data = next((u for u in users_data if u.get("chatId") == call.from_user.id), None)
-        user_ai = next((u for u in users_ai if u.get("chatId") == call.from_user.id), None)
-        user_pay_pass = next((u for u in users_pay_pass if u.get("chatId") == call.from_user.id), None)
+        records = await get_user_data_multi(
+            call.from_user.id, ["Users", "UsersAI", "UsersPayPass"]
+        )
+        user_data = records["Users"]
+        user_ai = records["UsersAI"]
+        user_pay_pass = records["UsersPayPass"]
         await update_pass_date(call.from_user.id, user_pay_pass)
 
         # Проверяем наличие всех необходимых данных
@@ -127,14 +118,14 @@ async def general_main_profile(call: CallbackQuery):
         if not user_pay_pass:
             raise ValueError("User payment data not found")
             
-        created_at = user_data.get('created_at', 'Неизвестно')
+        created_at = format_datetime(user_data.get('created_at'))
         
         # Форматируем данные
         user_id = call.from_user.id
         gpt_model = user_ai.get('typeGpt', 'gpt-4o-mini')
         subscription = user_pay_pass.get('tarif', 'NoBase')
-        updated_pass = user_pay_pass.get('updated_pass', 'Неизвестно')
-        expiration_date = user_pay_pass.get('expiration_date', 'Неизвестно')
+        updated_pass = format_datetime(user_pay_pass.get('updated_pass'))
+        expiration_date = format_datetime(user_pay_pass.get('expiration_date'))
         
         # Получаем локализованные сообщения
         profile_text = (
@@ -165,21 +156,18 @@ async def general_main_profile(call: CallbackQuery):
 
 @router.callback_query(F.data == "Pay")
 async def general_main_pay(call: CallbackQuery):
-    users_pay_pass = await get_table_data("UsersPayPass")
-    user_pay_pass = next((u for u in users_pay_pass if u.get("chatId") == call.from_user.id), None)
+    user_pay_pass = await get_user_data("UsersPayPass", call.from_user.id)
     
     # Check if user has a subscription
     if user_pay_pass and user_pay_pass.get("tarif", "NoBase") != "NoBase":
         # Get expiration date
-        expiration_date = user_pay_pass.get("expiration_date", "")
+        expiration_dt = parse_datetime(user_pay_pass.get("expiration_date"))
         current_time = datetime.now()
         subscription_type = user_pay_pass.get("tarif", "NoBase")
         
         try:
-            # Parse expiration date
-            if expiration_date:
-                expiration_dt = datetime.strptime(expiration_date, "%H:%M %d-%m-%Y")
-                
+            # Check expiration date
+            if expiration_dt:
                 # Calculate days remaining
                 days_remaining = (expiration_dt - current_time).days
                 
@@ -204,7 +192,7 @@ async def general_main_pay(call: CallbackQuery):
                         call.message, 
                         f"{MESSAGES['ru']['subscription_active']}\n"
                         f"Тип подписки: {subscription_type}\n"
-                        f"Действует до: {expiration_date}\n"
+                        f"Действует до: {format_datetime(expiration_dt)}\n"
                         f"Осталось дней: {days_remaining}",
                         await get_pay_keyboard(True, subscription_type == "Base")  # True indicates renewal option, second param for upgrade option
                     )
@@ -9,9 +9,10 @@ from Messages.inlinebutton import (
     get_subscription_type_keyboard,
 )
 from Messages.settingsmsg import new_message, update_message
-from database.settingsdata import add_to_table, get_table_data
+from database.settingsdata import add_to_table, get_user_data, set_quota_limits
 from datetime import datetime, timedelta
 from services.logging import logs_bot
+from Messages.utils import parse_datetime, format_datetime
 
 router = Router(name=__name__)
 
@@ -71,38 +72,21 @@ async def successful_payment(message: Message, bot: Bot):
     is_renewal = len(payload.split("_")) > 2 and payload.split("_")[2] == "renewal"
 
     # Get user data
-    users_pay_pass = await get_table_data("UsersPayPass")
-    user_pay_pass = next(
-        (u for u in users_pay_pass if u.get("chatId") == message.from_user.id), None
-    )
+    user_pay_pass = await get_user_data("UsersPayPass", message.from_user.id)
 
     # Calculate expiration date
     current_time = datetime.now()
 
+    existing_expiration = (
+        parse_datetime(user_pay_pass.get("expiration_date")) if user_pay_pass else None
+    )
+
     # If renewal and existing subscription hasn't expired yet, add 30 days to current expiration date
-    if is_renewal and user_pay_pass and user_pay_pass.get("expiration_date"):
-        try:
-            existing_expiration = datetime.strptime(
-                user_pay_pass.get("expiration_date"), "%H:%M %d-%m-%Y"
-            )
-            # Only use existing date if it's in the future
-            if existing_expiration > current_time:
-                expiration_date = (existing_expiration + timedelta(days=30)).strftime(
-                    "%H:%M %d-%m-%Y"
-                )
-            else:
-                # If expired, start fresh from current date
-                expiration_date = (current_time + timedelta(days=30)).strftime(
-                    "%H:%M %d-%m-%Y"
-                )
-        except ValueError:
-            # If date parsing fails, default to 30 days from now
-            expiration_date = (current_time + timedelta(days=30)).strftime(
-                "%H:%M %d-%m-%Y"
-            )
+    if is_renewal and existing_expiration and existing_expiration > current_time:
+        expiration_date = existing_expiration + timedelta(days=30)
     else:
-        # New subscription or no valid existing date
-        expiration_date = (current_time + timedelta(days=30)).strftime("%H:%M %d-%m-%Y")
+        # New subscription, expired or no valid existing date
+        expiration_date = current_time + timedelta(days=30)
 
     # Update user subscription
     await add_to_table(
@@ -110,7 +94,7 @@ async def successful_payment(message: Message, bot: Bot):
         {
             "chatId": message.from_user.id,
             "tarif": subscription_type,
-            "updated_pass": current_time.strftime("%H:%M %d-%m-%Y"),
+            "updated_pass": current_time,
             "expiration_date": expiration_date,
         },
     )
@@ -140,30 +124,18 @@ async def successful_payment(message: Message, bot: Bot):
             api_limits[api_name] = limits[model_name]
 
     # Update user limits
-    await add_to_table(
-        "StaticAIUsers", {"chatId": message.from_user.id, "dataGpt": api_limits}
-    )
+    await set_quota_limits(message.from_user.id, api_limits)
 
     # Determine if this was a renewal with added days
     renewal_message = ""
-    if is_renewal and user_pay_pass and user_pay_pass.get("expiration_date"):
-        try:
-            old_expiration = datetime.strptime(
-                user_pay_pass.get("expiration_date"), "%H:%M %d-%m-%Y"
-            )
-            if old_expiration > current_time:
-                days_added = (
-                    datetime.strptime(expiration_date, "%H:%M %d-%m-%Y")
-                    - old_expiration
-                ).days
-                renewal_message = f"\nДобавлено дней: {days_added}"
-        except ValueError:
-            pass
+    if is_renewal and existing_expiration and existing_expiration > current_time:
+        days_added = (expiration_date - existing_expiration).days
+        renewal_message = f"\nДобавлено дней: {days_added}"
 
     # Send confirmation message with proper escaping for Telegram's MarkdownV2
     confirmation_message = (
         f"Спасибо за оплату! Ваша подписка {subscription_type} активирована.\n"
-        f"Срок действия: до {expiration_date.replace('-', '-')}\n"
+        f"Срок действия: до {format_datetime(expiration_date)}\n"
         f"{renewal_message}\n"
         f"Теперь у вас доступны расширенные возможности!"
     )
@@ -182,10 +154,7 @@ async def pay_card_button(call: CallbackQuery):
 @router.callback_query(F.data == "RenewSubscription")
 async def renew_subscription(call: CallbackQuery, bot: Bot):
     # Get user data
-    users_pay_pass = await get_table_data("UsersPayPass")
-    user_pay_pass = next(
-        (u for u in users_pay_pass if u.get("chatId") == call.from_user.id), None
-    )
+    user_pay_pass = await get_user_data("UsersPayPass", call.from_user.id)
 
     if not user_pay_pass:
         await call.answer("Ошибка: данные подписки не найдены")
@@ -238,60 +207,56 @@ async def update_pass_date(chat_id: int, user_pay_pass: dict):
         return
 
     current_time = datetime.now()
-    created_at = current_time.strftime("%H:%M %d-%m-%Y")
 
     # Get expiration date
-    expiration_date = user_pay_pass.get("expiration_date", "")
+    raw_expiration = user_pay_pass.get("expiration_date")
+    expiration_dt = parse_datetime(raw_expiration)
     tarif = user_pay_pass.get("tarif", "NoBase")
 
+    if raw_expiration and expiration_dt is None:
+        await logs_bot(
+            "error", f"Date parsing error for user {chat_id}: {raw_expiration!r}"
+        )
+        return
+
     # If no expiration date set but has a tarif, set one for 30 days
-    if not expiration_date and tarif != "NoBase":
-        expiration_date = (current_time + timedelta(days=30)).strftime("%H:%M %d-%m-%Y")
+    if not expiration_dt and tarif != "NoBase":
+        expiration_dt = current_time + timedelta(days=30)
         await add_to_table(
-            "UsersPayPass", {"chatId": chat_id, "expiration_date": expiration_date}
+            "UsersPayPass", {"chatId": chat_id, "expiration_date": expiration_dt}
         )
 
     # Check if subscription has expired
-    try:
-        if expiration_date:
-            expiration_dt = datetime.strptime(expiration_date, "%H:%M %d-%m-%Y")
-
-            if current_time >= expiration_dt:
-                # Subscription expired, reset to NoBase
-                await logs_bot("info", f"Subscription expired for user {chat_id}")
-
-                await add_to_table(
-                    "UsersPayPass",
-                    {"chatId": chat_id, "tarif": "NoBase", "updated_pass": created_at},
-                )
-
-                # Reset limits to default
-                await add_to_table(
-                    "StaticAIUsers",
-                    {"chatId": int(chat_id), "dataGpt": get_default_limits()},
-                )
-
-                # Notify user about expiration
-                # This would require a bot instance, which we don't have in this function
-                # Consider implementing a notification system elsewhere
-            else:
-                # Subscription still valid
-                await logs_bot(
-                    "debug",
-                    f"Subscription for user {chat_id} is valid until {expiration_date}",
-                )
-    except ValueError as e:
-        await logs_bot("error", f"Date parsing error for user {chat_id}: {str(e)}")
-        return
+    if expiration_dt:
+        if current_time >= expiration_dt:
+            # Subscription expired, reset to NoBase
+            await logs_bot("info", f"Subscription expired for user {chat_id}")
+
+            await add_to_table(
+                "UsersPayPass",
+                {"chatId": chat_id, "tarif": "NoBase", "updated_pass": current_time},
+            )
+
+            # Reset limits to default
+            await set_quota_limits(int(chat_id), get_default_limits())
+
+            # Notify user about expiration
+            # This would require a bot instance, which we don't have in this function
+            # Consider implementing a notification system elsewhere
+        else:
+            # Subscription still valid
+            await logs_bot(
+                "debug",
+                "Subscription for user %s is valid until %s",
+                chat_id,
+                expiration_dt,
+            )
 
 
 @router.callback_query(F.data == "UpgradeToPro")
 async def upgrade_to_pro(call: CallbackQuery, bot: Bot):
     # Get user data
-    users_pay_pass = await get_table_data("UsersPayPass")
-    user_pay_pass = next(
-        (u for u in users_pay_pass if u.get("chatId") == call.from_user.id), None
-    )
+    user_pay_pass = await get_user_data("UsersPayPass", call.from_user.id)
 
     if not user_pay_pass or user_pay_pass.get("tarif", "NoBase") != "Base":
         await call.answer("Ошибка: вы не можете повысить подписку")
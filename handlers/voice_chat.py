@@ -4,7 +4,8 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from Messages.settingsmsg import new_message, update_message, send_typing_action
 from services.logging import logs_bot
-from services.openai_services import OpenAIService
+from services.openai_services import openai_service
+from Messages.utils import VoiceInputFile
 from Messages.inlinebutton import (
     tts_quality_menu,
     ai_menu_back,
@@ -13,15 +14,15 @@ from Messages.inlinebutton import (
 )
 from database.settingsdata import (
     get_state_ai,
-    add_to_table,
-    get_voice_from_mongodb,
+    decrement_quota,
+    refund_quota,
+    get_voice_size,
     get_voice_example,
     save_voice_example,
 )
 import asyncio
 
 router = Router(name=__name__)
-openai_service = OpenAIService()
 
 
 # Определение состояний для FSM
@@ -70,13 +71,13 @@ async def generate_all_examples():
                     continue
 
                 # Генерируем голосовое сообщение
-                virtual_path = await openai_service.text_to_speech(
+                audio_key = await openai_service.text_to_speech(
                     example_text, voice, quality
                 )
 
-                if virtual_path:
+                if audio_key:
                     # Сохраняем пример
-                    await save_voice_example(voice, quality, virtual_path)
+                    await save_voice_example(voice, quality, audio_key)
                     await logs_bot("info", f"Example saved for {voice} ({quality})")
                 else:
                     await logs_bot(
@@ -202,7 +203,7 @@ async def tts_select_voice(call: CallbackQuery, state: FSMContext):
 
         # Получаем данные о выбранном качестве
         data = await state.get_data()
-        await logs_bot("info", f"State data after voice selection: {data}")
+        await logs_bot("debug", lambda: f"State data after voice selection: {data}")
 
         quality = data.get("quality", "tts")
 
@@ -245,55 +246,54 @@ async def tts_example(call: CallbackQuery, state: FSMContext):
         voice = data.get("voice", "alloy")
 
         # Проверяем, есть ли уже сохраненный пример для этого голоса
-        virtual_path = await get_voice_example(voice, quality)
+        audio_key = await get_voice_example(voice, quality)
 
         # Если пример не найден, генерируем новый
-        if not virtual_path:
+        if not audio_key:
             await call.answer("Генерация примера...")
 
-            # Проверяем наличие доступа к выбранному качеству
+            # Списываем запрос (только при первой генерации примера)
             chat_id = call.from_user.id
-            data_gpt = await get_state_ai(chat_id)
+            try:
+                remaining = await decrement_quota(chat_id, quality)
+            except Exception:
+                await call.answer(
+                    "Не удалось проверить доступные запросы. Попробуйте позже.",
+                    show_alert=True,
+                )
+                return
 
-            if data_gpt.get(quality, 0) <= 0:
+            if remaining is None:
                 await call.answer(
                     f"У вас закончились доступные запросы для {quality}",
                     show_alert=True,
                 )
                 return
 
+            await logs_bot("info", f"Decreasing {quality} count to {remaining}")
+
             # Генерируем голосовое сообщение
-            virtual_path = await openai_service.text_to_speech(
+            audio_key = await openai_service.text_to_speech(
                 "Привет, мир!", voice, quality
             )
 
-            if virtual_path:
+            if audio_key:
                 # Сохраняем пример для будущего использования
-                await save_voice_example(voice, quality, virtual_path)
-
-                # Уменьшаем счетчик только при первой генерации
-                user_data = await get_state_ai(chat_id)
-                if quality in user_data:
-                    user_data[quality] -= 1
-                    await logs_bot(
-                        "info", f"Decreasing {quality} count to {user_data[quality]}"
-                    )
-
-                await add_to_table(
-                    "StaticAIUsers", {"chatId": chat_id, "dataGpt": user_data}
-                )
+                await save_voice_example(voice, quality, audio_key)
             else:
+                # Возвращаем списанный запрос
+                await refund_quota(chat_id, quality)
                 await call.answer("Не удалось сгенерировать пример", show_alert=True)
                 return
         else:
             # Если пример уже есть, просто сообщаем пользователю
             await call.answer("Воспроизведение примера...")
 
-        # Получаем данные голосового сообщения из MongoDB
-        voice_data = await get_voice_from_mongodb(virtual_path)
+        # Проверяем, что голосовое сообщение есть в хранилище
+        voice_size = await get_voice_size(audio_key)
 
-        if not voice_data:
-            await logs_bot("error", f"Voice data not found for path: {virtual_path}")
+        if not voice_size:
+            await logs_bot("error", f"Voice data not found for key: {audio_key}")
             await call.answer(
                 "Ошибка при получении голосового сообщения", show_alert=True
             )
@@ -301,10 +301,8 @@ async def tts_example(call: CallbackQuery, state: FSMContext):
 
         # Отправляем голосовое сообщение
         try:
-            # Создаем объект BufferedInputFile из бинарных данных
-            from aiogram.types import BufferedInputFile
-
-            voice_file = BufferedInputFile(voice_data, filename=f"voice_{voice}.mp3")
+            # Файл читается из хранилища частями во время отправки
+            voice_file = VoiceInputFile(audio_key, filename=f"voice_{voice}.mp3")
 
             # Получаем название голоса из словаря
             voice_name_raw = TTS_VOICES.get(voice, voice)
@@ -340,22 +338,11 @@ async def tts_process_text(message: Message, state: FSMContext):
 
         # Получаем данные из состояния
         data = await state.get_data()
-        await logs_bot("info", f"State data: {data}")
+        await logs_bot("debug", lambda: f"State data: {data}")
 
         quality = data.get("quality", "tts")
         voice = data.get("voice", "alloy")
 
-        # Проверяем наличие доступа к выбранному качеству
-        chat_id = message.from_user.id
-        data_gpt = await get_state_ai(chat_id)
-
-        if data_gpt.get(quality, 0) <= 0:
-            await new_message(
-                message, f"У вас закончились доступные запросы для {quality}."
-            )
-            await state.clear()
-            return
-
         # Проверяем текст
         if not message.text or len(message.text.strip()) == 0:
             await new_message(message, "Пожалуйста, введите текст для озвучивания.")
@@ -367,6 +354,23 @@ async def tts_process_text(message: Message, state: FSMContext):
             )
             return
 
+        # Списываем запрос выбранного качества одной атомарной операцией
+        chat_id = message.from_user.id
+        try:
+            remaining = await decrement_quota(chat_id, quality)
+        except Exception:
+            await new_message(
+                message, "Не удалось проверить доступные запросы. Попробуйте позже."
+            )
+            return
+
+        if remaining is None:
+            await new_message(
+                message, f"У вас закончились доступные запросы для {quality}."
+            )
+            await state.clear()
+            return
+
         # Запускаем индикатор "запись голосового сообщения"
         stop_typing = await send_typing_action(message, "typing")
 
@@ -381,23 +385,16 @@ async def tts_process_text(message: Message, state: FSMContext):
             )
             await logs_bot("info", f"Voice generation result: {success}")
 
-            # Если генерация успешна, уменьшаем счетчик
+            # Если генерация успешна, запрос остается списанным
             if success:
-                user_data = await get_state_ai(chat_id)
-                if quality in user_data:
-                    user_data[quality] -= 1
-                    await logs_bot(
-                        "info", f"Decreasing {quality} count to {user_data[quality]}"
-                    )
-
-                await add_to_table(
-                    "StaticAIUsers", {"chatId": chat_id, "dataGpt": user_data}
-                )
+                await logs_bot("info", f"Decreasing {quality} count to {remaining}")
                 # Очищаем состояние ТОЛЬКО если генерация успешна
                 await logs_bot("info", "Clearing state after successful generation")
                 await state.clear()
             else:
-                # Если генерация не удалась, НЕ очищаем состояние, чтобы пользователь мог попробовать снова
+                # Если генерация не удалась, возвращаем запрос и НЕ очищаем состояние,
+                # чтобы пользователь мог попробовать снова
+                await refund_quota(chat_id, quality)
                 await logs_bot("warning", "Voice generation failed, keeping state")
                 await new_message(
                     message,
@@ -443,13 +440,13 @@ async def generate_voice_message(
             f"Calling TTS API with text: '{text[:30]}...', voice: {voice}, model: {model}",
         )
 
-        # Генерируем голосовое сообщение и получаем виртуальный путь
-        virtual_path = await openai_service.text_to_speech(text, voice, model)
+        # Генерируем голосовое сообщение и получаем ключ аудио
+        audio_key = await openai_service.text_to_speech(text, voice, model)
 
         # Добавляем логирование результата
-        await logs_bot("info", f"TTS API returned virtual path: {virtual_path}")
+        await logs_bot("info", f"TTS API returned audio key: {audio_key}")
 
-        if not virtual_path:
+        if not audio_key:
             await logs_bot("error", "Failed to generate voice message")
             await new_message(
                 message,
@@ -457,20 +454,18 @@ async def generate_voice_message(
             )
             return False
 
-        # Получаем данные голосового сообщения из MongoDB
-        voice_data = await get_voice_from_mongodb(virtual_path)
+        # Проверяем, что голосовое сообщение есть в хранилище
+        voice_size = await get_voice_size(audio_key)
 
-        if not voice_data:
-            await logs_bot("error", f"Voice data not found for path: {virtual_path}")
+        if not voice_size:
+            await logs_bot("error", f"Voice data not found for key: {audio_key}")
             await new_message(message, "Ошибка при получении голосового сообщения.")
             return False
 
         # Отправляем голосовое сообщение
         try:
-            # Создаем объект BufferedInputFile из бинарных данных
-            from aiogram.types import BufferedInputFile
-
-            voice_file = BufferedInputFile(voice_data, filename=f"voice_{voice}.mp3")
+            # Файл читается из хранилища частями во время отправки
+            voice_file = VoiceInputFile(audio_key, filename=f"voice_{voice}.mp3")
 
             # Получаем название голоса из словаря
             voice_name_raw = TTS_VOICES.get(voice, voice)
@@ -2,11 +2,19 @@ import asyncio
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from services.app_api import run_fastapi
-from services.logging import logs_bot
+from services.logging import logs_bot, close_logging
+from services.metrics import MetricsMiddleware
+from services.tracing import TracingMiddleware, recorder
+from services.usage import close_usage
+from services.openai_services import openai_service
+from services.loop_monitor import loop_monitor
 
 from config.config import get_config
-from database.settingsdata import init_db
+from database.settingsdata import init_db, close_db
+from database.migrations import backfill_datetime_fields, expire_legacy_logs
 from handlers.chat import router as chat_router
 from handlers.common import router as common_router
 from services.AdminPanel import router as admin_router
@@ -47,19 +55,41 @@ async def main() -> None:
     """
     try:
         await init_db()
+        # Свой сервер Bot API (локальный или тестовый), если задан
+        session = (
+            AiohttpSession(api=TelegramAPIServer.from_base(config.telegram.api_url))
+            if config.telegram.api_url
+            else None
+        )
         bot = Bot(
             token=config.telegram.token,
+            session=session,
             default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN),
         )
         dp = Dispatcher()
+        # Метрики обработчиков (внутренний middleware действует на все роутеры)
+        dp.message.middleware(MetricsMiddleware())
+        dp.callback_query.middleware(MetricsMiddleware())
+        # Трассировка обновлений с сохранением только медленных
+        dp.message.middleware(TracingMiddleware())
+        dp.callback_query.middleware(TracingMiddleware())
 
         await on_routers(dp)
         async with asyncio.TaskGroup() as tg:
             tg.create_task(dp.start_polling(bot))
             tg.create_task(run_fastapi())
+            tg.create_task(backfill_datetime_fields())
+            tg.create_task(expire_legacy_logs())
+            if config.loop_monitor.enabled:
+                tg.create_task(loop_monitor.run())
 
     finally:
         await bot.session.close()
+        await recorder.close()
+        await close_usage()
+        await openai_service.close()
+        await close_db()
+        await close_logging()
 
 
 if __name__ == "__main__":
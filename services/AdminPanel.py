@@ -1,12 +1,14 @@
 from aiogram import Router, types
 from aiogram.filters import Command
-from database.settingsdata import add_to_table, get_state_ai, get_table_data
+from database.settingsdata import add_to_table, get_state_ai, get_table_data, set_quota_limits
 from config.confpaypass import get_paypass
 from services.logging import logs_bot
 from services.openai_services import new_message
-from datetime import datetime
+from aiogram.types import FSInputFile
+from services.profiler import profiler, MAX_DURATION
 from Messages.localization import MESSAGES
 from config.confpaypass import get_default_limits
+import asyncio
 import os
 
 router = Router(name=__name__)
@@ -80,8 +82,7 @@ async def command_reset(message: types.Message):
             try:
                 user_id = int(user_id)
                 # Сбрасываем статистику для указанного пользователя
-                reset_data = get_default_limits()  # Убрали await, так как это синхронная функция
-                await add_to_table("StaticAIUsers", {"chatId": user_id, "dataGpt": reset_data})
+                await set_quota_limits(user_id, get_default_limits())
                 await new_message(message, f"Статистика для пользователя {user_id} сброшена до значений по умолчанию", None)
                 await logs_bot("info", f"Admin {message.from_user.id} reset stats for user {user_id}")
             except ValueError:
@@ -89,8 +90,7 @@ async def command_reset(message: types.Message):
         else:
             # Если ID не указан, сбрасываем статистику для текущего пользователя
             user_id = message.from_user.id
-            reset_data = get_default_limits()  # Убрали await, так как это синхронная функция
-            await add_to_table("StaticAIUsers", {"chatId": user_id, "dataGpt": reset_data})
+            await set_quota_limits(user_id, get_default_limits())
             await new_message(message, "Ваша статистика сброшена до значений по умолчанию", None)
             await logs_bot("info", f"User {user_id} reset their own stats")
     except Exception as e:
@@ -150,14 +150,11 @@ async def command_allboost(message: types.Message):
             # Если ID не указан, берем текущего пользователя
             chat_id = message.from_user.id
         
-        # Получаем текущие данные пользователя
-        existing_data = await get_state_ai(chat_id)
-        
         # Получаем данные о всех моделях из Pro подписки
         paypass = get_paypass("Pro")
         paypass_dict = paypass.dict()
         
-        # Создаем словарь с лимитами 100 для всех моделей
+        # Создаем словарь с прибавкой 100 для всех моделей
         limits = {}
         
         # Маппинг имен моделей из PayPass в API-имена
@@ -179,18 +176,10 @@ async def command_allboost(message: types.Message):
         # Заполняем словарь лимитов
         for model_name, api_name in model_mapping.items():
             if model_name in paypass_dict and model_name not in ["image_recognition", "speech_to_text"]:
-                current_value = existing_data.get(api_name, 0)
-                limits[api_name] = current_value + 100
-        
-        # Создаем или обновляем запись пользователя
-        user_data = {
-            "chatId": chat_id,
-            "dataGpt": limits,
-            "updated_at": datetime.utcnow()
-        }
+                limits[api_name] = 100
         
-        # Сохраняем в базу данных
-        await add_to_table("StaticAIUsers", user_data)
+        # Увеличиваем лимиты на сервере: параллельные списания не теряются
+        await set_quota_limits(chat_id, limits, increment=True)
         
         await new_message(message, f"✅ Все модели AI активированы с лимитом +100 запросов для пользователя {chat_id}!", None) 
         await logs_bot("info", f"Admin {message.from_user.id} activated all models with +100 requests for user {chat_id}")
@@ -198,3 +187,61 @@ async def command_allboost(message: types.Message):
     except Exception as e:
         await new_message(message, f"⚠️ Произошла ошибка при активации моделей: {str(e)}", None)
         await logs_bot("error", f"Error in allboost command: {str(e)}")
+
+
+# Фоновые задачи профилирования: ссылка хранится до завершения задачи
+_profile_tasks = set()
+
+
+async def _finish_profile(message: types.Message, seconds: float):
+    """Ждет окончания профилирования и отправляет отчет администратору"""
+    try:
+        await asyncio.sleep(seconds)
+        artifact = await asyncio.to_thread(profiler.stop)
+
+        if not artifact:
+            await new_message(message, "Профайлер не собрал данных", None)
+            return
+
+        top_lines = "\n".join(
+            f"{own} / {total}  {label}" for label, own, total in profiler.top(10)
+        )
+        await message.answer_document(
+            FSInputFile(artifact),
+            caption=f"Семплов: {profiler.samples}\nФайл collapsed stacks для flamegraph",
+        )
+        await new_message(message, f"Топ функций (свои / со стеком):\n{top_lines}", None)
+    except Exception as e:
+        await logs_bot("error", f"Error in profile task: {str(e)}")
+        await new_message(message, f"Ошибка профилирования: {str(e)}", None)
+
+
+@router.message(Command("profile"))
+async def command_profile(message: types.Message):
+    """Профилирование цикла событий
+    Использование: /profile [секунды] (по умолчанию 30)
+    Обработчик сразу отвечает, отчет присылается по окончании профилирования"""
+    if not await check_admin_access(message):
+        return
+    try:
+        command_parts = message.text.split()
+        try:
+            seconds = float(command_parts[1]) if len(command_parts) > 1 else 30.0
+        except ValueError:
+            await new_message(message, "Ошибка: длительность должна быть числом секунд", None)
+            return
+        seconds = min(max(seconds, 1.0), MAX_DURATION)
+
+        if not profiler.start(seconds):
+            await new_message(message, "Профилирование уже запущено", None)
+            return
+
+        task = asyncio.create_task(_finish_profile(message, seconds))
+        _profile_tasks.add(task)
+        task.add_done_callback(_profile_tasks.discard)
+
+        await logs_bot("info", f"Admin {message.from_user.id} started profiler for {seconds}s")
+        await new_message(message, f"⏱ Профилирование на {seconds:.0f} сек...", None)
+    except Exception as e:
+        await logs_bot("error", f"Error in profile command: {str(e)}")
+        await new_message(message, f"Ошибка профилирования: {str(e)}", None)
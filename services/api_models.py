@@ -20,6 +20,10 @@ class UsageStats(BaseModel):
     requests_by_model: Dict[str, int]
     requests_by_day: Dict[str, int]
     average_response_time: float
+    average_time_to_first_byte: float = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    errors: int = 0
 
 
 class UserDetail(BaseModel):
@@ -1,14 +1,26 @@
-from fastapi import FastAPI, HTTPException, Depends, status, APIRouter
+from fastapi import FastAPI, HTTPException, Depends, status, APIRouter, Query
 from fastapi.security import APIKeyHeader
 import uvicorn
 from config.config import get_config
-from services.logging import logs_bot
+from services.logging import logs_bot, get_log_stats, get_recent_logs, LOG_LEVELS
+from services import metrics
+from services.tracing import recorder as trace_recorder
+from fastapi.responses import Response, FileResponse
+from services.profiler import profiler
+from services.loop_monitor import loop_monitor
+from services.openai_services import openai_service
+from services.circuit_breaker import STATE_VALUES
 from aiohttp import ClientSession
 from contextlib import asynccontextmanager
 import asyncio
 from config.confpaypass import get_paypass
-from datetime import datetime
-from database.settingsdata import get_table_data, get_state_ai, add_to_table
+from datetime import datetime, timedelta
+from database.settingsdata import (
+    get_table_data, get_state_ai, add_to_table, get_user_data, set_quota_limits,
+    get_cache_stats, get_chat_usage_stats, get_chat_history_page, get_model_counts,
+    verify_indexes
+)
+from database.migrations import parse_datetime
 from services.api_models import (
     ModelUpdate, BroadcastMessage, TimeRange, UsageStats,
     UserDetail, SubscriptionUpdate, ChatHistory
@@ -100,6 +112,37 @@ async def read_root():
     """
     return {"message": "AI Bot API", "version": "1.0.0"}
 
+@app.get("/metrics", tags=["general"])
+async def prometheus_metrics():
+    """Метрики в формате Prometheus.
+    
+    Компоненты:
+    - services.metrics: Счетчики и гистограммы обработчиков, моделей, TTS/STT и MongoDB
+    - get_log_stats, get_cache_stats: Состояние очереди логов и кэша
+    - openai_service.limits: Запросы к провайдерам в работе и в очереди
+    - openai_service.breakers: Состояние автоматов защиты провайдеров
+    
+    Эндпоинт без API ключа для сборщика метрик: не публикуйте порт API наружу.
+    
+    Пример вызова:
+    GET /metrics
+    """
+    log_stats = get_log_stats()
+    cache_stats = get_cache_stats()
+    metrics.LOG_QUEUE_DEPTH.set(log_stats["queued"])
+    metrics.LOG_DROPPED.set(log_stats["dropped"])
+    metrics.USER_CACHE_SIZE.set(cache_stats["size"])
+    metrics.USER_CACHE_HIT_RATE.set(cache_stats["hit_rate"])
+    if openai_service.limits is not None:
+        for name, limiter_stats in openai_service.limits.stats().items():
+            metrics.PROVIDER_IN_FLIGHT.labels(name).set(limiter_stats["in_flight"])
+            metrics.PROVIDER_WAITING.labels(name).set(limiter_stats["waiting"])
+    if openai_service.breakers is not None:
+        for name, breaker_stats in openai_service.breakers.stats().items():
+            metrics.CIRCUIT_STATE.labels(name).set(STATE_VALUES[breaker_stats["state"]])
+    body, content_type = metrics.render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/ping", tags=["general"])
 async def ping(api_key: str = Depends(verify_api_key)):
     """Эндпоинт для проверки работоспособности API.
@@ -127,8 +170,7 @@ async def update_model(model_data: ModelUpdate, api_key: str = Depends(verify_ap
     
     Компоненты:
     - get_table_data: Получение данных пользователей
-    - get_state_ai: Получение текущего состояния AI
-    - add_to_table: Обновление данных в таблице
+    - set_quota_limits: Атомарная установка лимита модели
     
     Пример вызова:
     POST /admin/update_model
@@ -145,12 +187,9 @@ async def update_model(model_data: ModelUpdate, api_key: str = Depends(verify_ap
         for user in users:
             user_id = user.get("chatId")
             if user_id:
-                ai_state = await get_state_ai(user_id)
-                ai_state[model_data.model_name] = model_data.available_requests
-                await add_to_table("StaticAIUsers", {
-                    "chatId": user_id,
-                    "dataGpt": ai_state
-                })
+                await set_quota_limits(
+                    user_id, {model_data.model_name: model_data.available_requests}
+                )
         
         return {"status": "success", "message": f"Updated {len(users)} users"}
     except Exception as e:
@@ -169,9 +208,9 @@ async def update_subscription(
     """Обновление подписки пользователя.
     
     Компоненты:
-    - get_table_data: Получение данных пользователя
-    - get_state_ai: Получение состояния AI
+    - get_user_data: Получение данных пользователя
     - add_to_table: Обновление данных в таблице
+    - set_quota_limits: Атомарное увеличение лимитов моделей
     
     Пример вызова:
     POST /admin/update_subscription
@@ -184,9 +223,8 @@ async def update_subscription(
     }
     """
     try:
-        users = await get_table_data("Users")
-        users = [u for u in users if u.get("chatId") == sub_data.user_id]
-        if not users:
+        user = await get_user_data("Users", sub_data.user_id)
+        if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User with ID {sub_data.user_id} not found"
@@ -200,7 +238,7 @@ async def update_subscription(
         if sub_data.expiry_date:
             try:
                 expiry_date = datetime.strptime(sub_data.expiry_date, "%Y-%m-%d")
-                update_data["expiry_date"] = expiry_date
+                update_data["expiration_date"] = expiry_date
             except ValueError as e:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -212,14 +250,11 @@ async def update_subscription(
         
         # Обновляем лимиты для Premium подписки
         if sub_data.tariff == "Premium":
-            # Получаем текущие данные пользователя
-            existing_data = await get_state_ai(sub_data.user_id)
-            
             # Получаем данные о всех моделях из Pro подписки
             paypass = get_paypass("Pro")
             paypass_dict = paypass.dict()
             
-            # Создаем словарь с лимитами 100 для всех моделей
+            # Создаем словарь с прибавкой 100 для всех моделей
             limits = {}
             
             # Маппинг имен моделей из PayPass в API-имена
@@ -241,18 +276,10 @@ async def update_subscription(
             # Заполняем словарь лимитов
             for model_name, api_name in model_mapping.items():
                 if model_name in paypass_dict and model_name not in ["image_recognition", "speech_to_text"]:
-                    current_value = existing_data.get(api_name, 0)
-                    limits[api_name] = current_value + 100
-            
-            # Создаем или обновляем запись пользователя
-            user_data = {
-                "chatId": sub_data.user_id,
-                "dataGpt": limits,
-                "updated_at": datetime.now().replace(second=0, microsecond=0)
-            }
+                    limits[api_name] = 100
             
-            # Сохраняем в базу данных
-            await add_to_table("StaticAIUsers", user_data)
+            # Увеличиваем лимиты на сервере: параллельные списания не теряются
+            await set_quota_limits(sub_data.user_id, limits, increment=True)
         
         return {
             "status": "success", 
@@ -269,6 +296,169 @@ async def update_subscription(
             detail=f"Error updating subscription: {str(e)}"
         )
 
+@admin_router.get("/cache_stats")
+async def cache_stats(api_key: str = Depends(verify_api_key)):
+    """Статистика кэша состояния пользователей.
+    
+    Компоненты:
+    - get_cache_stats: Счетчики попаданий и промахов кэша
+    
+    Пример вызова:
+    GET /admin/cache_stats
+    Заголовок: X-API-Key: ваш_api_ключ
+    """
+    return get_cache_stats()
+
+@admin_router.get("/indexes")
+async def index_report(
+    min_age_days: float = Query(7.0, ge=0),
+    api_key: str = Depends(verify_api_key)
+):
+    """Отчет об индексах: отсутствующие и неиспользуемые.
+    
+    Компоненты:
+    - verify_indexes: Сверка с REQUIRED_INDEXES и счетчики $indexStats
+    
+    Неиспользуемыми считаются необъявленные индексы без обращений,
+    счетчики которых ведутся не меньше min_age_days дней.
+    
+    Пример вызова:
+    GET /admin/indexes?min_age_days=7
+    Заголовок: X-API-Key: ваш_api_ключ
+    """
+    return await verify_indexes(check_usage=True, min_age=timedelta(days=min_age_days))
+
+@admin_router.get("/log_stats")
+async def log_stats(api_key: str = Depends(verify_api_key)):
+    """Статистика очереди пакетной записи логов.
+    
+    Компоненты:
+    - get_log_stats: Размер очереди, записанные и отброшенные записи
+    
+    Пример вызова:
+    GET /admin/log_stats
+    Заголовок: X-API-Key: ваш_api_ключ
+    """
+    return get_log_stats()
+
+@admin_router.post("/profile/start")
+async def profile_start(
+    seconds: float = Query(30.0, gt=0, le=600),
+    interval_ms: float = Query(5.0, ge=1, le=1000),
+    api_key: str = Depends(verify_api_key)
+):
+    """Запуск семплирующего профайлера цикла событий на N секунд.
+    
+    Компоненты:
+    - profiler: Снимает стеки потока цикла событий из отдельного потока
+    
+    Пример вызова:
+    POST /admin/profile/start?seconds=30&interval_ms=5
+    Заголовок: X-API-Key: ваш_api_ключ
+    """
+    if not profiler.start(seconds, interval_ms / 1000):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Profiler is already running"
+        )
+    await logs_bot("info", f"Profiler started for {seconds}s")
+    return profiler.status()
+
+@admin_router.post("/profile/stop")
+async def profile_stop(api_key: str = Depends(verify_api_key)):
+    """Остановка профайлера и загрузка результата.
+    
+    Возвращает файл collapsed stacks ("f1;f2;f3 N") для flamegraph.pl,
+    speedscope или inferno. Если профилирование уже завершилось по времени,
+    возвращает последний профиль.
+    
+    Пример вызова:
+    POST /admin/profile/stop
+    Заголовок: X-API-Key: ваш_api_ключ
+    """
+    artifact = await asyncio.to_thread(profiler.stop)
+    if not artifact:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No profile data collected"
+        )
+    return FileResponse(
+        artifact,
+        media_type="text/plain",
+        filename=artifact.rsplit("/", 1)[-1]
+    )
+
+@admin_router.get("/profile/status")
+async def profile_status(api_key: str = Depends(verify_api_key)):
+    """Состояние профайлера и самые частые функции последнего профиля.
+    
+    Пример вызова:
+    GET /admin/profile/status
+    Заголовок: X-API-Key: ваш_api_ключ
+    """
+    return {
+        **profiler.status(),
+        "top": [
+            {"function": label, "own_samples": own, "total_samples": total}
+            for label, own, total in profiler.top()
+        ]
+    }
+
+@admin_router.get("/loop_stats")
+async def loop_stats(api_key: str = Depends(verify_api_key)):
+    """Задержка цикла событий и места блокирующих вызовов.
+    
+    Компоненты:
+    - loop_monitor: Перцентили lag и стеки блокировок дольше LOOP_BLOCK_THRESHOLD
+    
+    Пример вызова:
+    GET /admin/loop_stats
+    Заголовок: X-API-Key: ваш_api_ключ
+    """
+    return loop_monitor.stats()
+
+@admin_router.get("/trace_stats")
+async def trace_stats(api_key: str = Depends(verify_api_key)):
+    """Статистика трассировки: сохраненные медленные и отброшенные быстрые.
+    
+    Компоненты:
+    - trace_recorder: Порог TRACE_SLOW_MS и счетчики трассировок
+    
+    Пример вызова:
+    GET /admin/trace_stats
+    Заголовок: X-API-Key: ваш_api_ключ
+    """
+    return trace_recorder.stats()
+
+@admin_router.get("/logs")
+async def recent_logs(
+    level: str = None,
+    limit: int = Query(50, ge=1, le=500),
+    api_key: str = Depends(verify_api_key)
+):
+    """Последние записи логов, например последние N ошибок.
+    
+    Компоненты:
+    - get_recent_logs: Выборка по индексу (level, created_at)
+    
+    Пример вызова:
+    GET /admin/logs?level=error&limit=20
+    Заголовок: X-API-Key: ваш_api_ключ
+    """
+    if level and level.lower() not in LOG_LEVELS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown log level: {level}"
+        )
+    try:
+        return await get_recent_logs(level, limit)
+    except Exception as e:
+        await logs_bot("error", f"Error getting recent logs: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error getting recent logs: {str(e)}"
+        )
+
 # Эндпоинты для аналитики
 @analytics_router.get("/usage", response_model=UsageStats)
 async def get_usage_stats(
@@ -281,50 +471,10 @@ async def get_usage_stats(
         start_date = datetime.strptime(time_range.start_date, "%Y-%m-%d")
         end_date = datetime.strptime(time_range.end_date, "%Y-%m-%d")
         
-        # Получаем историю чатов
-        chat_history = await get_table_data("ChatHistory")
+        # Агрегируем историю чатов за период (конечная дата включительно)
+        stats = await get_chat_usage_stats(start_date, end_date + timedelta(days=1))
         
-        # Фильтруем по дате
-        filtered = []
-        for h in chat_history:
-            if not h.get("timestamp"):
-                continue
-            # Преобразуем строку в datetime, если необходимо
-            if isinstance(h["timestamp"], str):
-                h_date = datetime.fromisoformat(h["timestamp"])
-            else:
-                h_date = h["timestamp"]
-                
-            if start_date <= h_date <= end_date:
-                filtered.append(h)
-        
-        # Считаем статистику
-        total_requests = len(filtered)
-        
-        requests_by_model = {}
-        for h in filtered:
-            model = h.get("model", "unknown")
-            requests_by_model[model] = requests_by_model.get(model, 0) + 1
-        
-        requests_by_day = {}
-        for h in filtered:
-            h_date = h["timestamp"] if isinstance(h["timestamp"], datetime) else datetime.fromisoformat(h["timestamp"])
-            date_str = h_date.strftime("%Y-%m-%d")
-            requests_by_day[date_str] = requests_by_day.get(date_str, 0) + 1
-        
-        response_times = [
-            h.get("response_time", 0) 
-            for h in filtered 
-            if h.get("response_time")
-        ]
-        avg_response_time = sum(response_times)/len(response_times) if response_times else 0
-        
-        return UsageStats(
-            total_requests=total_requests,
-            requests_by_model=requests_by_model,
-            requests_by_day=requests_by_day,
-            average_response_time=avg_response_time
-        )
+        return UsageStats(**stats)
         
     except Exception as e:
         await logs_bot("error", f"Usage stats error: {str(e)}")
@@ -338,34 +488,29 @@ async def get_usage_stats(
 async def get_chat_history(user_id: int, limit: int = 10, api_key: str = Depends(verify_api_key)):
     """Получение истории чата пользователя."""
     try:
-        users = await get_table_data("Users")
-        users = [u for u in users if u.get("chatId") == user_id]
-        if not users:
+        user = await get_user_data("Users", user_id)
+        if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User with ID {user_id} not found"
             )
         
-        history = await get_table_data("ChatHistory")
-        history = [h for h in history if h.get("chatId") == user_id]
-        
-        history.sort(key=lambda x: x.get("timestamp", datetime.min), reverse=True)
-        
-        limited_history = history[:limit]
+        limited_history, total_messages = await get_chat_history_page(user_id, limit)
         
         messages = []
         for h in limited_history:
+            timestamp = parse_datetime(h.get("timestamp"))
             messages.append({
                 "user_message": h.get("message_text", ""),
                 "bot_response": h.get("response_text", ""),
                 "model": h.get("model", "unknown"),
-                "timestamp": h.get("timestamp", "").isoformat() if h.get("timestamp") else None
+                "timestamp": timestamp.isoformat() if timestamp else None
             })
         
         return ChatHistory(
             user_id=user_id,
             messages=messages,
-            total_messages=len(history)
+            total_messages=total_messages
         )
     except HTTPException:
         raise
@@ -380,26 +525,17 @@ async def get_chat_history(user_id: int, limit: int = 10, api_key: str = Depends
 async def get_user_detail(user_id: int, api_key: str = Depends(verify_api_key)):
     """Получение детальной информации о конкретном пользователе."""
     try:
-        users = await get_table_data("Users")
-        users = [u for u in users if u.get("chatId") == user_id]
-        if not users:
+        user = await get_user_data("Users", user_id)
+        if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User with ID {user_id} not found"
             )
         
-        user = users[0]
-        
-        history = await get_table_data("ChatHistory")
-        history = [h for h in history if h.get("chatId") == user_id]
+        model_counts = await get_model_counts(user_id)
         
         ai_state = await get_state_ai(user_id)
         
-        model_counts = {}
-        for h in history:
-            model = h.get("model", "unknown")
-            model_counts[model] = model_counts.get(model, 0) + 1
-        
         favorite_model = max(model_counts.items(), key=lambda x: x[1])[0] if model_counts else "none"
         
         return UserDetail(
@@ -407,7 +543,7 @@ async def get_user_detail(user_id: int, api_key: str = Depends(verify_api_key)):
             username=user.get("username"),
             first_name=user.get("first_name"),
             last_name=user.get("last_name"),
-            requests_count=len(history),
+            requests_count=sum(model_counts.values()),
             favorite_model=favorite_model,
             remaining_requests=ai_state
         )
@@ -0,0 +1,151 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import sys
+
+
+class BatchSink:
+    """
+    Пакетная запись документов в коллекцию MongoDB.
+
+    Документы складываются в ограниченную очередь в памяти, а фоновая задача
+    записывает их через insert_many: как только набралось batch_size документов
+    или прошло flush_interval секунд с первого документа пакета.
+    При переполнении очереди документ отбрасывается (overflow="drop")
+    или вызывающий ждет свободного места (overflow="block").
+
+    Ошибки записи передаются в on_error(level, message) (обычно logs_bot).
+    Без on_error они печатаются в stderr: так работает очередь самих логов,
+    ошибку записи которой нельзя отправить в logs_bot.
+    """
+
+    def __init__(
+        self,
+        collection,
+        max_queue: int = 10000,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        overflow: str = "drop",
+        name: str = "sink",
+        on_error: Optional[Callable[[str, str], Awaitable[Any]]] = None,
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block = overflow == "block"
+        self.name = name
+        self.on_error = on_error
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._worker: Optional[asyncio.Task] = None
+        self._closing = False
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def _ensure_worker(self) -> None:
+        """Запускает фоновую задачу при первой записи в работающем цикле событий"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def put(self, document: Dict[str, Any]) -> bool:
+        """
+        Ставит документ в очередь на запись.
+
+        Returns:
+            bool: False, если документ отброшен из-за переполнения или закрытия
+        """
+        if self._closing:
+            self.dropped += 1
+            return False
+
+        self._ensure_worker()
+        if self.block:
+            await self._queue.put(document)
+            return True
+
+        try:
+            self._queue.put_nowait(document)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    def _drain(self, limit: int) -> List[Dict[str, Any]]:
+        """Забирает из очереди до limit документов без ожидания"""
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> None:
+        if not batch:
+            return
+        try:
+            await self.collection.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            await self._report(f"{self.name} batch write error: {str(e)}")
+
+    async def _report(self, message: str) -> None:
+        """Сообщает об ошибке записи через on_error или в stderr"""
+        if self.on_error is not None:
+            try:
+                await self.on_error("error", message)
+                return
+            except Exception:
+                pass
+        print(message, file=sys.stderr)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not (self._closing and self._queue.empty()):
+            try:
+                first = await asyncio.wait_for(
+                    self._queue.get(), timeout=self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                continue
+
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size and not self._closing:
+                batch.extend(self._drain(self.batch_size - len(batch)))
+                timeout = deadline - loop.time()
+                if len(batch) >= self.batch_size or timeout <= 0:
+                    break
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            batch.extend(self._drain(self.batch_size - len(batch)))
+            await self._write(batch)
+
+    async def flush(self) -> None:
+        """Немедленно записывает все документы, накопленные в очереди"""
+        while batch := self._drain(self.batch_size):
+            await self._write(batch)
+
+    async def close(self) -> None:
+        """Прекращает прием документов и дописывает очередь перед остановкой"""
+        self._closing = True
+        if self._worker is not None and not self._worker.done():
+            try:
+                await asyncio.wait_for(self._worker, timeout=self.flush_interval * 2)
+            except asyncio.TimeoutError:
+                self._worker.cancel()
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики записанных, отброшенных и не записанных документов"""
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
@@ -0,0 +1,142 @@
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Числовое значение состояния для метрики ai_circuit_state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """
+    Автомат защиты провайдера. Запрос считается неудачным, если он
+    завершился ошибкой или ответ начал приходить позже slow_seconds.
+    Когда за последние window секунд набирается не меньше min_requests
+    запросов и доля неудачных достигает error_rate, цепь размыкается:
+    запросы к провайдеру сразу уходят на резервную модель. Через
+    open_seconds пропускается один пробный запрос (полуоткрытое
+    состояние); удачный замыкает цепь, неудачный снова размыкает.
+
+    allow() выдает пропущенному запросу билет - момент допуска, а record()
+    принимает его обратно. В полуоткрытом состоянии учитывается только
+    результат с билетом пробного запроса: ответ запроса, начатого до
+    размыкания, не может замкнуть или снова разомкнуть цепь.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: float = 60.0,
+        min_requests: int = 5,
+        error_rate: float = 0.5,
+        slow_seconds: float = 30.0,
+        open_seconds: float = 30.0,
+    ):
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.closed_at = 0.0
+        self.probe_started = 0.0
+        self._results: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+
+    def allow(self) -> Optional[float]:
+        """
+        Можно ли отправить запрос провайдеру сейчас.
+
+        Returns:
+            Optional[float]: Билет запроса для record() или None, если нельзя
+        """
+        now = time.monotonic()
+        if self.state == CLOSED:
+            return now
+        if self.state == OPEN:
+            if now - self.opened_at < self.open_seconds:
+                return None
+            self.state = HALF_OPEN
+            self.probe_started = 0.0
+        # Один пробный запрос; если он не вернул результат (например,
+        # не дождался очереди), следующий пропускается через open_seconds
+        if self.probe_started and now - self.probe_started < self.open_seconds:
+            return None
+        self.probe_started = now
+        return now
+
+    def record(self, ok: bool, latency: float = None, ticket: float = None) -> None:
+        """
+        Учитывает результат запроса; latency - время до первого байта ответа,
+        ticket - билет, выданный запросу методом allow()
+        """
+        failed = not ok or (latency is not None and latency > self.slow_seconds)
+        now = time.monotonic()
+
+        if self.state == HALF_OPEN:
+            if ticket is None or ticket != self.probe_started:
+                # Результат не пробного запроса
+                return
+            if failed:
+                self._open(now)
+            else:
+                self._close(now)
+            return
+        if self.state == OPEN:
+            # Запрос начался до размыкания цепи
+            return
+        if ticket is not None and ticket < self.closed_at:
+            # Запрос начался до замыкания цепи и к новому окну не относится
+            return
+
+        self._results.append((now, failed))
+        self._failures += failed
+        while self._results and now - self._results[0][0] > self.window:
+            _, old_failed = self._results.popleft()
+            self._failures -= old_failed
+
+        total = len(self._results)
+        if total >= self.min_requests and self._failures >= self.error_rate * total:
+            self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = OPEN
+        self.opened_at = now
+        self._results.clear()
+        self._failures = 0
+
+    def _close(self, now: float) -> None:
+        self.state = CLOSED
+        self.closed_at = now
+        self.probe_started = 0.0
+        self._results.clear()
+        self._failures = 0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "state": self.state,
+            "requests": len(self._results),
+            "failures": self._failures,
+        }
+
+
+class CircuitBreakers:
+    """Автоматы защиты по провайдерам, создаются при первом запросе"""
+
+    def __init__(self, **settings):
+        self.settings = settings
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, provider: str) -> CircuitBreaker:
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            breaker = self._breakers[provider] = CircuitBreaker(provider, **self.settings)
+        return breaker
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: breaker.stats() for name, breaker in self._breakers.items()}
@@ -1,51 +1,141 @@
-from pydantic import BaseModel
-from typing import Any, Dict
-from datetime import datetime
+from pydantic import BaseModel, Field, model_validator
+from typing import Any, Callable, Dict, List, Optional, Union
+from datetime import datetime, timedelta
 from config.config import get_config
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient
+from services.batch_sink import BatchSink
+from services.tracing import current_trace_id
+import sys
 
 config = get_config()
 
-client = MongoClient(config.db.uri)
+client = AsyncMongoClient(config.db.uri, maxPoolSize=4)
 db = client[config.db.name]
 
+# Логи пишутся пакетами в фоне: logs_bot только ставит запись в очередь.
+# on_error не задан: ошибка записи логов печатается в stderr, а не в logs_bot
+log_sink = BatchSink(
+    db["logs_json"],
+    max_queue=config.logs.queue_size,
+    batch_size=config.logs.batch_size,
+    flush_interval=config.logs.flush_interval,
+    overflow=config.logs.overflow,
+    name="logs_json",
+)
+
 class LogsJson(BaseModel):
     data: Dict[str, str]
-    created_at: str = datetime.now().strftime("%H:%M %d-%m-%Y")
+    level: str
+    # Время фиксируется для каждой записи, а не при импорте модуля
+    created_at: datetime = Field(default_factory=datetime.now)
+    # Момент удаления записи TTL-индексом (срок зависит от уровня)
+    expire_at: Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def set_expire_at(self) -> "LogsJson":
+        if self.expire_at is None:
+            retention = config.logs.retention_days
+            days = retention.get(self.level, max(retention.values()))
+            self.expire_at = self.created_at + timedelta(days=days)
+        return self
+
+# Числовые уровни логов: записи ниже минимального уровня модуля пропускаются
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+# Минимальный уровень для модуля (по самому длинному совпадающему префиксу)
+_module_levels: Dict[str, int] = {}
 
-async def logs_bot(TypeLog: str, Text: str) -> None:
-    """Логирование событий."""
+def _level_for_module(module: str) -> int:
+    """Определяет минимальный уровень логов для модуля с кэшированием"""
+    level = _module_levels.get(module)
+    if level is None:
+        name = config.logs.level
+        matched = ""
+        for prefix, prefix_level in config.logs.module_levels.items():
+            if (module == prefix or module.startswith(prefix + ".")) and len(prefix) > len(matched):
+                matched, name = prefix, prefix_level
+        level = LOG_LEVELS.get(name.lower(), LOG_LEVELS["info"])
+        _module_levels[module] = level
+    return level
+
+def is_log_enabled(TypeLog: str, module: str) -> bool:
+    """Будет ли запись этого уровня сохранена для модуля"""
+    return LOG_LEVELS.get(TypeLog.lower(), LOG_LEVELS["warning"]) >= _level_for_module(module)
+
+async def logs_bot(
+    TypeLog: str, Text: Union[str, Callable[[], str]], *args: Any, module: str = None
+) -> None:
+    """
+    Логирование событий.
+
+    Аргументы:
+        TypeLog: str - Уровень (error, warning, info, debug)
+        Text: Сообщение, шаблон в стиле "%s" для args или функция без
+            аргументов, возвращающая сообщение. Шаблон и функция вычисляются
+            только если запись проходит фильтр уровня
+        args: Аргументы шаблона
+        module: Имя модуля для фильтра уровня (по умолчанию - вызывающий модуль)
+    """
     try:
-        valid_log_types = ["error", "warning", "info", "debug"]
-        if TypeLog.lower() not in valid_log_types:
-            TypeLog = "warning"  
+        TypeLog = TypeLog.lower()
+        if TypeLog not in LOG_LEVELS:
+            TypeLog = "warning"
+
+        if module is None:
+            module = sys._getframe(1).f_globals.get("__name__", "")
+        if not is_log_enabled(TypeLog, module):
+            return
+
+        if callable(Text):
+            Text = Text()
+        elif args:
+            Text = Text % args
 
         # Создаем запись лога
-        log_data = {"level": TypeLog, "message": Text}
-        log_entry = LogsJson(data=log_data)
-        
-        # Сохраняем в базу данных
-        await add_logs_data("logs_json", log_entry.model_dump())
+        log_data = {"level": TypeLog, "message": str(Text), "module": module}
+        trace_id = current_trace_id()
+        if trace_id:
+            log_data["trace_id"] = trace_id
+        log_entry = LogsJson(data=log_data, level=TypeLog)
+
+        # Ставим в очередь на пакетную запись
+        await log_sink.put(log_entry.model_dump())
     except Exception as e:
         print(f"Logging error: {str(e)}")
 
-async def add_logs_data(collection_name: str, data: dict) -> Any:
+async def get_recent_logs(level: str = None, limit: int = 50) -> List[dict]:
     """
-    Общая функция для добавления данных в коллекцию MongoDB.
-    
+    Последние записи логов (по индексу level_created_at).
+
     Аргументы:
-        collection_name: str - Название коллекции
-        data: dict - Данные для вставки
-        
+        level: str - Уровень (error, warning, info, debug) или None для всех
+        limit: int - Максимальное количество записей
+
     Возвращает:
-        Созданную запись или False, если не удалось вставить данные
+        Список записей от новых к старым
     """
-    try:
-        collection = db[collection_name]
-        # Для остальных коллекций - обычная вставка
-        result = collection.insert_one(data)
-        return result.inserted_id
-    except Exception as e:
-        error_msg = f"Database insertion error in {collection_name}: {str(e)}"
-        await logs_bot("error", error_msg)
-        return False
\ No newline at end of file
+    query = {"level": level.lower()} if level else {}
+    return (
+        await db["logs_json"]
+        .find(query, {"_id": 0, "expire_at": 0})
+        .sort("created_at", -1)
+        .limit(limit)
+        .to_list(limit)
+    )
+
+def get_log_stats() -> Dict[str, Any]:
+    """
+    Статистика очереди логов.
+
+    Возвращает:
+        Словарь с размером очереди и счетчиками записанных и отброшенных записей
+    """
+    return log_sink.stats()
+
+async def close_logging() -> None:
+    """
+    Дописывает накопленные логи и закрывает соединение с базой.
+    Вызывается при остановке приложения.
+    """
+    await log_sink.close()
+    await client.close()
@@ -0,0 +1,185 @@
+from collections import deque
+from config.config import get_config
+from prometheus_client import Histogram
+from services.logging import logs_bot
+from typing import Any, Dict, List, Optional
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+
+config = get_config()
+
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Задержка цикла событий относительно расписания",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+# Корень проекта: по нему в стеке ищется кадр нашего кода, вызвавший блокировку
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _blocking_site(frame) -> str:
+    """Самый глубокий кадр кода проекта (не библиотек) в стеке"""
+    innermost = frame
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(PROJECT_ROOT) and "site-packages" not in filename:
+            return f"{frame.f_code.co_name} ({os.path.relpath(filename, PROJECT_ROOT)}:{frame.f_lineno})"
+        frame = frame.f_back
+    code = innermost.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{innermost.f_lineno})"
+
+
+class LoopMonitor:
+    """
+    Монитор задержек цикла событий.
+
+    Задача в цикле просыпается каждые interval секунд и измеряет, насколько
+    позже расписания она получила управление (lag). Сторожевой поток следит
+    за ее отметками: если цикл не отвечает дольше block_threshold, он снимает
+    стек потока цикла - это и есть блокирующий вызов (синхронный pymongo,
+    requests, OpenAI SDK и т.п.). Места блокировок копятся с числом случаев
+    и суммарным временем, худшие периодически пишутся в лог.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        block_threshold: float = 0.1,
+        window: int = 3000,
+        report_interval: float = 60.0,
+    ):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.report_interval = report_interval
+        self._lags: deque = deque(maxlen=window)
+        self._heartbeat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._stall: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.offenders: Dict[str, Dict[str, Any]] = {}
+        self.blocks = 0
+
+    async def run(self) -> None:
+        """Измеряет задержку цикла; запускается задачей рядом с ботом"""
+        loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        watchdog = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        watchdog.start()
+        next_report = loop.time() + self.report_interval
+        try:
+            while True:
+                scheduled = loop.time() + self.interval
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, loop.time() - scheduled)
+                self._lags.append(lag)
+                LOOP_LAG.observe(lag)
+                self._heartbeat = time.monotonic()
+                self._finish_stall()
+
+                if loop.time() >= next_report:
+                    next_report = loop.time() + self.report_interval
+                    await self._report()
+        finally:
+            self._stop.set()
+
+    def _watch(self) -> None:
+        """Сторожевой поток: снимает стек, если цикл не отвечает"""
+        poll = max(self.block_threshold / 2, 0.01)
+        while not self._stop.wait(poll):
+            silent = time.monotonic() - self._heartbeat - self.interval
+            if silent < self.block_threshold:
+                continue
+            with self._lock:
+                if self._stall is not None:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is None:
+                    continue
+                self._stall = {
+                    "site": _blocking_site(frame),
+                    "stack": "".join(traceback.format_stack(frame, limit=15)),
+                }
+
+    def _finish_stall(self) -> None:
+        """Учитывает завершившуюся блокировку (вызывается из цикла)"""
+        with self._lock:
+            stall, self._stall = self._stall, None
+        if stall is None:
+            return
+        duration = self._lags[-1] if self._lags else 0.0
+        self.blocks += 1
+        offender = self.offenders.setdefault(
+            stall["site"], {"count": 0, "total": 0.0, "max": 0.0, "stack": ""}
+        )
+        offender["count"] += 1
+        offender["total"] += duration
+        if duration >= offender["max"]:
+            offender["max"] = duration
+            offender["stack"] = stall["stack"]
+
+    def worst_offenders(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Места блокировок по суммарному времени"""
+        ranked = sorted(
+            self.offenders.items(), key=lambda item: item[1]["total"], reverse=True
+        )
+        return [
+            {
+                "site": site,
+                "count": data["count"],
+                "total_seconds": round(data["total"], 3),
+                "max_seconds": round(data["max"], 3),
+                "stack": data["stack"],
+            }
+            for site, data in ranked[:limit]
+        ]
+
+    async def _report(self) -> None:
+        for offender in self.worst_offenders(3):
+            await logs_bot(
+                "warning",
+                "Event loop blocked at %s: %s times, %.3fs total, %.3fs max",
+                offender["site"],
+                offender["count"],
+                offender["total_seconds"],
+                offender["max_seconds"],
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """Перцентили задержки цикла и худшие места блокировок"""
+        lags = list(self._lags)
+        return {
+            "samples": len(lags),
+            "interval": self.interval,
+            "block_threshold": self.block_threshold,
+            "lag_p50": _percentile(lags, 50),
+            "lag_p95": _percentile(lags, 95),
+            "lag_p99": _percentile(lags, 99),
+            "lag_max": max(lags, default=0.0),
+            "blocks": self.blocks,
+            "offenders": self.worst_offenders(),
+        }
+
+
+loop_monitor = LoopMonitor(
+    config.loop_monitor.interval,
+    config.loop_monitor.block_threshold,
+    report_interval=config.loop_monitor.report_interval,
+)
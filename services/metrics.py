@@ -0,0 +1,171 @@
+from aiogram import BaseMiddleware
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from pymongo import monitoring
+from typing import Any, Awaitable, Callable, Dict, Tuple
+import time
+
+# Границы корзин: от быстрых обращений к базе до долгих ответов моделей
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+# Обновления Telegram по обработчикам
+BOT_UPDATES = Counter(
+    "bot_updates_total", "Обработанные обновления Telegram", ["handler", "outcome"]
+)
+BOT_UPDATE_DURATION = Histogram(
+    "bot_update_duration_seconds",
+    "Время обработки обновления Telegram",
+    ["handler"],
+    buckets=SLOW_BUCKETS,
+)
+
+# Запросы к моделям
+AI_REQUESTS = Counter(
+    "ai_requests_total", "Запросы к AI моделям", ["model", "provider", "outcome"]
+)
+AI_REQUEST_DURATION = Histogram(
+    "ai_request_duration_seconds",
+    "Время ответа AI модели",
+    ["model", "provider"],
+    buckets=SLOW_BUCKETS,
+)
+PROVIDER_ERRORS = Counter(
+    "ai_provider_errors_total", "Ошибки провайдеров AI", ["provider", "reason"]
+)
+AI_FALLBACKS = Counter(
+    "ai_fallbacks_total",
+    "Запросы, переданные резервной модели из-за разомкнутой цепи",
+    ["model", "fallback"],
+)
+PROVIDER_RETRIES = Counter(
+    "ai_provider_retries_total", "Повторы запросов после 429/503", ["provider", "status"]
+)
+
+# Синтез и распознавание речи
+AUDIO_REQUESTS = Counter(
+    "audio_requests_total", "Запросы TTS и STT", ["kind", "model", "outcome"]
+)
+AUDIO_REQUEST_DURATION = Histogram(
+    "audio_request_duration_seconds",
+    "Время запроса TTS и STT",
+    ["kind", "model"],
+    buckets=SLOW_BUCKETS,
+)
+
+# Команды MongoDB (собираются через мониторинг команд драйвера)
+DB_COMMANDS = Counter(
+    "mongo_commands_total", "Команды MongoDB", ["command", "outcome"]
+)
+DB_COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds",
+    "Время выполнения команды MongoDB",
+    ["command"],
+    buckets=FAST_BUCKETS,
+)
+
+# Состояние очередей и кэшей (обновляется при каждом запросе /metrics)
+LOG_QUEUE_DEPTH = Gauge("log_queue_depth", "Записи логов в очереди")
+LOG_DROPPED = Gauge("log_dropped_records", "Записи логов, отброшенные при переполнении")
+USER_CACHE_SIZE = Gauge("user_cache_size", "Пользователи в кэше состояния")
+USER_CACHE_HIT_RATE = Gauge("user_cache_hit_rate", "Доля попаданий в кэш состояния")
+PROVIDER_IN_FLIGHT = Gauge(
+    "ai_provider_in_flight", "Запросы к провайдеру или модели в работе", ["limiter"]
+)
+CIRCUIT_STATE = Gauge(
+    "ai_circuit_state",
+    "Состояние автомата защиты провайдера (0 - замкнут, 1 - проба, 2 - разомкнут)",
+    ["provider"],
+)
+PROVIDER_WAITING = Gauge(
+    "ai_provider_waiting", "Запросы в очереди ожидания провайдера или модели", ["limiter"]
+)
+
+
+
+def observe_ai_request(model: str, provider: str, started: float, ok: bool) -> None:
+    """Учитывает запрос к модели, started - значение time.perf_counter() до вызова"""
+    AI_REQUEST_DURATION.labels(model, provider).observe(time.perf_counter() - started)
+    AI_REQUESTS.labels(model, provider, "ok" if ok else "error").inc()
+
+
+def observe_audio_request(kind: str, model: str, started: float, ok: bool) -> None:
+    """Учитывает запрос TTS или STT, started - значение time.perf_counter() до вызова"""
+    AUDIO_REQUEST_DURATION.labels(kind, model).observe(time.perf_counter() - started)
+    AUDIO_REQUESTS.labels(kind, model, "ok" if ok else "error").inc()
+
+
+def record_provider_error(provider: str, reason: Any) -> None:
+    """Учитывает ошибку провайдера (HTTP статус, исключение или пустой ответ)"""
+    if isinstance(reason, BaseException):
+        reason = type(reason).__name__
+    PROVIDER_ERRORS.labels(provider, str(reason)).inc()
+
+
+def record_fallback(model: str, fallback: str) -> None:
+    """Учитывает запрос, переданный резервной модели"""
+    AI_FALLBACKS.labels(model, fallback).inc()
+
+
+def record_provider_retry(provider: str, status: int) -> None:
+    """Учитывает повтор запроса к провайдеру после ответа 429 или 503"""
+    PROVIDER_RETRIES.labels(provider, str(status)).inc()
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Метрики в текстовом формате Prometheus и их Content-Type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Слушатель команд драйвера pymongo: время и результат каждой команды.
+    Драйвер сам измеряет длительность, поэтому накладные расходы минимальны.
+    """
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        DB_COMMAND_DURATION.labels(event.command_name).observe(
+            event.duration_micros / 1_000_000
+        )
+        DB_COMMANDS.labels(event.command_name, "ok").inc()
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        DB_COMMAND_DURATION.labels(event.command_name).observe(
+            event.duration_micros / 1_000_000
+        )
+        DB_COMMANDS.labels(event.command_name, "error").inc()
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware aiogram: время и результат каждого обработчика.
+    Регистрируется на dp.message и dp.callback_query и действует
+    на все вложенные роутеры.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await handler(event, data)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            BOT_UPDATE_DURATION.labels(name).observe(time.perf_counter() - started)
+            BOT_UPDATES.labels(name, outcome).inc()
@@ -1,23 +1,61 @@
-from openai import OpenAI
+from openai import APIStatusError, AsyncOpenAI
 from config.config import get_config
+import asyncio
+import functools
+import importlib.util
+import httpx
+import json
+import pathlib
 import time
-import requests
+import tempfile
 from services.logging import logs_bot
-from Messages.settingsmsg import new_message, update_message, send_typing_action
+from services.tracing import span, traced
+from services.metrics import (
+    observe_ai_request,
+    observe_audio_request,
+    record_fallback,
+    record_provider_error,
+    record_provider_retry,
+)
+from services.circuit_breaker import CircuitBreakers
+from services.providers import ADAPTERS, ProviderAdapter, get_adapter
+from services.ratelimit import (
+    ProviderBusy,
+    ProviderLimits,
+    RateLimitExceeded,
+    estimate_tokens,
+    parse_retry_after,
+)
+from services.usage import (
+    UsageEvent,
+    finish_usage,
+    record_first_byte,
+    record_retry,
+    start_usage,
+)
+from Messages.settingsmsg import (
+    StreamingMessage,
+    new_message,
+    update_message,
+    send_typing_action,
+)
 from Messages.utils import download_voice_user
 from database.settingsdata import (
     get_user_history,
     save_chat_history,
     save_voice_to_mongodb,
-    get_voice_from_mongodb,
+    stream_voice,
 )
-from typing import Optional, Tuple, List, Dict, Any
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple, List, Dict, Any
 from dataclasses import dataclass
 
 
 config = get_config()
 last_messages = {}
 
+# Статусы, после которых запрос повторяется с учетом Retry-After
+RETRY_STATUSES = (429, 503)
+
 
 @dataclass
 class MessageResponse:
@@ -27,21 +65,90 @@ class MessageResponse:
     message: object
 
 
+@dataclass
+class ChatReply:
+    """
+    Ответ модели: текст для пользователя, признак успешной генерации
+    и модель, которая фактически ответила (при сбое провайдера - резервная)
+    """
+
+    text: str
+    ok: bool
+    model: Optional[str] = None
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Общий пул HTTP-соединений ко всем провайдерам ProxyAPI.
+    Соединения переиспользуются (keep-alive), HTTP/2 включается,
+    если установлен пакет h2 и он не отключен через PROVIDER_HTTP2.
+    """
+    http2 = config.openai.http2 and importlib.util.find_spec("h2") is not None
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=config.openai.max_connections,
+            max_keepalive_connections=config.openai.max_keepalive_connections,
+            keepalive_expiry=config.openai.keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(
+            config.openai.timeout, connect=config.openai.connect_timeout
+        ),
+    )
+
+
 class OpenAIService:
     def __init__(self):
-        self.client = OpenAI(
-            api_key=config.openai.api_key, base_url=config.openai.base_url
+        self.http = create_http_client()
+        self.client = AsyncOpenAI(
+            api_key=config.openai.api_key,
+            base_url=config.openai.base_url,
+            http_client=self.http,
         )
         self.default_system_message = (
             "Ты полезный ассистент, который помнит контекст разговора."
         )
         # Базовые URL для разных провайдеров ProxyAPI
+        proxy_base_url = config.openai.proxy_base_url
         self.proxy_base_urls = {
-            "openai": "https://api.proxyapi.ru/openai",
-            "anthropic": "https://api.proxyapi.ru/anthropic",
-            "google": "https://api.proxyapi.ru/google",
-            "deepseek": "https://api.proxyapi.ru/deepseek",
+            "openai": f"{proxy_base_url}/openai",
+            "anthropic": f"{proxy_base_url}/anthropic",
+            "google": f"{proxy_base_url}/google",
+            "deepseek": f"{proxy_base_url}/deepseek",
         }
+        # Лимиты одновременных запросов, запросов и токенов в минуту
+        rate_limit = config.rate_limit
+        self.limits = (
+            ProviderLimits(
+                max_concurrent=rate_limit.max_concurrent,
+                rpm=rate_limit.rpm,
+                tpm=rate_limit.tpm,
+                max_queue=rate_limit.max_queue,
+                max_wait=rate_limit.max_wait,
+                concurrency=rate_limit.concurrency,
+                rpm_overrides=rate_limit.rpm_overrides,
+                tpm_overrides=rate_limit.tpm_overrides,
+            )
+            if rate_limit.enabled
+            else None
+        )
+        # Автоматы защиты провайдеров
+        breaker = config.circuit_breaker
+        self.breakers = (
+            CircuitBreakers(
+                window=breaker.window,
+                min_requests=breaker.min_requests,
+                error_rate=breaker.error_rate,
+                slow_seconds=breaker.slow_seconds,
+                open_seconds=breaker.open_seconds,
+            )
+            if breaker.enabled
+            else None
+        )
+
+    async def close(self) -> None:
+        """Закрывает пул соединений; вызывается при остановке бота"""
+        await self.client.close()
 
     async def _make_api_request(self, api_func, *args, **kwargs) -> Optional[str]:
         """Общий обработчик API запросов с обработкой ошибок"""
@@ -52,42 +159,238 @@ class OpenAIService:
             await logs_bot("error", error_msg)
             return None
 
+    async def _stream_proxy_events(
+        self, adapter: ProviderAdapter, data: Dict[str, Any]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Потоковый запрос к ProxyAPI: разбирает ответ в формате SSE
+        и отдает события (JSON из строк data:) по мере получения.
+        При ответе 429/503 выбрасывает ProviderBusy (поток еще не начался,
+        запрос можно повторить), при другом статусе, отличном от 200, -
+        httpx.HTTPStatusError.
+        """
+        url = f"{self.proxy_base_urls[adapter.provider]}{adapter.endpoint(True)}"
+        await logs_bot("debug", "Making streaming request to %s", url)
+        async with self.http.stream(
+            "POST", url, headers=adapter.headers, json=data
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                if response.status_code in RETRY_STATUSES:
+                    raise ProviderBusy(
+                        response.status_code,
+                        parse_retry_after(response.headers.get("Retry-After")),
+                        response.text,
+                    )
+                await logs_bot(
+                    "error", f"ProxyAPI error: {response.status_code} - {response.text}"
+                )
+                response.raise_for_status()
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    break
+                if payload:
+                    yield json.loads(payload)
+
     async def _make_proxy_request(
-        self, provider: str, endpoint: str, data: Dict[str, Any]
+        self, adapter: ProviderAdapter, data: Dict[str, Any]
     ) -> Optional[Dict[str, Any]]:
-        """Выполняет запрос к ProxyAPI"""
+        """
+        Выполняет запрос к ProxyAPI.
+        При ответе 429/503 выбрасывает ProviderBusy: повтор с паузой
+        выполняет _run_limited, освободив слот ограничителя.
+        """
+        provider = adapter.provider
         try:
             base_url = self.proxy_base_urls.get(provider)
             if not base_url:
                 await logs_bot("error", f"Unknown provider: {provider}")
                 return None
 
-            url = f"{base_url}{endpoint}"
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.client.api_key}",
-            }
-
-            # Для Anthropic добавляем специальный заголовок
-            if provider == "anthropic":
-                headers["Anthropic-Version"] = "2023-06-01"
-
-            await logs_bot("debug", f"Making request to {url}")
-            response = requests.post(url, headers=headers, json=data, timeout=60)
+            url = f"{base_url}{adapter.endpoint(False)}"
+            await logs_bot("debug", "Making request to %s", url)
+            async with self.http.stream(
+                "POST", url, headers=adapter.headers, json=data
+            ) as response:
+                if response.status_code in RETRY_STATUSES:
+                    await response.aread()
+                    raise ProviderBusy(
+                        response.status_code,
+                        parse_retry_after(response.headers.get("Retry-After")),
+                        response.text,
+                    )
+                # Заголовки получены: время до первого байта
+                record_first_byte()
+                await response.aread()
 
             if response.status_code != 200:
+                record_provider_error(provider, response.status_code)
                 await logs_bot(
                     "error", f"ProxyAPI error: {response.status_code} - {response.text}"
                 )
                 return None
 
             return response.json()
+        except ProviderBusy:
+            raise
         except Exception as e:
+            record_provider_error(provider, e)
             await logs_bot("error", f"Error in _make_proxy_request: {str(e)}")
             return None
 
+    async def _retry_delay(
+        self, adapter: ProviderAdapter, busy: ProviderBusy, attempt: int
+    ) -> Optional[float]:
+        """
+        Пауза перед повтором запроса после ответа 429/503 или None, если
+        повторять не нужно. Retry-After приостанавливает и остальные запросы
+        к провайдеру (или к модели, если у нее свои лимиты).
+        """
+        rate_limit = config.rate_limit
+        if attempt >= rate_limit.max_retries:
+            return None
+        delay = busy.retry_after
+        if delay is None:
+            # Без Retry-After: экспоненциальная пауза 1, 2, 4... секунд
+            delay = float(2**attempt)
+        if delay > rate_limit.max_retry_after:
+            return None
+
+        if self.limits is not None:
+            self.limits.backoff(adapter.provider, adapter.model, delay)
+        record_provider_retry(adapter.provider, busy.status_code)
+        record_retry()
+        await logs_bot(
+            "warning",
+            f"ProxyAPI {busy.status_code} for {adapter.model}, "
+            f"retry {attempt + 1} in {delay:.1f}s",
+        )
+        return delay
+
+    async def _run_limited(
+        self,
+        adapter: ProviderAdapter,
+        process: Callable[[List[Dict[str, Any]]], Awaitable[Tuple[str, bool]]],
+        messages: List[Dict[str, Any]],
+        event: UsageEvent,
+    ) -> Tuple[str, bool]:
+        """
+        Выполняет запрос в пределах лимитов провайдера и модели (см. _run_once).
+        После ответа 429/503 запрос повторяется до PROVIDER_MAX_RETRIES раз;
+        на время паузы слот ограничителя освобождается, чтобы ожидающий
+        повтора запрос не задерживал остальные.
+        Если дождаться слота не удалось, выбрасывает RateLimitExceeded.
+        """
+        attempt = 0
+        while True:
+            try:
+                return await self._run_once(adapter, process, messages, event)
+            except ProviderBusy as busy:
+                delay = await self._retry_delay(adapter, busy, attempt)
+                if delay is None:
+                    record_provider_error(adapter.provider, busy.status_code)
+                    await logs_bot(
+                        "error", f"ProxyAPI error: {busy.status_code} - {busy.text}"
+                    )
+                    text = f"Произошла ошибка при обработке запроса {adapter.model}."
+                    return text, False
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _run_once(
+        self,
+        adapter: ProviderAdapter,
+        process: Callable[[List[Dict[str, Any]]], Awaitable[Tuple[str, bool]]],
+        messages: List[Dict[str, Any]],
+        event: UsageEvent,
+    ) -> Tuple[str, bool]:
+        """
+        Одна попытка запроса: ждет свободный слот и бюджет запросов/токенов
+        в очереди ограниченного размера, а после ответа уточняет расход
+        токенов по usage
+        """
+        if self.limits is None:
+            return await process(messages)
+
+        estimated = estimate_tokens(messages)
+        async with self.limits.acquire(
+            adapter.provider, adapter.model, estimated
+        ) as limiters:
+            result = await process(messages)
+
+        used = (event.input_tokens or 0) + (event.output_tokens or 0)
+        if used:
+            for limiter in limiters:
+                limiter.charge(used - estimated)
+        return result
+
+    async def _route(
+        self, adapter: ProviderAdapter
+    ) -> Tuple[Optional[ProviderAdapter], Optional[float]]:
+        """
+        Адаптер для запроса с учетом автоматов защиты и билет автомата
+        (см. CircuitBreaker.allow). Если цепь провайдера разомкнута, запрос
+        уходит на резервную модель (fallback в MODEL_ROUTES) с исправным
+        провайдером, а если такой нет - возвращается (None, None).
+        """
+        if self.breakers is None:
+            return adapter, None
+        ticket = self.breakers.get(adapter.provider).allow()
+        if ticket is not None:
+            return adapter, ticket
+
+        fallback_model = adapter.route.fallback
+        if fallback_model:
+            fallback = get_adapter(fallback_model)
+            ticket = self.breakers.get(fallback.provider).allow()
+            if ticket is not None:
+                record_fallback(adapter.model, fallback.model)
+                await logs_bot(
+                    "warning",
+                    f"Circuit open for {adapter.provider}: "
+                    f"{adapter.model} -> {fallback.model}",
+                )
+                return fallback, ticket
+
+        record_provider_error(adapter.provider, "circuit_open")
+        await logs_bot(
+            "warning",
+            f"Circuit open for {adapter.provider}, no healthy fallback for {adapter.model}",
+        )
+        return None, None
+
+    async def _record_circuit(
+        self, provider: str, ok: bool, latency: float, ticket: Optional[float]
+    ) -> None:
+        """Передает результат запроса с его билетом автомату защиты провайдера"""
+        if self.breakers is None:
+            return
+        breaker = self.breakers.get(provider)
+        state = breaker.state
+        breaker.record(ok, latency, ticket)
+        if breaker.state != state:
+            await logs_bot(
+                "warning", f"Circuit for {provider}: {state} -> {breaker.state}"
+            )
+
+    @traced()
     async def text_to_speech(
         self, text: str, voice: str = "alloy", model: str = "tts"
+    ) -> Optional[str]:
+        """Преобразование текста в речь с учетом в метриках (см. _text_to_speech)"""
+        started = time.perf_counter()
+        event = start_usage("tts", model, "openai")
+        audio_key = await self._text_to_speech(text, voice, model)
+        observe_audio_request("tts", model, started, audio_key is not None)
+        await finish_usage(event, audio_key is not None)
+        return audio_key
+
+    async def _text_to_speech(
+        self, text: str, voice: str = "alloy", model: str = "tts"
     ) -> Optional[str]:
         """
         Преобразование текста в речь и сохранение в MongoDB
@@ -98,7 +401,7 @@ class OpenAIService:
             model: Модель TTS (tts или tts-hd)
 
         Returns:
-            Optional[str]: Виртуальный путь к аудиофайлу или None в случае ошибки
+            Optional[str]: Ключ аудио (sha256) или None в случае ошибки
         """
         try:
             # Нормализуем модель
@@ -106,81 +409,45 @@ class OpenAIService:
 
             await logs_bot(
                 "debug",
-                f"Starting TTS generation with model: {tts_model}, voice: {voice}",
+                "Starting TTS generation with model: %s, voice: %s",
+                tts_model,
+                voice,
             )
 
-            # Для стандартного OpenAI API
-            if self.client.base_url == "https://api.openai.com/v1":
-                try:
-                    response = self.client.audio.speech.create(
-                        model=tts_model, voice=voice, input=text
-                    )
-
-                    if response:
-                        # Получаем бинарные данные
-                        audio_data = response.content
+            # Запрос через общий пул соединений; ответ читается потоком
+            try:
+                async with self.client.audio.speech.with_streaming_response.create(
+                    model=tts_model, voice=voice, input=text
+                ) as response:
+                    record_first_byte()
+                    # Читаем ответ частями во временный файл (в памяти до 1 МБ),
+                    # чтобы не держать весь аудиофайл в куче
+                    with tempfile.SpooledTemporaryFile(
+                        max_size=1024 * 1024
+                    ) as audio_file:
+                        async for chunk in response.iter_bytes(
+                            config.storage.chunk_size
+                        ):
+                            audio_file.write(chunk)
+                        audio_file.seek(0)
 
                         # Генерируем уникальное имя файла
                         timestamp = int(time.time())
                         voice_name = f"tts_{voice}_{timestamp}.mp3"
 
-                        # Сохраняем в MongoDB
-                        virtual_path = await save_voice_to_mongodb(
-                            0, audio_data, voice_name
+                        # Сохраняем в хранилище
+                        audio_key = await save_voice_to_mongodb(
+                            0, audio_file, voice_name
                         )
+            except APIStatusError as api_error:
+                await logs_bot(
+                    "error",
+                    f"ProxyAPI error: {api_error.status_code} - {api_error.message}",
+                )
+                return None
 
-                        await logs_bot(
-                            "info", f"TTS saved to MongoDB with path: {virtual_path}"
-                        )
-                        return virtual_path
-                    else:
-                        await logs_bot("error", "Empty response from OpenAI API")
-                        return None
-                except Exception as api_error:
-                    await logs_bot("error", f"OpenAI API error: {str(api_error)}")
-                    return None
-
-            # Для ProxyAPI
-            else:
-                # Определяем URL для запроса
-                url = f"{self.proxy_base_urls['openai']}/v1/audio/speech"
-
-                # Подготавливаем данные для запроса
-                data = {"model": tts_model, "voice": voice, "input": text}
-
-                # Заголовки запроса
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.client.api_key}",
-                }
-
-                # Отправляем запрос
-                await logs_bot("debug", f"Sending TTS request to ProxyAPI: {url}")
-                response = requests.post(url, headers=headers, json=data, timeout=60)
-
-                if response.status_code == 200:
-                    # Получаем бинарные данные
-                    audio_data = response.content
-
-                    # Генерируем уникальное имя файла
-                    timestamp = int(time.time())
-                    voice_name = f"tts_{voice}_{timestamp}.mp3"
-
-                    # Сохраняем в MongoDB
-                    virtual_path = await save_voice_to_mongodb(
-                        0, audio_data, voice_name
-                    )
-
-                    await logs_bot(
-                        "info", f"TTS saved to MongoDB with path: {virtual_path}"
-                    )
-                    return virtual_path
-                else:
-                    await logs_bot(
-                        "error",
-                        f"ProxyAPI error: {response.status_code} - {response.text}",
-                    )
-                    return None
+            await logs_bot("info", f"TTS saved with audio key: {audio_key}")
+            return audio_key
 
         except Exception as e:
             await logs_bot("error", f"Error in text_to_speech: {str(e)}")
@@ -189,51 +456,61 @@ class OpenAIService:
             await logs_bot("error", traceback.format_exc())
             return None
 
-    async def speech_to_text(self, virtual_path: str, model: str = "whisper-1") -> str:
+    @traced()
+    async def speech_to_text(self, audio_key: str, model: str = "whisper-1") -> str:
+        """Распознавание речи с учетом в метриках (см. _speech_to_text)"""
+        started = time.perf_counter()
+        event = start_usage("stt", model, "openai")
+        text = await self._speech_to_text(audio_key, model)
+        observe_audio_request("stt", model, started, bool(text))
+        await finish_usage(event, bool(text))
+        return text
+
+    async def _speech_to_text(self, audio_key: str, model: str = "whisper-1") -> str:
         """
         Конвертация аудио в текст
 
         Args:
-            virtual_path: Виртуальный путь к файлу в MongoDB
+            audio_key: Ключ аудио, полученный при сохранении
             model: Модель для распознавания речи
 
         Returns:
             str: Распознанный текст
         """
         try:
-            await logs_bot("debug", f"Starting speech-to-text for path: {virtual_path}")
+            await logs_bot("debug", "Starting speech-to-text for key: %s", audio_key)
 
-            # Получаем данные из MongoDB
-            voice_data = await get_voice_from_mongodb(virtual_path)
+            # Создаем временный файл для OpenAI API и переносим в него
+            # аудио из хранилища частями
+            import os
 
-            if not voice_data:
+            voice_size = 0
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".oga") as temp_file:
+                temp_path = temp_file.name
+                async for chunk in stream_voice(audio_key):
+                    temp_file.write(chunk)
+                    voice_size += len(chunk)
+
+            if not voice_size:
+                os.unlink(temp_path)
                 await logs_bot(
-                    "error", f"Voice data not found for path: {virtual_path}"
+                    "error", f"Voice data not found for key: {audio_key}"
                 )
                 return ""
 
             await logs_bot(
-                "debug",
-                f"Retrieved voice data from MongoDB, size: {len(voice_data)} bytes",
+                "debug", "Retrieved voice data from storage, size: %s bytes", voice_size
             )
 
-            # Создаем временный файл для OpenAI API
-            import tempfile
-            import os
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".oga") as temp_file:
-                temp_file.write(voice_data)
-                temp_path = temp_file.name
-
             try:
                 # Используем временный файл для распознавания
-                with open(temp_path, "rb") as audio_file:
-                    await logs_bot(
-                        "debug", f"Sending file to OpenAI API for transcription"
-                    )
-                    transcript = self.client.audio.transcriptions.create(
-                        model=model, file=audio_file
-                    )
+                # (SDK читает его асинхронно по пути)
+                await logs_bot("debug", "Sending file to OpenAI API for transcription")
+                async with self.client.audio.transcriptions.with_streaming_response.create(
+                    model=model, file=pathlib.Path(temp_path)
+                ) as raw_response:
+                    record_first_byte()
+                    transcript = await raw_response.parse()
 
                 # Удаляем временный файл
                 os.unlink(temp_path)
@@ -261,7 +538,7 @@ class OpenAIService:
         if system_message:
             messages.append({"role": "system", "content": system_message})
 
-        # Add last 5 messages from context
+        # Add last 5 turns (message, response) from context
         for msg in context[-5:]:
             messages.extend(
                 [
@@ -273,10 +550,20 @@ class OpenAIService:
         messages.append({"role": "user", "content": user_message})
         return messages
 
+    @traced()
     async def chat_completion_with_context(
-        self, user_message: str, context: list, model_gpt: str
-    ) -> str:
-        """Обработка сообщения с учетом контекста"""
+        self,
+        user_message: str,
+        context: list,
+        model_gpt: str,
+        on_delta: Callable[[str], Awaitable[None]] = None,
+    ) -> ChatReply:
+        """
+        Обработка сообщения с учетом контекста.
+        Если передан on_delta и включен AI_STREAM, ответ запрашивается
+        потоком, а on_delta получает накопленный текст после каждого фрагмента.
+        При ошибке провайдера ok=False, а text содержит сообщение об ошибке.
+        """
         try:
             # Подготавливаем сообщения
             messages = await self._prepare_messages(
@@ -284,245 +571,188 @@ class OpenAIService:
             )
 
             # Добавляем логирование для отладки
-            await logs_bot("debug", f"Sending request to API with model: {model_gpt}")
+            await logs_bot("debug", "Sending request to API with model: %s", model_gpt)
 
             # Проверяем, что модель существует и доступна
             if not model_gpt:
                 await logs_bot("error", "Model name is empty or None")
-                return "Ошибка: не указана модель AI."
-
-            # Маршрутизация запросов в зависимости от модели
-            if model_gpt in ["o1-mini", "o1", "o3mini"]:
-                # Для моделей O1 используем специальный формат
-                return await self._process_o1(messages, model_gpt)
-            elif model_gpt in ["claude-3-5-sonnet", "claude-3-haiku"]:
-                # Для моделей Claude используем специальный формат
-                return await self._process_claude(messages, model_gpt)
-            elif model_gpt in ["gemini-1.5-flash"]:
-                # Для моделей Gemini используем специальный формат
-                return await self._process_gemini(messages, model_gpt)
-            elif model_gpt in ["deepseek-v3", "deepseek-r1"]:
-                # Для моделей DeepSeek используем специальный формат
-                return await self._process_deepseek(messages, model_gpt)
+                return ChatReply("Ошибка: не указана модель AI.", False)
+
+            if model_gpt not in ADAPTERS:
+                await logs_bot(
+                    "warning",
+                    f"Model {model_gpt} is not in MODEL_ROUTES, sending it to OpenAI as is",
+                )
+
+            # Адаптер модели из реестра (config/models.py), при сбое
+            # провайдера - адаптер резервной модели
+            adapter, ticket = await self._route(get_adapter(model_gpt))
+            if adapter is None:
+                return ChatReply(
+                    "Модель временно недоступна. "
+                    "Попробуйте позже или выберите другую модель.",
+                    False,
+                )
+            provider, model = adapter.provider, adapter.model
+            if on_delta is not None and adapter.stream and config.openai.stream:
+                process = functools.partial(self._process_stream, adapter, on_delta)
             else:
-                # Для моделей OpenAI используем стандартный формат
-                try:
-                    response = self.client.chat.completions.create(
-                        model=model_gpt,
-                        messages=messages,
-                    )
-                except Exception as api_error:
-                    await logs_bot("error", f"OpenAI API error: {str(api_error)}")
-                    return f"Ошибка API: {str(api_error)[:100]}."
-                # Проверяем ответ
-                if response and response.choices and len(response.choices) > 0:
-                    content = response.choices[0].message.content
-                    return content
-
-                # Если ответ пустой или некорректный
-                await logs_bot("warning", "Empty or invalid response from OpenAI")
-                return "Не удалось получить ответ от модели."
+                process = functools.partial(self._process, adapter)
+
+            started = time.perf_counter()
+            event = start_usage("chat", model, provider)
+            ok = False
+            try:
+                with span("provider", provider=provider, model=model):
+                    try:
+                        response, ok = await self._run_limited(
+                            adapter, process, messages, event
+                        )
+                    except RateLimitExceeded as e:
+                        # Перегрузка на нашей стороне: провайдер исправен
+                        record_provider_error(provider, "rate_limited")
+                        await logs_bot("warning", f"Rate limit for {model}: {e}")
+                        return ChatReply(
+                            "Сейчас слишком много запросов к модели. "
+                            "Попробуйте через минуту.",
+                            False,
+                        )
+                latency = event.ttfb
+                if latency is None:
+                    latency = time.perf_counter() - started
+                await self._record_circuit(provider, ok, latency, ticket)
+                return ChatReply(response, ok, model)
+            finally:
+                observe_ai_request(model, provider, started, ok)
+                await finish_usage(event, ok)
 
         except Exception as e:
             # Подробное логирование ошибки
             error_details = f"Error details: {str(e)}\nModel: {model_gpt}"
             await logs_bot("error", f"Error in chat completion: {error_details}")
-            return "Произошла ошибка при обработке запроса."
+            return ChatReply("Произошла ошибка при обработке запроса.", False)
 
-    async def _process_o1(self, messages: List[Dict[str, Any]], model: str) -> str:
-        """Обработка запросов к моделям O1, O1-mini, O3-mini через OpenAI API"""
-        try:
-            # Преобразуем сообщения в формат, поддерживаемый моделями O1
-            processed_messages = []
-            system_content = None
-
-            # Обрабатываем системное сообщение
-            for msg in messages:
-                if msg["role"] == "system":
-                    system_content = msg["content"]
-                else:
-                    processed_messages.append(
-                        {"role": msg["role"], "content": msg["content"]}
-                    )
-
-            # Если есть системное сообщение, добавляем его в контекст
-            if system_content:
-                # Для первого пользовательского сообщения добавляем системный контекст
-                if processed_messages and processed_messages[0]["role"] == "user":
-                    processed_messages[0][
-                        "content"
-                    ] = f"Контекст: {system_content}\n\n{processed_messages[0]['content']}"
-                else:
-                    # Если нет пользовательских сообщений, создаем новое
-                    processed_messages.insert(
-                        0, {"role": "user", "content": f"Контекст: {system_content}"}
-                    )
-
-            # Выполняем запрос к API
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=processed_messages,
-            )
-
-            # Обрабатываем ответ
-            if response and response.choices and len(response.choices) > 0:
-                return response.choices[0].message.content
-
-            await logs_bot("warning", f"Empty or invalid response from {model}")
-            return f"Не удалось получить ответ от модели {model}."
-
-        except Exception as e:
-            await logs_bot("error", f"Error in _process_o1 for {model}: {str(e)}")
-            return f"Произошла ошибка при обработке запроса {model}."
-
-    async def _process_deepseek(
-        self, messages: List[Dict[str, Any]], model: str
-    ) -> str:
-        """Обработка запросов к DeepSeek моделям"""
+    async def _process(
+        self, adapter: ProviderAdapter, messages: List[Dict[str, Any]]
+    ) -> Tuple[str, bool]:
+        """
+        Обработка запроса к модели через адаптер провайдера.
+        Возвращает текст ответа (или ошибки) и признак успешной генерации.
+        """
+        model = adapter.model
         try:
-            # Маппинг моделей
-            model_mapping = {
-                "deepseek-v3": "deepseek-chat",
-                "deepseek-r1": "deepseek-chat",
-            }
-
-            deepseek_model = model_mapping.get(model, "deepseek-chat")
-
-            # Подготовка данных для запроса
-            data = {"model": deepseek_model, "messages": messages}
-
-            # Выполнение запроса
             response = await self._make_proxy_request(
-                "deepseek", "/chat/completions", data
+                adapter, adapter.payload(messages, False)
             )
+            if response is None:
+                # Ошибка уже учтена и записана в лог в _make_proxy_request
+                return f"Произошла ошибка при обработке запроса {model}.", False
 
-            if response and "choices" in response and len(response["choices"]) > 0:
-                return response["choices"][0]["message"]["content"]
+            content = adapter.extract(response)
+            if content:
+                return content, True
 
+            record_provider_error(adapter.provider, "empty_response")
             await logs_bot(
-                "warning", f"Empty or invalid response from DeepSeek: {response}"
+                "warning", f"Empty or invalid response from {model}: {response}"
             )
-            return "Не удалось получить ответ от модели DeepSeek."
+            return f"Не удалось получить ответ от модели {model}.", False
 
+        except ProviderBusy:
+            raise
         except Exception as e:
-            await logs_bot("error", f"Error in _process_deepseek: {str(e)}")
-            return "Произошла ошибка при обработке запроса DeepSeek."
-
-    async def _process_claude(self, messages: List[Dict[str, Any]], model: str) -> str:
-        """Обработка запросов к Claude моделям"""
+            record_provider_error(adapter.provider, e)
+            await logs_bot("error", f"Error in _process for {model}: {str(e)}")
+            return f"Произошла ошибка при обработке запроса {model}.", False
+
+    async def _process_stream(
+        self,
+        adapter: ProviderAdapter,
+        on_delta: Callable[[str], Awaitable[None]],
+        messages: List[Dict[str, Any]],
+    ) -> Tuple[str, bool]:
+        """
+        Потоковая обработка запроса: собирает фрагменты ответа из событий
+        потока и передает накопленный текст в on_delta после каждого фрагмента.
+        Возвращает текст ответа (или ошибки) и признак успешной генерации.
+        """
+        provider, model = adapter.provider, adapter.model
+        parts: List[str] = []
         try:
-            # Маппинг моделей
-            model_mapping = {
-                "claude-3-5-sonnet": "claude-3-5-sonnet-20241022",
-                "claude-3-haiku": "claude-3-haiku-20240307",
-            }
-
-            claude_model = model_mapping.get(model, model)
-
-            # Преобразуем сообщения в формат Claude
-            claude_messages = []
-            for msg in messages:
-                if (
-                    msg["role"] != "system"
-                ):  # Системные сообщения обрабатываются отдельно
-                    claude_messages.append(
-                        {"role": msg["role"], "content": msg["content"]}
-                    )
-
-            # Находим системное сообщение
-            system_content = next(
-                (msg["content"] for msg in messages if msg["role"] == "system"), None
-            )
-
-            # Подготовка данных для запроса
-            data = {
-                "model": claude_model,
-                "messages": claude_messages,
-                "max_tokens": 1024,
-            }
-
-            # Добавляем системное сообщение, если оно есть
-            if system_content:
-                data["system"] = system_content
-
-            # Выполнение запроса
-
-            response = await self._make_proxy_request("anthropic", "/v1/messages", data)
-
-            if response and "content" in response and len(response["content"]) > 0:
-                # Извлекаем текст из ответа
-                for content_item in response["content"]:
-                    if content_item["type"] == "text":
-                        return content_item["text"]
-
-            await logs_bot(
-                "warning", f"Empty or invalid response from Claude: {response}"
-            )
-            return "Не удалось получить ответ от модели Claude."
-
+            data = adapter.payload(messages, True)
+            async for event in self._stream_proxy_events(adapter, data):
+                delta = adapter.stream_text(event)
+                if not delta:
+                    continue
+                if not parts:
+                    # В потоке важен первый фрагмент текста, а не заголовки
+                    record_first_byte()
+                parts.append(delta)
+                await on_delta("".join(parts))
+        except ProviderBusy:
+            # Ответ 429/503 приходит до первого фрагмента: запрос повторяется
+            raise
         except Exception as e:
-            await logs_bot("error", f"Error in _process_claude: {str(e)}")
-            return "Произошла ошибка при обработке запроса Claude."
-
-    async def _process_gemini(self, messages: List[Dict[str, Any]], model: str) -> str:
-        """Обработка запросов к Gemini моделям"""
-        try:
-            # Преобразуем сообщения в формат Gemini
-            gemini_contents = []
-
-            # Обрабатываем системное сообщение
-            system_content = next(
-                (msg["content"] for msg in messages if msg["role"] == "system"), None
-            )
-
-            # Если есть системное сообщение, добавляем его как сообщение от модели
-            if system_content:
-                gemini_contents.append(
-                    {"role": "model", "parts": [{"text": system_content}]}
+            if isinstance(e, httpx.HTTPStatusError):
+                record_provider_error(provider, e.response.status_code)
+            else:
+                record_provider_error(provider, e)
+            await logs_bot("error", f"Streaming error from {provider} ({model}): {str(e)}")
+            if parts:
+                return (
+                    "".join(parts) + "\n\n⚠️ Ответ прерван из-за ошибки провайдера.",
+                    False,
                 )
-
-            # Добавляем остальные сообщения
-            for msg in messages:
-                if (
-                    msg["role"] != "system"
-                ):  # Пропускаем системные сообщения, они уже обработаны
-                    role = "user" if msg["role"] == "user" else "model"
-                    gemini_contents.append(
-                        {"role": role, "parts": [{"text": msg["content"]}]}
-                    )
-
-            # Подготовка данных для запроса
-            data = {"contents": gemini_contents}
-
-            # Определяем эндпоинт в зависимости от модели
-            endpoint = f"/v1/models/{model}:generateContent"
-
-            # Выполнение запроса
-            response = await self._make_proxy_request("google", endpoint, data)
-
-            if (
-                response
-                and "candidates" in response
-                and len(response["candidates"]) > 0
-            ):
-                candidate = response["candidates"][0]
-                if "content" in candidate and "parts" in candidate["content"]:
-                    parts = candidate["content"]["parts"]
-                    if len(parts) > 0 and "text" in parts[0]:
-                        return parts[0]["text"]
-
-            await logs_bot(
-                "warning", f"Empty or invalid response from Gemini: {response}"
-            )
-            return "Не удалось получить ответ от модели Gemini."
-
-        except Exception as e:
-            await logs_bot("error", f"Error in _process_gemini: {str(e)}")
-            return "Произошла ошибка при обработке запроса Gemini."
-
-
-async def AI_choice(message, model: str) -> Tuple[str, object]:
-    """Основной обработчик сообщений"""
+            return f"Произошла ошибка при обработке запроса {model}.", False
+
+        if not parts:
+            record_provider_error(provider, "empty_response")
+            await logs_bot("warning", f"Empty streaming response from {model}")
+            return "Не удалось получить ответ от модели.", False
+        return "".join(parts), True
+
+
+def _clean_response(response: str) -> str:
+    """
+    Убирает из ответа модели технические детали вида {'role': ..., 'content': ...}
+
+    Args:
+        response: Ответ модели
+
+    Returns:
+        str: Содержимое content или исходная строка, если очищать нечего
+    """
+    # Проверяем на наличие технических деталей
+    if "{'role':" not in response and '{"role":' not in response:
+        return response
+
+    # Простая очистка без регулярных выражений
+    content_start = response.find("'content': '")
+    if content_start == -1:
+        content_start = response.find('"content": "')
+    if content_start == -1:
+        return response
+
+    content_start = response.find("'", content_start + 11)
+    if content_start == -1:
+        content_start = response.find('"', content_start + 11)
+
+    content_end = response.rfind("'}")
+    if content_end == -1:
+        content_end = response.rfind('"')
+
+    if content_start != -1 and content_end != -1:
+        return response[content_start + 1 : content_end]
+    return response
+
+
+@traced()
+async def AI_choice(message, model: str) -> Tuple[str, object, bool]:
+    """
+    Основной обработчик сообщений.
+    Возвращает текст ответа (или ошибки), сообщение с ответом и признак
+    успешной генерации: при неудаче запрос не сохраняется в историю.
+    """
     message_text = None
 
     # Запускаем статус "печатает" и получаем функцию для его остановки
@@ -543,88 +773,79 @@ async def AI_choice(message, model: str) -> Tuple[str, object]:
     try:
         # Обработка входящего сообщения
         if message.voice:
-            audio_file_path = await download_voice_user(message)
+            audio_key = await download_voice_user(message)
             message_text = await openai_service.speech_to_text(
-                audio_file_path, "whisper-1"
+                audio_key, "whisper-1"
             )
         elif message.text:
             message_text = message.text
 
         if not message_text:
-            return "Не удалось обработать сообщение.", msg_old
+            return "Не удалось обработать сообщение.", msg_old, False
 
         # Получение истории и обработка модели
         history = await get_user_history(message.from_user.id, 5)
 
         # Получение ответа от модели через универсальный обработчик
-        response = await openai_service.chat_completion_with_context(
-            message_text, history, model
+        # Ответ показывается по мере генерации, правки сообщения объединяются
+        streaming = StreamingMessage(
+            msg_old,
+            config.telegram.stream_edit_interval,
+            config.telegram.stream_min_chars,
         )
+        try:
+            reply = await openai_service.chat_completion_with_context(
+                message_text, history, model, on_delta=streaming.update
+            )
+        finally:
+            await streaming.close()
+
+        response = reply.text
+        if not reply.ok:
+            return response, msg_old, False
+        # Модель, которая ответила (отличается от выбранной при переключении
+        # на резервную модель)
+        served_model = reply.model or model
 
         # Очищаем ответ от технических деталей, если они есть
         if response and isinstance(response, str):
-            # Проверяем на наличие технических деталей
-            if "{'role':" in response or '{"role":' in response:
-                try:
-                    # Простая очистка без регулярных выражений
-                    content_start = response.find("'content': '")
-                    if content_start == -1:
-                        content_start = response.find('"content": "')
-
-                    if content_start != -1:
-                        content_start = response.find("'", content_start + 11)
-                        if content_start == -1:
-                            content_start = response.find('"', content_start + 11)
-
-                        content_end = response.rfind("'}")
-                        if content_end == -1:
-                            content_end = response.rfind('"')
-
-                        if content_start != -1 and content_end != -1:
-                            response = response[content_start + 1 : content_end]
-                            await logs_bot(
-                                "debug", "Cleaned technical details from response"
-                            )
-                except Exception as e:
-                    await logs_bot("warning", f"Failed to clean response: {e}")
+            cleaned = _clean_response(response)
+            if cleaned is not response:
+                response = cleaned
+                await logs_bot("debug", "Cleaned technical details from response")
 
         if response:
-            # Подготовка и сохранение контекста
+            # Сохраняем реплику в историю чата
             try:
-                # Получаем существующий контекст
-                context_to_save = []
-                if history and any(entry[0] for entry in history):
-                    context_to_save.extend(entry[0] for entry in history)
-                context_to_save.append(message_text)
-                context_to_save.append(response)
-                # Сохраняем историю чата
                 history_data = {
                     "user_id": message.from_user.id,
                     "message_text": message_text,
                     "response_text": response,
-                    "model": model,
-                    "context": context_to_save,
+                    "model": served_model,
                 }
                 await save_chat_history(history_data)
-                await logs_bot(
-                    "debug", f"Saved context with {len(context_to_save)} messages"
-                )
 
             except Exception as save_err:
                 await logs_bot("error", f"Error saving chat history: {save_err}")
 
+            if served_model != model:
+                response = (
+                    f"ℹ️ {model} временно недоступна, ответила {served_model}.\n\n"
+                    f"{response}"
+                )
+
             # Сохраняем текущее сообщение
             last_messages[message.from_user.id] = (msg_old, str(response))
 
-            return response, msg_old
+            return response, msg_old, True
 
     except Exception as err:
 
         await logs_bot("error", f"Error in AI_choice: {err}")
         error_msg = "Извините, произошла ошибка при обработке вашего запроса."
-        return error_msg, msg_old
+        return error_msg, msg_old, False
 
-    return "Не удалось получить ответ от модели.", msg_old
+    return "Не удалось получить ответ от модели.", msg_old, False
 
 
 openai_service = OpenAIService()
@@ -0,0 +1,140 @@
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import os
+import sys
+import threading
+import time
+
+# Каталог для сохраненных профилей (collapsed stacks для flamegraph)
+PROFILE_DIR = "./info_save/profiles"
+
+# Ограничение времени профилирования, чтобы забытый профиль не работал вечно
+MAX_DURATION = 600.0
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Семплирующий профайлер потока цикла событий.
+
+    Отдельный поток раз в interval секунд снимает стек целевого потока
+    через sys._current_frames и копит одинаковые стеки в счетчике.
+    Сам цикл событий при этом не трогается, поэтому профиль можно снимать
+    на работающем боте. Результат - collapsed stacks ("f1;f2;f3 N"),
+    которые принимают flamegraph.pl, speedscope и inferno.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[datetime] = None
+        self.duration = 0.0
+        self.interval = 0.005
+        self.last_artifact: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float = 30.0, interval: float = 0.005) -> bool:
+        """
+        Запускает профилирование текущего потока на duration секунд.
+        Вызывается из цикла событий, поэтому профилируется его поток.
+
+        Returns:
+            bool: False, если профилирование уже идет
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self._stacks = Counter()
+            self.samples = 0
+            self.interval = interval
+            self.duration = min(duration, MAX_DURATION)
+            self.started_at = datetime.now()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._sample,
+                args=(threading.get_ident(), self.duration, interval),
+                name="sampling-profiler",
+                daemon=True,
+            )
+            self._thread.start()
+            return True
+
+    def _sample(self, thread_id: int, duration: float, interval: float) -> None:
+        deadline = time.monotonic() + duration
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                self._stacks[";".join(reversed(labels))] += 1
+                self.samples += 1
+            self._stop.wait(interval)
+        self._save()
+
+    def _save(self) -> None:
+        if not self._stacks:
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(
+            PROFILE_DIR, f"profile_{self.started_at:%Y%m%d_%H%M%S}.collapsed"
+        )
+        with open(path, "w", encoding="utf-8") as profile_file:
+            profile_file.writelines(
+                f"{stack} {count}\n" for stack, count in self._stacks.most_common()
+            )
+        self.last_artifact = path
+
+    def stop(self) -> Optional[str]:
+        """
+        Останавливает профилирование и сохраняет результат.
+
+        Returns:
+            Optional[str]: Путь к файлу collapsed stacks или None, если данных нет
+        """
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._stop.set()
+            thread.join()
+        return self.last_artifact
+
+    def top(self, limit: int = 15) -> List[Tuple[str, int, int]]:
+        """
+        Самые частые функции профиля.
+
+        Returns:
+            List[Tuple[str, int, int]]: (функция, собственные семплы, семплы со стеком)
+        """
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in list(self._stacks.items()):
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for label in set(frames):
+                total[label] += count
+        return [(label, count, total[label]) for label, count in own.most_common(limit)]
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "interval": self.interval,
+            "samples": self.samples,
+            "artifact": self.last_artifact,
+        }
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,252 @@
+from abc import ABC, abstractmethod
+from config.config import get_config
+from config.models import MODEL_ROUTES, ModelRoute
+from services.usage import record_tokens
+from typing import Any, Dict, List, Optional
+
+config = get_config()
+
+
+def _headers(provider: str) -> Dict[str, str]:
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {config.openai.api_key}",
+    }
+    # Для Anthropic добавляем специальный заголовок
+    if provider == "anthropic":
+        headers["Anthropic-Version"] = "2023-06-01"
+    return headers
+
+
+class ProviderAdapter(ABC):
+    """
+    Адаптер модели у провайдера ProxyAPI: эндпоинт, заголовки, тело запроса
+    и разбор ответа. Все, что не зависит от сообщений, вычисляется один раз
+    при создании адаптера; на запрос остается только преобразовать сообщения.
+    """
+
+    provider = "openai"
+
+    def __init__(self, model: str, route: ModelRoute):
+        self.model = model
+        self.route = route
+        self.headers = _headers(self.provider)
+        self.stream = route.stream
+
+    @abstractmethod
+    def endpoint(self, stream: bool) -> str:
+        """Путь запроса относительно базового URL провайдера"""
+
+    @abstractmethod
+    def payload(self, messages: List[Dict[str, Any]], stream: bool) -> Dict[str, Any]:
+        """Тело запроса для сообщений"""
+
+    @abstractmethod
+    def extract(self, response: Dict[str, Any]) -> Optional[str]:
+        """Текст из полного ответа (и токены из usage) или None"""
+
+    @abstractmethod
+    def stream_text(self, event: Dict[str, Any]) -> str:
+        """Фрагмент текста из события потока (и токены из usage)"""
+
+
+class OpenAIAdapter(ProviderAdapter):
+    """Chat completions OpenAI (и совместимые провайдеры)"""
+
+    provider = "openai"
+    path = "/v1/chat/completions"
+
+    def __init__(self, model: str, route: ModelRoute):
+        super().__init__(model, route)
+        self._static = {"model": route.api_model}
+        if route.max_tokens:
+            self._static["max_tokens"] = route.max_tokens
+        self._static_stream = {
+            **self._static,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+
+    def endpoint(self, stream: bool) -> str:
+        return self.path
+
+    def payload(self, messages: List[Dict[str, Any]], stream: bool) -> Dict[str, Any]:
+        static = self._static_stream if stream else self._static
+        return {**static, "messages": messages}
+
+    def extract(self, response: Dict[str, Any]) -> Optional[str]:
+        choices = response.get("choices")
+        if not choices:
+            return None
+        usage = response.get("usage") or {}
+        record_tokens(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        return (choices[0].get("message") or {}).get("content")
+
+    def stream_text(self, event: Dict[str, Any]) -> str:
+        usage = event.get("usage")
+        if usage:
+            record_tokens(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        choices = event.get("choices")
+        if not choices:
+            return ""
+        return (choices[0].get("delta") or {}).get("content") or ""
+
+
+class O1Adapter(OpenAIAdapter):
+    """Модели o1 и o3-mini: без системных сообщений, контекст в первом сообщении"""
+
+    def payload(self, messages: List[Dict[str, Any]], stream: bool) -> Dict[str, Any]:
+        system_content = None
+        processed_messages = []
+        for msg in messages:
+            if msg["role"] == "system":
+                system_content = msg["content"]
+            else:
+                processed_messages.append({"role": msg["role"], "content": msg["content"]})
+
+        # Системное сообщение добавляем в контекст первого пользовательского
+        if system_content:
+            if processed_messages and processed_messages[0]["role"] == "user":
+                processed_messages[0]["content"] = (
+                    f"Контекст: {system_content}\n\n{processed_messages[0]['content']}"
+                )
+            else:
+                processed_messages.insert(
+                    0, {"role": "user", "content": f"Контекст: {system_content}"}
+                )
+        return super().payload(processed_messages, stream)
+
+
+class DeepSeekAdapter(OpenAIAdapter):
+    """DeepSeek: формат OpenAI chat completions"""
+
+    provider = "deepseek"
+    path = "/chat/completions"
+
+
+class ClaudeAdapter(ProviderAdapter):
+    """Anthropic Messages API"""
+
+    provider = "anthropic"
+
+    def __init__(self, model: str, route: ModelRoute):
+        super().__init__(model, route)
+        self._static = {"model": route.api_model, "max_tokens": route.max_tokens or 1024}
+
+    def endpoint(self, stream: bool) -> str:
+        return "/v1/messages"
+
+    def payload(self, messages: List[Dict[str, Any]], stream: bool) -> Dict[str, Any]:
+        data = dict(self._static)
+        claude_messages = []
+        for msg in messages:
+            # Системное сообщение передается отдельным полем
+            if msg["role"] == "system":
+                data.setdefault("system", msg["content"])
+            else:
+                claude_messages.append({"role": msg["role"], "content": msg["content"]})
+        data["messages"] = claude_messages
+        if stream:
+            data["stream"] = True
+        return data
+
+    def extract(self, response: Dict[str, Any]) -> Optional[str]:
+        usage = response.get("usage") or {}
+        record_tokens(usage.get("input_tokens"), usage.get("output_tokens"))
+        for content_item in response.get("content") or []:
+            if content_item.get("type") == "text":
+                return content_item.get("text")
+        return None
+
+    def stream_text(self, event: Dict[str, Any]) -> str:
+        event_type = event.get("type")
+        if event_type == "content_block_delta":
+            delta = event.get("delta") or {}
+            if delta.get("type") == "text_delta":
+                return delta.get("text", "")
+        elif event_type == "message_start":
+            usage = (event.get("message") or {}).get("usage") or {}
+            record_tokens(usage.get("input_tokens"), usage.get("output_tokens"))
+        elif event_type == "message_delta":
+            usage = event.get("usage") or {}
+            record_tokens(output_tokens=usage.get("output_tokens"))
+        elif event_type == "error":
+            raise RuntimeError((event.get("error") or {}).get("message", "stream error"))
+        return ""
+
+
+class GeminiAdapter(ProviderAdapter):
+    """Gemini generateContent / streamGenerateContent"""
+
+    provider = "google"
+
+    def __init__(self, model: str, route: ModelRoute):
+        super().__init__(model, route)
+        self._endpoint = f"/v1/models/{route.api_model}:generateContent"
+        self._stream_endpoint = f"/v1/models/{route.api_model}:streamGenerateContent?alt=sse"
+
+    def endpoint(self, stream: bool) -> str:
+        return self._stream_endpoint if stream else self._endpoint
+
+    def payload(self, messages: List[Dict[str, Any]], stream: bool) -> Dict[str, Any]:
+        system_contents = []
+        gemini_contents = []
+        for msg in messages:
+            if msg["role"] == "system":
+                # Системное сообщение передается как сообщение от модели
+                system_contents.append({"role": "model", "parts": [{"text": msg["content"]}]})
+            else:
+                role = "user" if msg["role"] == "user" else "model"
+                gemini_contents.append({"role": role, "parts": [{"text": msg["content"]}]})
+        return {"contents": system_contents[:1] + gemini_contents}
+
+    def _record_usage(self, response: Dict[str, Any]) -> None:
+        usage = response.get("usageMetadata")
+        if usage:
+            record_tokens(usage.get("promptTokenCount"), usage.get("candidatesTokenCount"))
+
+    def extract(self, response: Dict[str, Any]) -> Optional[str]:
+        self._record_usage(response)
+        candidates = response.get("candidates")
+        if not candidates:
+            return None
+        parts = (candidates[0].get("content") or {}).get("parts") or []
+        if parts and "text" in parts[0]:
+            return parts[0]["text"]
+        return None
+
+    def stream_text(self, event: Dict[str, Any]) -> str:
+        self._record_usage(event)
+        return "".join(
+            part.get("text", "")
+            for candidate in event.get("candidates") or []
+            for part in (candidate.get("content") or {}).get("parts") or []
+        )
+
+
+ADAPTER_TYPES = {
+    "openai": OpenAIAdapter,
+    "o1": O1Adapter,
+    "anthropic": ClaudeAdapter,
+    "google": GeminiAdapter,
+    "deepseek": DeepSeekAdapter,
+}
+
+# Реестр адаптеров по id модели, собирается один раз при импорте
+ADAPTERS: Dict[str, ProviderAdapter] = {
+    model: ADAPTER_TYPES[route.adapter](model, route)
+    for model, route in MODEL_ROUTES.items()
+}
+
+
+def get_adapter(model: str) -> ProviderAdapter:
+    """
+    Адаптер для модели. Модели не из MODEL_ROUTES, как и раньше,
+    отправляются в OpenAI с тем же именем; такой адаптер создается
+    на каждый запрос и не попадает в реестр, чтобы произвольные имена
+    моделей не накапливались в ADAPTERS.
+    """
+    adapter = ADAPTERS.get(model)
+    if adapter is None:
+        adapter = OpenAIAdapter(model, ModelRoute("openai", model))
+    return adapter
@@ -0,0 +1,278 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import AsyncIterator, Deque, Dict, List, Optional
+import asyncio
+import time
+
+
+class RateLimitExceeded(Exception):
+    """Очередь ожидания провайдера переполнена или ожидание превысило предел"""
+
+
+class ProviderBusy(Exception):
+    """
+    Провайдер ответил 429 или 503: запрос можно повторить после паузы.
+    retry_after - значение заголовка Retry-After в секундах или None.
+    """
+
+    def __init__(self, status_code: int, retry_after: Optional[float], text: str = ""):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.text = text
+
+
+class TokenBucket:
+    """
+    Ведро токенов с непрерывным пополнением: per_minute единиц в минуту,
+    емкость - минутный лимит. Баланс может уйти в минус, если фактический
+    расход оказался больше оценки; тогда следующие запросы подождут.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Сколько секунд ждать, пока в ведре наберется amount"""
+        self._refill(now)
+        # Запрос больше емкости ждет полного ведра, а не вечно
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= amount
+
+
+class Limiter:
+    """
+    Ограничитель одного провайдера или модели: не больше max_concurrent
+    запросов одновременно, rpm запросов и tpm токенов в минуту (0 - без
+    ограничения). Лишние запросы ждут в очереди не длиннее max_queue
+    и не дольше max_wait секунд, затем получают RateLimitExceeded.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int = 0,
+        rpm: int = 0,
+        tpm: int = 0,
+        max_queue: int = 100,
+        max_wait: float = 30.0,
+    ):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self.blocked_until = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self, tokens: int = 0, deadline: float = None) -> None:
+        """Занимает слот и списывает запрос и tokens из ведер"""
+        now = time.monotonic()
+        if deadline is None:
+            deadline = now + self.max_wait
+        if self.waiting >= self.max_queue:
+            raise RateLimitExceeded(f"{self.name}: очередь ожидания заполнена")
+
+        self.waiting += 1
+        try:
+            await self._acquire_slot(deadline)
+            try:
+                await self._wait_budget(tokens, deadline)
+            except BaseException:
+                self.release()
+                raise
+        finally:
+            self.waiting -= 1
+
+    async def _acquire_slot(self, deadline: float) -> None:
+        if not self.max_concurrent or (
+            self.in_flight < self.max_concurrent and not self._waiters
+        ):
+            self.in_flight += 1
+            return
+
+        # Слоты заняты: ждем своей очереди (FIFO), release передает слот
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise RateLimitExceeded(f"{self.name}: нет свободного слота") from None
+        except BaseException:
+            # Слот мог быть передан в момент отмены - возвращаем его
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    async def _wait_budget(self, tokens: int, deadline: float) -> None:
+        while True:
+            now = time.monotonic()
+            delay = max(
+                self.blocked_until - now,
+                self.requests.delay(1, now) if self.requests else 0.0,
+                self.tokens.delay(tokens, now) if self.tokens and tokens else 0.0,
+            )
+            if delay <= 0:
+                break
+            if now + delay > deadline:
+                raise RateLimitExceeded(
+                    f"{self.name}: лимит запросов, ожидание {delay:.1f} с"
+                )
+            await asyncio.sleep(delay)
+
+        if self.requests:
+            self.requests.consume(1, now)
+        if self.tokens and tokens:
+            self.tokens.consume(tokens, now)
+
+    def release(self) -> None:
+        """Освобождает слот: передает его первому ожидающему или уменьшает счетчик"""
+        if not self.max_concurrent:
+            self.in_flight -= 1
+            return
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def charge(self, tokens: int) -> None:
+        """Доплата (или возврат при отрицательном значении) токенов после ответа"""
+        if self.tokens and tokens:
+            self.tokens.consume(tokens, time.monotonic())
+
+    def backoff(self, seconds: float) -> None:
+        """Приостанавливает новые запросы на seconds секунд (Retry-After)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 3),
+        }
+
+
+class ProviderLimits:
+    """
+    Ограничители по провайдерам и, если для модели заданы свои лимиты,
+    по моделям. Запрос к такой модели занимает слот и в ограничителе
+    модели, и в ограничителе ее провайдера.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 0,
+        rpm: int = 0,
+        tpm: int = 0,
+        max_queue: int = 100,
+        max_wait: float = 30.0,
+        concurrency: Dict[str, int] = None,
+        rpm_overrides: Dict[str, int] = None,
+        tpm_overrides: Dict[str, int] = None,
+    ):
+        self.defaults = (max_concurrent, rpm, tpm)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.concurrency = concurrency or {}
+        self.rpm_overrides = rpm_overrides or {}
+        self.tpm_overrides = tpm_overrides or {}
+        self._limiters: Dict[str, Optional[Limiter]] = {}
+
+    def _create(self, name: str, model: bool) -> Optional[Limiter]:
+        overrides = (self.concurrency, self.rpm_overrides, self.tpm_overrides)
+        if model:
+            # Ограничитель модели нужен, только если ее лимиты заданы явно
+            if not any(name in values for values in overrides):
+                return None
+            max_concurrent, rpm, tpm = (values.get(name, 0) for values in overrides)
+        else:
+            max_concurrent, rpm, tpm = (
+                values.get(name, default)
+                for values, default in zip(overrides, self.defaults)
+            )
+        return Limiter(name, max_concurrent, rpm, tpm, self.max_queue, self.max_wait)
+
+    def limiters(self, provider: str, model: str) -> List[Limiter]:
+        """Ограничители запроса: сначала модели (если есть), затем провайдера"""
+        if model not in self._limiters:
+            self._limiters[model] = self._create(model, model=True)
+        if provider not in self._limiters:
+            self._limiters[provider] = self._create(provider, model=False)
+        return [
+            limiter
+            for limiter in (self._limiters[model], self._limiters[provider])
+            if limiter is not None
+        ]
+
+    @asynccontextmanager
+    async def acquire(
+        self, provider: str, model: str, tokens: int = 0
+    ) -> AsyncIterator[List[Limiter]]:
+        """Ждет слот и бюджет во всех ограничителях запроса и освобождает их по выходе"""
+        limiters = self.limiters(provider, model)
+        deadline = time.monotonic() + self.max_wait
+        acquired: List[Limiter] = []
+        try:
+            for limiter in limiters:
+                await limiter.acquire(tokens, deadline)
+                acquired.append(limiter)
+            yield acquired
+        finally:
+            for limiter in acquired:
+                limiter.release()
+
+    def backoff(self, provider: str, model: str, seconds: float) -> None:
+        """Retry-After относится к модели, если у нее свой ограничитель, иначе к провайдеру"""
+        self.limiters(provider, model)[0].backoff(seconds)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: limiter.stats()
+            for name, limiter in self._limiters.items()
+            if limiter is not None
+        }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Значение заголовка Retry-After в секундах (число секунд или HTTP-дата)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    """Грубая оценка входных токенов (около 4 символов на токен)"""
+    return sum(len(msg.get("content") or "") for msg in messages) // 4 + 4 * len(messages)
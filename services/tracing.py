@@ -0,0 +1,222 @@
+from aiogram import BaseMiddleware
+from config.config import get_config
+from contextvars import ContextVar
+from datetime import datetime
+from prometheus_client import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import functools
+import json
+import os
+import time
+import uuid
+
+config = get_config()
+
+TRACES = Counter(
+    "traces_total", "Трассировки обновлений: kept - медленные, сохранены", ["outcome"]
+)
+
+
+class Trace:
+    """Трассировка одного обновления: корневой интервал и вложенные spans"""
+
+    __slots__ = ("trace_id", "name", "attrs", "started_at", "started", "spans")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+
+
+# Текущая трассировка и текущий span (id) в контексте задачи asyncio
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_current_span: ContextVar[Optional[int]] = ContextVar("span", default=None)
+
+
+class span:
+    """
+    Интервал трассировки: with span("get_user_history", user_id=1): ...
+    Вне трассировки ничего не записывает.
+    """
+
+    __slots__ = ("name", "attrs", "trace", "span_id", "parent", "started", "token")
+
+    def __init__(self, name: str, **attrs: Any):
+        self.name = name
+        self.attrs = attrs
+        self.trace = _current_trace.get()
+
+    def __enter__(self) -> "span":
+        if self.trace is not None:
+            self.span_id = len(self.trace.spans)
+            self.parent = _current_span.get()
+            self.trace.spans.append(None)  # место под span в порядке начала
+            self.token = _current_span.set(self.span_id)
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.trace is None:
+            return
+        finished = time.perf_counter()
+        _current_span.reset(self.token)
+        record = {
+            "id": self.span_id,
+            "parent": self.parent,
+            "name": self.name,
+            "start_ms": round((self.started - self.trace.started) * 1000, 3),
+            "duration_ms": round((finished - self.started) * 1000, 3),
+        }
+        if self.attrs:
+            record["attrs"] = self.attrs
+        if exc is not None:
+            record["error"] = f"{type(exc).__name__}: {exc}"
+        self.trace.spans[self.span_id] = record
+
+
+def traced(name: str = None):
+    """Декоратор асинхронной функции: каждый вызов внутри трассировки - span"""
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return await func(*args, **kwargs)
+            with span(span_name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def current_trace_id() -> Optional[str]:
+    """Идентификатор текущей трассировки (для логов)"""
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+def _append_lines(path: str, lines: List[str]) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as trace_file:
+        trace_file.writelines(lines)
+
+
+class TraceRecorder:
+    """
+    Хвостовая выборка трассировок: решение принимается после завершения.
+    Трассировки дольше slow_ms сохраняются целиком (JSON lines в файл или
+    в коллекцию traces), быстрые только учитываются в счетчиках.
+    """
+
+    def __init__(self, slow_ms: float, export: str, path: str):
+        self.slow_ms = slow_ms
+        self.export = export
+        self.path = path
+        self.kept = 0
+        self.fast = 0
+        self._sink = None
+
+    def _collection_sink(self):
+        if self._sink is None:
+            from services.batch_sink import BatchSink
+            from services.logging import db, logs_bot
+
+            self._sink = BatchSink(
+                db["traces"], batch_size=50, name="traces", on_error=logs_bot
+            )
+        return self._sink
+
+    async def finish(self, trace: Trace, error: BaseException = None) -> None:
+        duration_ms = (time.perf_counter() - trace.started) * 1000
+        if duration_ms < self.slow_ms:
+            self.fast += 1
+            TRACES.labels("fast").inc()
+            return
+
+        self.kept += 1
+        TRACES.labels("kept").inc()
+        record = {
+            "trace_id": trace.trace_id,
+            "name": trace.name,
+            "started_at": trace.started_at,
+            "duration_ms": round(duration_ms, 3),
+            "attrs": trace.attrs,
+            "spans": [item for item in trace.spans if item is not None],
+        }
+        if error is not None:
+            record["error"] = f"{type(error).__name__}: {error}"
+
+        try:
+            if self.export == "mongo":
+                await self._collection_sink().put(record)
+            else:
+                line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+                await asyncio.to_thread(_append_lines, self.path, [line])
+        except Exception as e:
+            # Импорт здесь: services.logging сам импортирует этот модуль
+            from services.logging import logs_bot
+
+            await logs_bot("error", f"Trace export error: {str(e)}")
+
+    async def close(self) -> None:
+        if self._sink is not None:
+            await self._sink.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "slow_ms": self.slow_ms,
+            "export": self.export,
+            "kept": self.kept,
+            "fast": self.fast,
+        }
+
+
+recorder = TraceRecorder(
+    config.tracing.slow_ms, config.tracing.export, config.tracing.path
+)
+
+
+class TracingMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware aiogram: открывает трассировку на каждое обновление.
+    Все вызовы с @traced/span внутри обработчика (в том числе во вложенных
+    задачах asyncio) попадают в эту трассировку.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not config.tracing.enabled:
+            return await handler(event, data)
+
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        update = data.get("event_update")
+        user = data.get("event_from_user")
+        trace = Trace(
+            name,
+            {
+                "update_id": getattr(update, "update_id", None),
+                "chat_id": getattr(user, "id", None),
+            },
+        )
+        token = _current_trace.set(trace)
+        error = None
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _current_trace.reset(token)
+            await recorder.finish(trace, error)
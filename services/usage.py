@@ -0,0 +1,126 @@
+from contextvars import ContextVar
+from datetime import datetime
+from services.batch_sink import BatchSink
+from services.logging import logs_bot
+from typing import Any, Dict, Optional
+import time
+
+
+class UsageEvent:
+    """
+    Событие использования: один завершенный запрос к модели, TTS или STT.
+    Адаптеры провайдеров дополняют текущее событие временем до первого
+    байта и токенами из поля usage ответа (см. record_first_byte, record_tokens).
+    """
+
+    __slots__ = (
+        "kind",
+        "model",
+        "provider",
+        "started_at",
+        "started",
+        "ttfb",
+        "input_tokens",
+        "output_tokens",
+        "retries",
+    )
+
+    def __init__(self, kind: str, model: str, provider: str):
+        self.kind = kind
+        self.model = model
+        self.provider = provider
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.ttfb: Optional[float] = None
+        self.input_tokens: Optional[int] = None
+        self.output_tokens: Optional[int] = None
+        self.retries = 0
+
+    def to_document(self, outcome: str) -> Dict[str, Any]:
+        duration = time.perf_counter() - self.started
+        document = {
+            "kind": self.kind,
+            "model": self.model,
+            "provider": self.provider,
+            "created_at": self.started_at,
+            "duration": round(duration, 4),
+            "ttfb": round(self.ttfb, 4) if self.ttfb is not None else None,
+            "outcome": outcome,
+        }
+        if self.input_tokens is not None:
+            document["input_tokens"] = self.input_tokens
+        if self.output_tokens is not None:
+            document["output_tokens"] = self.output_tokens
+        if self.retries:
+            document["retries"] = self.retries
+        return document
+
+
+# Событие запроса, выполняемого в текущей задаче asyncio
+_current_event: ContextVar[Optional[UsageEvent]] = ContextVar("usage_event", default=None)
+
+_sink: Optional[BatchSink] = None
+
+
+def _usage_sink() -> BatchSink:
+    global _sink
+    if _sink is None:
+        from database.settingsdata import db
+
+        _sink = BatchSink(
+            db["UsageEvents"], batch_size=100, name="usage", on_error=logs_bot
+        )
+    return _sink
+
+
+def start_usage(kind: str, model: str, provider: str) -> UsageEvent:
+    """Открывает событие для запроса в текущей задаче (kind: chat, tts, stt)"""
+    event = UsageEvent(kind, model, provider)
+    _current_event.set(event)
+    return event
+
+
+def record_first_byte(seconds: float = None) -> None:
+    """
+    Отмечает время до первого байта ответа текущего запроса.
+    seconds - готовое значение (например, response.elapsed), иначе
+    считается от начала события.
+    """
+    event = _current_event.get()
+    if event is None or event.ttfb is not None:
+        return
+    event.ttfb = seconds if seconds is not None else time.perf_counter() - event.started
+
+
+def record_tokens(input_tokens: Any = None, output_tokens: Any = None) -> None:
+    """Сохраняет число токенов из поля usage ответа провайдера"""
+    event = _current_event.get()
+    if event is None:
+        return
+    if input_tokens is not None:
+        event.input_tokens = int(input_tokens)
+    if output_tokens is not None:
+        event.output_tokens = int(output_tokens)
+
+
+def record_retry() -> None:
+    """Учитывает повтор запроса текущего события (ответ 429/503)"""
+    event = _current_event.get()
+    if event is not None:
+        event.retries += 1
+
+
+async def finish_usage(event: UsageEvent, ok: bool) -> None:
+    """Закрывает событие и ставит его в пакетную запись в UsageEvents"""
+    if _current_event.get() is event:
+        _current_event.set(None)
+    try:
+        await _usage_sink().put(event.to_document("ok" if ok else "error"))
+    except Exception as e:
+        await logs_bot("error", f"Usage event error: {str(e)}")
+
+
+async def close_usage() -> None:
+    """Дописывает накопленные события; вызывается при остановке бота"""
+    if _sink is not None:
+        await _sink.close()